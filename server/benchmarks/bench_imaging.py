@@ -0,0 +1,380 @@
+"""
+This script benchmarks the image-processing primitives of the server
+over a matrix of image sizes.
+
+Each benchmark is run on RGB images of the given sizes in megapixels and
+reports the throughput in megapixels per second and the peak memory
+allocated by a single run. The results can be stored as a baseline and
+later runs compared with it: the script fails if the throughput drops
+or the peak memory grows by more than the threshold.
+
+Usage:
+    python -m benchmarks.bench_imaging --sizes 1 4 16 --output bench.json
+    python -m benchmarks.bench_imaging --baseline bench.json --threshold 0.15
+
+A benchmark is added by decorating a function with `@benchmark(name)`.
+The function receives the image as an RGB array and a scratch folder,
+and returns the callable to be timed.
+"""
+
+import argparse
+import atexit
+import base64
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+
+import numpy as np
+from PIL import Image
+
+from server import imaging
+from server.imaging.shared import SharedArrayPool
+from server.security import EncryptedStorage, XOREncryptor
+from server.services.editor_management import EditorManager, MAX_FILTER_VALUES
+from server.services.scanner_management import ScannerManager
+
+# the benchmarks mapped to their names
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Decorator to register a benchmark."""
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def create_image(megapixels: float, seed: int = 0) -> np.ndarray:
+    """Create an RGB test image of the given size with a 4:3 aspect ratio.
+
+    The image is a smooth gradient with noise, which resembles
+    a photograph more than uniform noise does.
+    """
+
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    width = int(round(megapixels * 1e6 / height))
+
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0, 200, height, dtype = np.float32)[:, None, None]
+    cols = np.linspace(0, 55, width, dtype = np.float32)[None, :, None]
+    noise = rng.normal(0, 8, (height, width, 3)).astype(np.float32)
+
+    return np.clip(rows + cols + noise, 0, 255).astype(np.uint8)
+
+
+# ====== benchmarks ======
+@benchmark("decode_image")
+def bench_decode_image(image: np.ndarray, tmp_dir: str):
+    manager = EditorManager()
+    content = "data:image/png;base64," + base64.b64encode(image.tobytes()).decode("ascii")
+
+    return lambda: manager.decode_image(content)
+
+
+@benchmark("save_file")
+def bench_save_file(image: np.ndarray, tmp_dir: str):
+    manager = EditorManager()
+    data = image.tobytes()
+
+    return lambda: manager.save_file(tmp_dir, "image.png", data)
+
+
+@benchmark("save_file_encrypted")
+def bench_save_file_encrypted(image: np.ndarray, tmp_dir: str):
+    manager = EditorManager(EncryptedStorage(XOREncryptor("benchmark_key")))
+    data = image.tobytes()
+
+    return lambda: manager.save_file(tmp_dir, "image.png", data)
+
+
+@benchmark("read_file_encrypted")
+def bench_read_file_encrypted(image: np.ndarray, tmp_dir: str):
+    manager = EditorManager(EncryptedStorage(XOREncryptor("benchmark_key")))
+    path = manager.save_file(tmp_dir, "image.png", image.tobytes())
+
+    return lambda: manager.read_file(path)
+
+
+@benchmark("xor_encrypt")
+def bench_xor_encrypt(image: np.ndarray, tmp_dir: str):
+    encryptor = XOREncryptor("benchmark_key")
+    data = image.tobytes()
+
+    return lambda: encryptor.encrypt(data)
+
+
+@benchmark("encrypt_stream")
+def bench_encrypt_stream(image: np.ndarray, tmp_dir: str):
+    encryptor = XOREncryptor("benchmark_key")
+    data = image.tobytes()
+
+    return lambda: encryptor.encrypt_stream(io.BytesIO(data), io.BytesIO())
+
+
+@benchmark("box_blur")
+def bench_box_blur(image: np.ndarray, tmp_dir: str):
+    return lambda: imaging.box_blur(image, 8)
+
+
+@benchmark("gaussian_blur")
+def bench_gaussian_blur(image: np.ndarray, tmp_dir: str):
+    return lambda: imaging.gaussian_blur(image, 4.0)
+
+
+@benchmark("convolve_fft")
+def bench_convolve_fft(image: np.ndarray, tmp_dir: str):
+    kernel = np.ones((31, 31), dtype = np.float32) / 31 ** 2
+    page = image[..., 0]
+
+    return lambda: imaging.convolve_fft(page, kernel)
+
+
+# a typical value of each filter preset of `EditorManager.apply_filter`
+FILTER_VALUES = {
+    'blur_box': 8,
+    'blur_gaussian': 4.0,
+    'sharpen': 1.0
+}
+
+
+def register_filter(name: str) -> None:
+    """Register the benchmark of a filter preset, which includes
+    decoding and encoding the image as a request does."""
+
+    value = FILTER_VALUES[name]
+
+    @benchmark(f"apply_filter_{name}")
+    def bench_apply_filter(image: np.ndarray, tmp_dir: str):
+        manager = EditorManager()
+        stream = io.BytesIO()
+        Image.fromarray(image).save(stream, format = "PNG", compress_level = 1)
+        data = stream.getvalue()
+
+        return lambda: manager.apply_filter(data, name, value)
+
+
+# every preset accepted by the editor has a benchmark
+for filter_name in MAX_FILTER_VALUES:
+    register_filter(filter_name)
+
+
+@benchmark("scan_page")
+def bench_scan_page(image: np.ndarray, tmp_dir: str):
+    manager = ScannerManager()
+
+    # a bright page on the darker image, stored as a phone camera would
+    height, width = image.shape[:2]
+    photo = image // 4
+    photo[height // 10:height * 9 // 10, width // 8:width * 7 // 8] += 180
+    stream = io.BytesIO()
+    Image.fromarray(photo).save(stream, format = "JPEG", quality = 90)
+    data = stream.getvalue()
+
+    return lambda: manager.scan(data)
+
+
+@benchmark("adaptive_threshold")
+def bench_adaptive_threshold(image: np.ndarray, tmp_dir: str):
+    manager = ScannerManager()
+    page = image.mean(axis = 2).astype(np.uint8)
+
+    return lambda: manager.adaptive_threshold(page)
+
+
+
+@benchmark("estimate_skew")
+def bench_estimate_skew(image: np.ndarray, tmp_dir: str):
+    manager = ScannerManager()
+
+    # dark lines of text on the brighter image, slightly rotated
+    page = image.mean(axis = 2).astype(np.uint8) // 2 + 120
+    page[::40] = 20
+    page[1::40] = 20
+    page = np.asarray(Image.fromarray(page).rotate(2.0, fillcolor = 200))
+
+    return lambda: manager.estimate_skew(page)
+
+
+@benchmark("whiten_page")
+def bench_whiten_page(image: np.ndarray, tmp_dir: str):
+    manager = ScannerManager()
+
+    # a yellowish page with red lines of a form
+    page = image // 8 + np.array([200, 190, 140], dtype = np.uint8)
+    page[::30] = [220, 60, 60]
+
+    return lambda: manager.whiten_page(page, [(330, 30)])
+
+
+@benchmark("stitch")
+def bench_stitch(image: np.ndarray, tmp_dir: str):
+    manager = ScannerManager()
+
+    # 3 x 2 tiles of the image overlapping by a fifth
+    height, width = image.shape[:2]
+    tile_height, tile_width = height * 3 // 5, width * 2 // 5
+    tiles = []
+    for top in (0, height - tile_height):
+        for left in (0, (width - tile_width) // 2, width - tile_width):
+            stream = io.BytesIO()
+            Image.fromarray(image[top:top + tile_height, left:left + tile_width]).save(
+                stream, format = "PNG", compress_level = 1)
+            tiles.append(stream.getvalue())
+
+    return lambda: manager.stitch(tiles, join(tmp_dir, "canvas.npy"), color = True)
+
+
+@benchmark("pickle_pixels")
+def bench_pickle_pixels(image: np.ndarray, tmp_dir: str):
+    # the image sent to a worker process and the result sent back
+    def run():
+        for _ in range(2):
+            pickle.loads(pickle.dumps(image, protocol = pickle.HIGHEST_PROTOCOL))
+
+    return run
+
+
+@benchmark("share_pixels")
+def bench_share_pixels(image: np.ndarray, tmp_dir: str):
+    pool = SharedArrayPool()
+    atexit.register(pool.close)
+
+    # the image copied to shared memory and the handles
+    # of the image and of the result passed instead
+    def run():
+        source = pool.share(image)
+        target = pool.allocate(image.shape)
+
+        for handle in (source, target):
+            pickle.loads(pickle.dumps(handle)).open()
+            pool.release(handle)
+
+    return run
+
+# ====== runner ======
+def measure(func, repeat: int) -> float:
+    """Return the best time in seconds of the repeated function calls."""
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def measure_peak_memory(func) -> int:
+    """Return the peak memory in bytes allocated by a function call."""
+
+    tracemalloc.start()
+
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(names: list[str], sizes: list[float], repeat: int) -> dict:
+    """Run the benchmarks and return the results mapped to
+    the keys '<benchmark>@<size>MP'."""
+
+    results = {}
+
+    for size in sizes:
+        image = create_image(size)
+        megapixels = image.shape[0] * image.shape[1] / 1e6
+
+        for name in names:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                func = BENCHMARKS[name](image, tmp_dir)
+                func() # warm up
+                elapsed = measure(func, repeat)
+                peak = measure_peak_memory(func)
+
+            key = f"{name}@{size:g}MP"
+            results[key] = {
+                "megapixels": megapixels,
+                "seconds": elapsed,
+                "mp_per_sec": megapixels / elapsed,
+                "peak_memory_mb": peak / 2 ** 20
+            }
+            print(
+                f"{key:>36}: {megapixels / elapsed:9.1f} MP/s  "
+                f"{elapsed * 1000:9.2f} ms  peak {peak / 2 ** 20:8.1f} MB"
+            )
+
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compare the results with the baseline and describe the regressions."""
+
+    regressions = []
+
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+
+        if result["mp_per_sec"] < base["mp_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{key}: {result['mp_per_sec']:.1f} MP/s, "
+                f"baseline {base['mp_per_sec']:.1f} MP/s")
+
+        # small allocations vary too much to be compared
+        if (result["peak_memory_mb"] > base["peak_memory_mb"] * (1 + threshold) and
+            result["peak_memory_mb"] - base["peak_memory_mb"] > 1.0):
+            regressions.append(
+                f"{key}: peak {result['peak_memory_mb']:.1f} MB, "
+                f"baseline {base['peak_memory_mb']:.1f} MB")
+
+    return regressions
+
+
+def main() -> int:
+    """Parse the command line and run the benchmarks."""
+
+    parser = argparse.ArgumentParser(description = "Image-processing microbenchmarks.")
+    parser.add_argument("--sizes", type = float, nargs = "+", default = [1, 4, 16],
+                        help = "Image sizes in megapixels, up to 100.")
+    parser.add_argument("--only", nargs = "+", choices = sorted(BENCHMARKS),
+                        help = "Run only the listed benchmarks.")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--output", help = "JSON file the results are written to.")
+    parser.add_argument("--baseline", help = "JSON results to compare with.")
+    parser.add_argument("--threshold", type = float, default = 0.15,
+                        help = "Relative change considered a regression.")
+    args = parser.parse_args()
+
+    results = run(args.only or list(BENCHMARKS), args.sizes, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding = "utf-8") as stream:
+            json.dump(results, stream, indent = 2)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, encoding = "utf-8") as stream:
+        regressions = find_regressions(results, json.load(stream), args.threshold)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file = sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+This script measures the cold start time of the server: the import of the
+application package, the creation of the application and the first request.
+Each run is done in a new interpreter process.
+
+Usage:
+    python -m benchmarks.bench_startup --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# runs in the child process, prints the timings as JSON
+PROBE = """
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+app = server.create_app({"LOG_CONFIG_PATH": None, "SESSION_DB_URL": %r})
+created = time.perf_counter()
+response = app.test_client().get("/about")
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "first request": served - created,
+    "total": served - start
+}))
+"""
+
+
+def run_once(session_db_url: str) -> dict:
+    """Start the server in a new process and return the timings."""
+
+    env = dict(os.environ, SECRET_KEY = os.getenv("SECRET_KEY", "benchmark_key"))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE % session_db_url],
+        env = env, capture_output = True, text = True, check = True
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+
+    parser = argparse.ArgumentParser(description = "Server cold start benchmark.")
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = "sqlite:///" + os.path.join(tmp_dir, "sessions.db")
+        runs = [run_once(url) for _ in range(args.repeat)]
+
+    for name in runs[0]:
+        best = min(run[name] for run in runs)
+        print(f"{name:>13}: {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+This script compares the throughput of the encrypted file storage
+with plain file I/O.
+
+Usage:
+    python -m benchmarks.bench_storage --size-mb 50 --repeat 5
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+from os.path import join
+
+from server.security import EncryptedStorage, XOREncryptor
+
+
+def measure(func, repeat: int) -> float:
+    """Return the best time in seconds of the repeated function calls."""
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+
+    parser = argparse.ArgumentParser(description = "Encrypted storage benchmark.")
+    parser.add_argument("--size-mb", type = int, default = 50)
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--block-kb", type = int, default = 1024)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    storage = EncryptedStorage(XOREncryptor("benchmark_key"), args.block_kb * 1024)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain_path = join(tmp_dir, "plain.bin")
+        encr_path = join(tmp_dir, "encrypted.bin")
+
+        def write_plain():
+            with open(plain_path, "wb") as file:
+                file.write(data)
+
+        def read_plain():
+            with open(plain_path, "rb") as file:
+                file.read()
+
+        def write_encrypted():
+            storage.write(encr_path, io.BytesIO(data))
+
+        def read_encrypted():
+            storage.read(encr_path, io.BytesIO())
+
+        def read_encrypted_range():
+            storage.read_range(encr_path, len(data) // 2, 65536)
+
+        results = {
+            "plain write": measure(write_plain, args.repeat),
+            "encrypted write": measure(write_encrypted, args.repeat),
+            "plain read": measure(read_plain, args.repeat),
+            "encrypted read": measure(read_encrypted, args.repeat),
+        }
+        range_time = measure(read_encrypted_range, args.repeat)
+
+    for name, elapsed in results.items():
+        print(f"{name:>16}: {args.size_mb / elapsed:8.1f} MB/s")
+
+    print(f"{'64 kB range read':>16}: {range_time * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
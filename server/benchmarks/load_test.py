@@ -0,0 +1,350 @@
+"""
+This script load-tests the authentication and upload endpoints.
+
+The application is started in-process on a local HTTP server, backed by
+an SQLite database standing in for PostgreSQL, so no database server is
+needed. Each scenario sends a fixed number of requests from concurrent
+clients and the throughput and the latency percentiles are reported.
+
+The scenarios run in order, each one using the accounts created by the
+previous ones:
+    register      POST /register with new accounts
+    login         POST /login with the registered accounts
+    authenticate  GET /authenticate with the issued tokens
+    upload_<N>kB  POST /upload_image with an N kB image
+
+Usage:
+    python -m benchmarks.load_test --requests 500 --concurrency 8 \
+        --payload-kb 64 1024 --output load_test.json
+
+The results written to the output file can be compared between commits
+with the --baseline option, which prints the relative changes.
+"""
+
+import argparse
+import base64
+import datetime as dt
+import http.client
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+import sqlalchemy as sqal
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from server import create_app
+
+
+def create_users_table(url: str) -> None:
+    """Create the users table in the stand-in database."""
+
+    engine = sqal.create_engine(url)
+    sqal.Table(
+        "users", sqal.MetaData(),
+        sqal.Column("user_id", sqal.Integer, primary_key = True),
+        sqal.Column("user_name", sqal.String(24), unique = True, nullable = False),
+        sqal.Column("user_email", sqal.String(256), unique = True, nullable = False),
+        sqal.Column("user_password", sqal.String(256), nullable = False),
+        sqal.Column("user_token", sqal.String(512)),
+        sqal.Column("user_registration_date", sqal.DateTime),
+        sqal.Column("user_active", sqal.Boolean, server_default = sqal.true()),
+        sqal.Column("user_locked_until", sqal.DateTime),
+        sqal.Column("user_deleted_at", sqal.DateTime)
+    ).create(engine)
+    engine.dispose()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Does not log the requests, which would slow down the server."""
+
+    def log_request(self, *args, **kwargs) -> None:
+        pass
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Return the percentile of the sorted values (nearest rank)."""
+
+    if len(values) == 0:
+        return float("nan")
+
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+
+    return values[rank]
+
+
+class Client:
+    """Sends requests to the server, one connection per request."""
+
+    def __init__(self, host: str, port: int) -> None:
+        self._host = host
+        self._port = port
+
+    def send(
+        self, method: str, path: str, body: bytes = None,
+        headers: dict = None) -> http.client.HTTPResponse:
+        """Send a request and return the response with the body read."""
+
+        conn = http.client.HTTPConnection(self._host, self._port, timeout = 60)
+
+        try:
+            conn.request(method, path, body = body, headers = headers or {})
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+
+        return response
+
+
+def run_scenario(name: str, requests: list, concurrency: int) -> dict:
+    """Send the requests from concurrent clients and return the statistics.
+
+    Parameters:
+    -----------
+    name:
+    The scenario name.
+
+    requests:
+    Callables sending a single request each and returning `True`
+    if the response is as expected.
+
+    concurrency:
+    The number of concurrent clients.
+
+    Returns:
+    --------
+    The number of requests and errors, the throughput
+    and the latency percentiles in milliseconds.
+    """
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(request) -> None:
+        nonlocal errors
+
+        start = time.perf_counter()
+        try:
+            ok = request()
+        except (OSError, http.client.HTTPException):
+            ok = False
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(run, requests))
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / wall_time,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else float("nan")
+    }
+
+    print(
+        f"{name:>16}: {result['throughput']:8.1f} req/s  "
+        f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  "
+        f"p99 {result['p99_ms']:7.1f} ms  errors {errors}"
+    )
+
+    return result
+
+
+def run_load_test(args: argparse.Namespace, tmp_dir: str) -> dict:
+    """Start the server and run all scenarios."""
+
+    db_url = "sqlite:///" + join(tmp_dir, "users.db")
+    create_users_table(db_url)
+    os.makedirs(join(tmp_dir, "users"))
+
+    app = create_app({
+        "SECRET_KEY": "load-test",
+        "LOG_CONFIG_PATH": None,
+        "SESSION_DB_URL": "sqlite:///" + join(tmp_dir, "sessions.db"),
+        "DB_URL": db_url,
+        "DB_SCHEMA": None,
+        "DB_ENGINE_OPTIONS": {"connect_args": {"check_same_thread": False}},
+        "DATA_STORAGE": join(tmp_dir, "users"),
+        "RECLAIM_DIR": join(tmp_dir, "reclaim"),
+        "HASH_TARGET_LATENCY": args.hash_latency,
+        "HASH_POOL_WORKERS": args.hash_workers,
+        "HASH_POOL_MAX_PENDING": max(16, args.concurrency * 2),
+        # the login attempts are limited per server, not per account,
+        # so the limit would reject all but the first few logins
+        "LOGIN_MAX_TRIES": 0
+    })
+
+    server = make_server(
+        "127.0.0.1", 0, app, threaded = True, request_handler = QuietRequestHandler)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    client = Client("127.0.0.1", server.server_port)
+    form_headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    accounts = [
+        (f"loaduser{idx:06d}", f"loaduser{idx:06d}@example.com", f"Password{idx:06d}")
+        for idx in range(args.requests)
+    ]
+    tokens = [None] * len(accounts)
+    results = {}
+
+    def register(idx: int):
+        def send() -> bool:
+            name, email, password = accounts[idx]
+            response = client.send("POST", "/register", urllib.parse.urlencode({
+                "username": name, "email": email, "password": password
+            }).encode(), form_headers)
+            cookie = response.getheader("Set-Cookie", "")
+            for part in cookie.split(","):
+                if part.strip().startswith("auth_token="):
+                    tokens[idx] = part.strip().split(";")[0].split("=", 1)[1]
+            return response.status == 302
+        return send
+
+    def login(idx: int):
+        def send() -> bool:
+            name, _, password = accounts[idx]
+            response = client.send("POST", "/login", urllib.parse.urlencode({
+                "username": name, "password": password
+            }).encode(), form_headers)
+            return response.status == 302
+        return send
+
+    def authenticate(idx: int):
+        def send() -> bool:
+            response = client.send("GET", "/authenticate", headers = {
+                "Authorization": f"Bearer {tokens[idx]}"
+            })
+            return response.status == 200
+        return send
+
+    def upload(idx: int, body: bytes):
+        def send() -> bool:
+            response = client.send("POST", "/upload_image", body, {
+                "Content-Type": "application/json"
+            })
+            return response.status == 200
+        return send
+
+    try:
+        # warm up: the lazily created services are created now
+        app_services = app.extensions["services"]
+        app_services.user_manager
+        app_services.editor_manager
+
+        indices = range(len(accounts))
+        results["register"] = run_scenario(
+            "register", [register(idx) for idx in indices], args.concurrency)
+        results["login"] = run_scenario(
+            "login", [login(idx) for idx in indices], args.concurrency)
+        results["authenticate"] = run_scenario(
+            "authenticate", [authenticate(idx) for idx in indices], args.concurrency)
+
+        for size_kb in args.payload_kb:
+            image = base64.b64encode(os.urandom(size_kb * 1024)).decode("ascii")
+            body = json.dumps({
+                "content": "data:image/png;base64," + image,
+                "filename": f"load_test_{size_kb}kB.png"
+            }).encode()
+            name = f"upload_{size_kb}kB"
+            results[name] = run_scenario(
+                name, [upload(idx, body) for idx in indices], args.concurrency)
+    finally:
+        server.shutdown()
+        app.extensions["services"].shutdown()
+
+    return results
+
+
+def get_commit() -> str|None:
+    """Return the current git commit or None outside of a repository."""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output = True, text = True, check = True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    """Print the changes of the results relative to a baseline."""
+
+    with open(baseline_path, encoding = "utf-8") as stream:
+        baseline = json.load(stream)["scenarios"]
+
+    print(f"\nChanges relative to: {baseline_path}")
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base = baseline[name]
+        changes = "  ".join(
+            f"{key} {(result[key] / base[key] - 1) * 100:+6.1f}%"
+            for key in ("throughput", "p50_ms", "p95_ms", "p99_ms")
+            if base[key]
+        )
+        print(f"{name:>16}: {changes}")
+
+
+def main() -> None:
+    """Parse the command line and run the load test."""
+
+    parser = argparse.ArgumentParser(description = "Authentication and upload load test.")
+    parser.add_argument("--requests", type = int, default = 200,
+                        help = "Number of requests per scenario.")
+    parser.add_argument("--concurrency", type = int, default = 8,
+                        help = "Number of concurrent clients.")
+    parser.add_argument("--payload-kb", type = int, nargs = "+", default = [64, 1024],
+                        help = "Sizes of the uploaded images in kB.")
+    parser.add_argument("--hash-latency", type = float, default = 0.01,
+                        help = "Target time of a password hash computation in seconds.")
+    parser.add_argument("--hash-workers", type = int, default = os.cpu_count() or 1,
+                        help = "Number of password hashing processes.")
+    parser.add_argument("--output", default = "load_test.json",
+                        help = "JSON file the results are written to.")
+    parser.add_argument("--baseline", help = "JSON results of a previous run to compare with.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_load_test(args, tmp_dir)
+
+    report = {
+        "time": dt.datetime.now().isoformat(),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "scenarios": results
+    }
+
+    with open(args.output, "w", encoding = "utf-8") as stream:
+        json.dump(report, stream, indent = 2)
+
+    print(f"\nResults written to: {args.output}")
+
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+This script runs batch user administration commands.
+
+Usage:
+    python manage_users.py import users.csv --report report.csv
+    python manage_users.py deactivate users.jsonl --report report.jsonl
+    python manage_users.py delete users.csv --report report.csv
+    python manage_users.py migrate
+
+The 'migrate' command adds the columns missing in a users table created
+by an earlier version of the server. Run it before deleting users.
+
+The input file is either a CSV file with a header row or a JSONL file
+with one JSON object per line. The 'import' command expects the fields
+'name', 'email' and 'password', the other commands the field 'user_id'.
+
+The report contains one result row per input row in the input order.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from os.path import join, dirname, splitext
+from functools import partial
+
+from werkzeug.security import generate_password_hash
+
+from server.database import Database
+from server.security import (
+    Credentials, XOREncryptor,
+    Authenticator, HS256Algorithm,
+    PasswordHasher
+)
+from server.services.user_management import UserManager
+
+REPORT_FIELDS = ["row", "user_id", "user_name", "status", "error"]
+
+
+def read_rows(file_path: str) -> list[dict]:
+    """Read the input rows from a CSV or JSONL file."""
+
+    ext = splitext(file_path)[1].lower()
+
+    with open(file_path, encoding = "utf-8", newline = "") as stream:
+        if ext == ".csv":
+            return list(csv.DictReader(stream))
+
+        if ext == ".jsonl":
+            return [json.loads(line) for line in stream if line.strip()]
+
+    raise ValueError(f"Unsupported input file format: '{ext}'")
+
+
+def write_report(file_path: str, results: list[dict]) -> None:
+    """Write the per-row results into a CSV or JSONL file."""
+
+    ext = splitext(file_path)[1].lower()
+    rows = [{"row": idx + 1, **result} for idx, result in enumerate(results)]
+
+    with open(file_path, "w", encoding = "utf-8", newline = "") as stream:
+        if ext == ".csv":
+            writer = csv.DictWriter(stream, fieldnames = REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        elif ext == ".jsonl":
+            for row in rows:
+                stream.write(json.dumps(row) + "\n")
+        else:
+            raise ValueError(f"Unsupported report file format: '{ext}'")
+
+
+def create_user_manager(hasher: PasswordHasher|None) -> UserManager:
+    """Connect to the database and create the user manager."""
+
+    credentials_dir = os.getenv('PostgresDbCredentials')
+    credentials_path = os.path.join(credentials_dir, 'credentials.enc')
+    credentials = Credentials(XOREncryptor('my_secret_key')).load(credentials_path)
+
+    database = Database(
+        host = 'localhost',
+        port = 5432,
+        db_name = 'postgres',
+        user_name = credentials['user'],
+        password = credentials['password'],
+        debug = False
+    )
+
+    return UserManager(
+        db = database,
+        table = "users",
+        schema = "public",
+        uid_column = "user_id",
+        auth = Authenticator("some_secret_key", HS256Algorithm),
+        max_login_tries = 3,
+        login_wnd = 1,
+        login_lock_wnd = 60,
+        hasher = hasher
+    )
+
+
+def main() -> int:
+    """Parse the command line and run the command."""
+
+    parser = argparse.ArgumentParser(description = "Batch user administration.")
+    parser.add_argument("command", choices = ["import", "deactivate", "delete", "migrate"])
+    parser.add_argument("input", nargs = "?", help = "CSV or JSONL file with the users.")
+    parser.add_argument("--report", help = "CSV or JSONL result report.")
+    parser.add_argument("--batch-size", type = int, default = 1000)
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        added = create_user_manager(None).upgrade_users_table()
+        print(f"Added columns: {', '.join(added)}" if added else "The users table is up to date.")
+        return 0
+
+    if args.input is None or args.report is None:
+        parser.error(f"the '{args.command}' command requires the input file and --report")
+
+    rows = read_rows(args.input)
+    data_storage = join(dirname(__file__), "server", "data", "users")
+
+    hasher = PasswordHasher(max_workers = args.workers, max_pending = args.workers)
+    hasher.calibrate(float(os.getenv('HASH_TARGET_LATENCY', '0.25')))
+    manager = create_user_manager(hasher)
+
+    start = time.perf_counter()
+
+    try:
+        if args.command == "import":
+            results = manager.register_users(
+                rows, partial(generate_password_hash, method = hasher.method),
+                data_storage, args.batch_size, args.workers
+            )
+        elif args.command == "deactivate":
+            results = manager.deactivate_users(
+                [int(row["user_id"]) for row in rows], args.batch_size)
+        else:
+            results = manager.delete_users(
+                [int(row["user_id"]) for row in rows], data_storage,
+                args.batch_size, args.workers
+            )
+    finally:
+        hasher.shutdown()
+
+    write_report(args.report, results)
+
+    failed = sum(result["status"] != "ok" for result in results)
+    print(
+        f"Processed {len(results)} rows in {time.perf_counter() - start:.1f} s: "
+        f"{len(results) - failed} succeeded, {failed} failed."
+    )
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,9 @@ This script runs the server application using a development server.
 """
 
 from os import environ
-from server import app
+from server import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
     HOST = environ.get('SERVER_HOST', 'localhost')
@@ -49,120 +49,745 @@ with an appropriate error message and take necessary security measures:
 """
 
 # python-builtin modules
+import base64
 import datetime as dt
-from logging import config, getLogger, FileHandler
+import json
+from logging import config, getLogger
 import os
+import threading
+import time
+import weakref
 from os.path import join, dirname
 from datetime import datetime
-from http.client import UNAUTHORIZED, INTERNAL_SERVER_ERROR
-from functools import wraps
+from http.client import (
+    UNAUTHORIZED, INTERNAL_SERVER_ERROR,
+    SERVICE_UNAVAILABLE, FORBIDDEN
+)
+from functools import wraps, partial
+from typing import Callable
 
 # third-party modules
 import yaml
 from flask import (
     Flask, redirect, render_template,
     request, session, make_response,
-    url_for
+    url_for, current_app, g, jsonify, send_file,
+    Response, stream_with_context
 )
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash as gen_hash_func
+from werkzeug.security import generate_password_hash
 from werkzeug.security import check_password_hash as chk_hash_func
+from werkzeug.utils import secure_filename
 
 # local custom modules
 from server.security import (
-    Credentials, XOREncryptor,
-    Authenticator, HS256Algorithm
+    Credentials, CredentialsWatcher, XOREncryptor,
+    Authenticator, HS256Algorithm,
+    PasswordHasher, EncryptedStorage
 )
 from server.database import Database
 from server.services.user_management import (
     UserManager, InvalidPasswordError,
     InvalidEmailError, InvalidUsernameError,
     UserAlreadyExistsError, DatabaseError,
-    FolderCreationError, MaxLoginAttemptsExceededError
+    FolderCreationError, MaxLoginAttemptsExceededError,
+    ServiceBusyError
 )
 
 from server.services.editor_management import (
-    EditorManager, InvalidImageFormatError
+    EditorManager, InvalidImageFormatError, InvalidFilterError
+)
+from server.services.scanner_management import (
+    ScannerManager, InvalidImageError, InvalidScanModeError, InvalidDropoutError
+)
+from server.services.document_management import (
+    DocumentManager, DocumentNotFoundError, DocumentStateError,
+    InvalidDocumentFormatError, InvalidPageFilterError
 )
+from server.services.job_management import (
+    JobManager, SQLJobStore, JobNotFoundError, InvalidJobKindError,
+    FINISHED_STATUSES, PIXEL_JOB_KINDS
+)
+from server.services.storage_management import FolderReclaimer
+from server.sessions import ServerSessionInterface, SQLSessionBackend
+from server.logger import LoggingPipeline, BatchFileHandler
+from server.monitoring import MetricsRegistry, CONTENT_TYPE, instrument
+from server.monitoring.profiling import RequestProfiler
+from server.monitoring.memory import MemoryTracker
 
-# ==== initialize the logging system ====
-log_tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-log_path = f"logs/runtime/server_{log_tag}.log"
-log_cfg_path = "logconfig.yaml"
+log = getLogger("master")
 
-with open(log_cfg_path, encoding = "utf-8") as fs:
-    log_config = yaml.safe_load(fs.read())
+# the logging pipeline of the process, created by the application factory
+_logging_pipeline = None
+
+# views registered with the application by the application factory
+_views = []
+
+# the service containers to be reset in a child process after a fork
+_live_services = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    """Reset the service containers inherited from the parent process."""
+
+    for services in list(_live_services):
+        services.after_fork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _after_fork_in_child)
+
+
+# ==== configuration ====
+def default_config() -> dict:
+    """Return the default configuration read from the environment variables."""
+
+    root = dirname(__file__)
+    credentials_dir = os.getenv('PostgresDbCredentials')
+
+    return {
+        "SECRET_KEY": os.getenv('SECRET_KEY'),
+        "LOG_CONFIG_PATH": "logconfig.yaml",
+        "LOG_DIR": "logs/runtime",
+        "LOG_QUEUE_SIZE": int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+        "LOG_BATCH_SIZE": int(os.getenv('LOG_BATCH_SIZE', '256')),
+        "PROFILE_DIR": "logs/profiles",
+        "PROFILE_SAMPLE_RATE": float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+        "PROFILE_TOKEN": os.getenv('PROFILE_TOKEN'),
+        "PROFILE_MAX_COUNT": int(os.getenv('PROFILE_MAX_COUNT', '50')),
+        "MEMORY_TRACKING": os.getenv('MEMORY_TRACKING', '0') == '1',
+        "MEMORY_TRACKED_ROUTES": ['/upload_image'],
+        "MEMORY_BUDGETS": json.loads(os.getenv('MEMORY_BUDGETS', '{}')),
+        "MEMORY_DEFAULT_BUDGET": int(os.getenv('MEMORY_DEFAULT_BUDGET', '67108864')),
+        "MEMORY_TOP_SITES": int(os.getenv('MEMORY_TOP_SITES', '5')),
+        "DATA_STORAGE": join(root, "data", "users"),
+        "RECLAIM_DIR": join(root, "data", "reclaim"),
+        "DOCUMENT_STORAGE": join(root, "data", "documents"),
+        "SCAN_POOL_WORKERS": int(os.getenv('SCAN_POOL_WORKERS', str(os.cpu_count() or 1))),
+        "SCAN_PAGES_PER_WORKER": int(os.getenv('SCAN_PAGES_PER_WORKER', '2')),
+        "DOCUMENT_RETENTION": float(os.getenv('DOCUMENT_RETENTION', '86400')),
+        "JOB_DB_URL": os.getenv('JOB_DB_URL', "sqlite:///" + join(root, "data", "jobs.db")),
+        "JOB_POOL_WORKERS": int(os.getenv('JOB_POOL_WORKERS', str(os.cpu_count() or 1))),
+        "JOB_RETENTION": float(os.getenv('JOB_RETENTION', '86400')),
+        "RECLAIM_MAX_FILES_PER_SEC": int(os.getenv('RECLAIM_MAX_FILES_PER_SEC', '500')),
+        "RECLAIM_MAX_BYTES_PER_SEC": int(os.getenv('RECLAIM_MAX_BYTES_PER_SEC', '52428800')),
+        "SESSION_DB_URL": os.getenv(
+            'SESSION_DB_URL', "sqlite:///" + join(root, "data", "sessions.db")),
+        "CREDENTIALS_PATH": (
+            None if credentials_dir is None
+            else join(credentials_dir, 'credentials.enc')),
+        "CREDENTIALS_CHECK_INTERVAL": float(os.getenv('CREDENTIALS_CHECK_INTERVAL', '5')),
+        "DB_HOST": 'localhost',
+        "DB_PORT": 5432,
+        "DB_NAME": 'postgres',
+        "DB_SCHEMA": 'public',
+        "DB_URL": os.getenv('DB_URL'),
+        "DB_ENGINE_OPTIONS": {},
+        "HASH_POOL_WORKERS": int(os.getenv('HASH_POOL_WORKERS', '2')),
+        "HASH_POOL_MAX_PENDING": int(os.getenv('HASH_POOL_MAX_PENDING', '16')),
+        "HASH_TARGET_LATENCY": float(os.getenv('HASH_TARGET_LATENCY', '0.25')),
+        "LOGIN_MAX_TRIES": 3,
+        "LOGIN_WINDOW": 1,
+        "LOGIN_LOCK_WINDOW": 60,
+        "ACCOUNT_FILTER_CAPACITY": int(os.getenv('ACCOUNT_FILTER_CAPACITY', '100000')),
+        "ACCOUNT_FILTER_ERROR_RATE": float(os.getenv('ACCOUNT_FILTER_ERROR_RATE', '0.01')),
+        "STORAGE_ENCRYPTION_KEY": os.getenv('STORAGE_ENCRYPTION_KEY'),
+    }
+
+
+def configure_logging(
+    cfg_path: str, log_dir: str,
+    queue_size: int = 10000, batch_size: int = 256) -> LoggingPipeline:
+    """Configure the logging system and log into a new file
+    tagged with the start time of the server.
+
+    The records are written by a background thread, so that
+    the request threads do not wait for the disk.
+    """
 
-config.dictConfig(log_config)
-log = getLogger("master")
+    global _logging_pipeline
 
-assert log.handlers, "Logger has no handlers!"
-prev_filehandler = log.handlers.pop(1)
-new_filehandler = FileHandler(log_path)
-new_filehandler.setFormatter(prev_filehandler.formatter)
-log.addHandler(new_filehandler)
-
-
-log.info("======= Server START =======")
-
-# ==== create the Flask application and set the secret key ====
-log.info("Initializing FLASK application...")
-app = Flask(__name__)
-CORS(app)
-env_secret_key = 'SECRET_KEY'
-app.secret_key = os.getenv(env_secret_key)
-assert app.secret_key is not None, (
-    f"The environment key '{env_secret_key}' not found!")
-log.info("Application initialized successfully.")
-
-
-# ==== compile the path to the user data storage root folder ====
-log.info("Setting up user data storage...")
-data_storage = join(dirname(__file__), "data", "users")
-log.info("User data storage setup completed.")
-
-
-# ==== create a database connection ====
-log.info("Establishing connection to database...")
-credentials_dir = os.getenv('PostgresDbCredentials')
-credentials_path = os.path.join(credentials_dir, 'credentials.enc')
-encryptor = XOREncryptor('my_secret_key')
-credentials = Credentials(encryptor).load(credentials_path)
-
-database = Database(
-    host='localhost',
-    port=5432,
-    db_name='postgres',
-    user_name=credentials['user'],
-    password=credentials['password'],
-    debug = False
-)
-log.info("Database connection established successfully.")
-
-
-# ==== create a user manager instance ====
-log.info("Initializing service: User Management ...")
-authenticator = Authenticator("some_secret_key", HS256Algorithm)
-
-user_manager = UserManager(
-    db = database,
-    table = "users",
-    schema = "public",
-    uid_column = "user_id",
-    auth = authenticator,
-    max_login_tries = 3,
-    login_wnd = 1,
-    login_lock_wnd = 60
-)
-log.info("Service initialized successfully.")
+    if _logging_pipeline is not None:
+        _logging_pipeline.stop()
+
+    log_tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_path = f"{log_dir}/server_{log_tag}.log"
+
+    with open(cfg_path, encoding = "utf-8") as fs:
+        log_config = yaml.safe_load(fs.read())
+
+    config.dictConfig(log_config)
+
+    assert log.handlers, "Logger has no handlers!"
+    prev_filehandler = log.handlers.pop(1)
+    new_filehandler = BatchFileHandler(log_path, delay = True)
+    new_filehandler.name = prev_filehandler.name
+    new_filehandler.setLevel(prev_filehandler.level)
+    new_filehandler.setFormatter(prev_filehandler.formatter)
+    log.addHandler(new_filehandler)
+
+    _logging_pipeline = LoggingPipeline(log, cfg_path, queue_size, batch_size)
+    _logging_pipeline.start()
+
+    return _logging_pipeline
+
+
+# ==== services ====
+class Services:
+    """Holds the services of the application.
+
+    A service is created on its first use rather than at the start, so
+    that the server starts quickly and no connections, threads or process
+    pools exist before the worker processes are forked from the master
+    process. In a forked child the inherited services are dropped and
+    created again on their next use.
+    """
+
+    # the services whose method calls are timed
+    instrumented = (
+        "database", "user_manager", "editor_manager",
+        "scanner_manager", "document_manager", "job_manager")
+
+    def __init__(
+        self, cfg: dict, metrics: MetricsRegistry = None,
+        memory: MemoryTracker = None, **instances) -> None:
+        """Initialize the service container.
+
+        Parameters:
+        -----------
+        cfg:
+        The application configuration.
+
+        metrics:
+        The registry of the service call metrics (default: None).
+
+        memory:
+        The tracker of the memory allocated by the editor
+        management calls (default: None).
+
+        instances:
+        Services created by the caller mapped to the service names, for
+        example 'database' or 'user_manager'. They are used instead of
+        the services created from the configuration.
+        """
+
+        self._config = cfg
+        self._metrics = metrics
+        self._memory = memory
+        self._overrides = dict(instances)
+        self._instances = dict(instances)
+        self._lock = threading.RLock()
+
+        # the services dropped after a fork are kept referenced,
+        # so that their finalizers never close the connections
+        # and files still used by the parent process
+        self._orphans = []
+
+        _live_services.add(self)
+
+    def _get(self, name: str, factory) -> any:
+        """Return the service, create it on the first call."""
+
+        service = self._instances.get(name)
+        if service is not None:
+            return service
+
+        with self._lock:
+            service = self._instances.get(name)
+            if service is None:
+                service = factory()
+
+                if self._metrics is not None and name in self.instrumented:
+                    instrument(
+                        service, name,
+                        self._metrics.get("service_call_duration_seconds"),
+                        self._metrics.get("service_call_errors_total")
+                    )
+
+                if self._memory is not None and name == "editor_manager":
+                    self._memory.track_calls(
+                        service, name, ("decode_image", "apply_filter", "save_file", "read_file"))
+
+                self._instances[name] = service
+
+        return service
+
+    def peek(self, name: str) -> any:
+        """Return the service if already created, otherwise None."""
+        return self._instances.get(name)
+
+    @property
+    def data_storage(self) -> str:
+        """Return the root folder of the user data."""
+        return self._config["DATA_STORAGE"]
+
+    @property
+    def session_interface(self) -> ServerSessionInterface:
+        """Return the server-side session interface."""
+
+        def create():
+            # the session data is stored on the server, the client holds
+            # the signed session ID only, so that the sessions can be revoked
+            return ServerSessionInterface(
+                SQLSessionBackend(self._config["SESSION_DB_URL"]),
+                lifetime = self._config["PERMANENT_SESSION_LIFETIME"]
+            )
+
+        return self._get("session_interface", create)
+
+    @property
+    def folder_reclaimer(self) -> FolderReclaimer:
+        """Return the background remover of the deleted user data folders."""
+
+        def create():
+            reclaimer = FolderReclaimer(
+                reclaim_dir = self._config["RECLAIM_DIR"],
+                max_files_per_sec = self._config["RECLAIM_MAX_FILES_PER_SEC"],
+                max_bytes_per_sec = self._config["RECLAIM_MAX_BYTES_PER_SEC"]
+            )
+            reclaimer.start()
+            log.info(
+                "Folder reclaimer started (%d folders pending removal).",
+                reclaimer.backlog
+            )
+            return reclaimer
+
+        return self._get("folder_reclaimer", create)
+
+    @property
+    def database(self) -> Database:
+        """Return the database connection."""
+        return self._get("database", self._create_database)
+
+    def _create_database(self) -> Database:
+        """Connect to the database and watch the credentials file."""
+
+        # a database given by its URL, such as a local stand-in
+        # for the tests, needs no credentials
+        if self._config["DB_URL"] is not None:
+            return Database(
+                host = None, port = None, db_name = None,
+                user_name = None, password = None,
+                url = self._config["DB_URL"],
+                engine_options = self._config["DB_ENGINE_OPTIONS"]
+            )
+
+        credentials_path = self._config["CREDENTIALS_PATH"]
+        if credentials_path is None:
+            raise RuntimeError("The database credentials path is not configured!")
+
+        log.info("Establishing connection to database...")
+        credentials_store = Credentials(XOREncryptor('my_secret_key'))
+        credentials = credentials_store.load(credentials_path)
+
+        database = Database(
+            host = self._config["DB_HOST"],
+            port = self._config["DB_PORT"],
+            db_name = self._config["DB_NAME"],
+            user_name = credentials['user'],
+            password = credentials['password'],
+            debug = False
+        )
+        log.info("Database connection established successfully.")
+
+        # reconnect to the database in the background
+        # whenever the credentials file is replaced
+        def on_credentials_change(new_credentials: dict) -> None:
+            log.info("Database credentials changed. Reconnecting...")
+            database.reconnect(new_credentials['user'], new_credentials['password'])
+            log.info("Database reconnected with the new credentials.")
+
+        watcher = CredentialsWatcher(
+            credentials_store, credentials_path, on_credentials_change,
+            interval = self._config["CREDENTIALS_CHECK_INTERVAL"]
+        )
+        watcher.start()
+        self._instances["credentials_watcher"] = watcher
+
+        return database
+
+    @property
+    def password_hasher(self) -> PasswordHasher:
+        """Return the password hashing pool."""
+
+        def create():
+            log.info("Initializing password hashing pool...")
+            hasher = PasswordHasher(
+                max_workers = self._config["HASH_POOL_WORKERS"],
+                max_pending = self._config["HASH_POOL_MAX_PENDING"]
+            )
+
+            # the work factor is calibrated against the target time in
+            # seconds the computation of a single password hash should take
+            hasher.calibrate(self._config["HASH_TARGET_LATENCY"])
+            log.info(
+                "Password hashing pool initialized (work factor: %d iterations).",
+                hasher.iterations
+            )
+            return hasher
+
+        return self._get("password_hasher", create)
+
+    @property
+    def create_password_hash(self) -> Callable[[str], str]:
+        """Return the function computing the password hashes."""
+
+        return self._get("create_password_hash", lambda: partial(
+            generate_password_hash, method = self.password_hasher.method))
+
+    @property
+    def user_manager(self) -> UserManager:
+        """Return the user management service."""
+
+        def create():
+            log.info("Initializing service: User Management ...")
+            manager = UserManager(
+                db = self.database,
+                table = "users",
+                schema = self._config["DB_SCHEMA"],
+                uid_column = "user_id",
+                auth = Authenticator("some_secret_key", HS256Algorithm),
+                max_login_tries = self._config["LOGIN_MAX_TRIES"],
+                login_wnd = self._config["LOGIN_WINDOW"],
+                login_lock_wnd = self._config["LOGIN_LOCK_WINDOW"],
+                hasher = self.password_hasher,
+                filter_capacity = self._config["ACCOUNT_FILTER_CAPACITY"],
+                filter_error_rate = self._config["ACCOUNT_FILTER_ERROR_RATE"],
+                reclaimer = self.folder_reclaimer
+            )
+            log.info("Service initialized successfully.")
+            return manager
+
+        return self._get("user_manager", create)
+
+    @property
+    def editor_manager(self) -> EditorManager:
+        """Return the editor management service."""
+
+        def create():
+            # the user files are encrypted at rest only if a storage key is set
+            storage_key = self._config["STORAGE_ENCRYPTION_KEY"]
+            file_storage = None
+
+            if storage_key is not None:
+                file_storage = EncryptedStorage(XOREncryptor(storage_key))
+                log.info("User files will be encrypted at rest.")
+
+            return EditorManager(storage = file_storage)
+
+        return self._get("editor_manager", create)
+
+    @property
+    def scanner_manager(self) -> ScannerManager:
+        """Return the scanner management service."""
+        return self._get("scanner_manager", ScannerManager)
+
+    @property
+    def document_manager(self) -> DocumentManager:
+        """Return the multi-page document scanning service."""
+
+        def create():
+            log.info("Initializing document scanning pool...")
+            return DocumentManager(
+                self._config["DOCUMENT_STORAGE"],
+                max_workers = self._config["SCAN_POOL_WORKERS"],
+                pages_per_worker = self._config["SCAN_PAGES_PER_WORKER"],
+                retention = self._config["DOCUMENT_RETENTION"]
+            )
+
+        return self._get("document_manager", create)
+
+    @property
+    def job_manager(self) -> JobManager:
+        """Return the manager of the jobs run by the worker processes."""
+
+        def create():
+            log.info("Initializing job pool...")
+            return JobManager(
+                SQLJobStore(self._config["JOB_DB_URL"]),
+                max_workers = self._config["JOB_POOL_WORKERS"],
+                retention = self._config["JOB_RETENTION"]
+            )
+
+        return self._get("job_manager", create)
+
+    def after_fork(self) -> None:
+        """Drop the services inherited from the parent process.
+        Called in a child process after a fork."""
+
+        self._lock = threading.RLock()
+
+        session_interface = self._instances.get("session_interface")
+        if session_interface is not None:
+            session_interface.after_fork()
+
+        for name, service in list(self._instances.items()):
+            if name in self._overrides or name == "session_interface":
+                continue
+            self._orphans.append(service)
+            del self._instances[name]
+
+    def shutdown(self) -> None:
+        """Stop the background threads and close the connections."""
+
+        with self._lock:
+            instances = self._instances
+            self._instances = dict(self._overrides)
+
+        if "credentials_watcher" in instances:
+            instances["credentials_watcher"].stop()
+        if "session_interface" in instances:
+            instances["session_interface"].stop()
+        if "folder_reclaimer" in instances:
+            instances["folder_reclaimer"].stop()
+        if "password_hasher" in instances:
+            instances["password_hasher"].shutdown()
+        if "document_manager" in instances:
+            instances["document_manager"].shutdown()
+        if "job_manager" in instances:
+            instances["job_manager"].shutdown()
+        if "database" in instances:
+            instances["database"].disconnect()
+
+
+def get_services() -> Services:
+    """Return the services of the current application."""
+    return current_app.extensions["services"]
+
+
+# ==== metrics ====
+def create_metrics() -> MetricsRegistry:
+    """Create the registry of the request and service call metrics."""
+
+    metrics = MetricsRegistry()
+    metrics.counter(
+        "http_requests_total",
+        "Number of handled requests.", ("route", "method", "status"))
+    metrics.histogram(
+        "http_request_duration_seconds",
+        "Request handling time in seconds.", ("route", "method"))
+    metrics.histogram(
+        "service_call_duration_seconds",
+        "Service method call time in seconds.", ("component", "method"))
+    metrics.counter(
+        "service_call_errors_total",
+        "Number of service method calls raising an error.", ("component", "method"))
+    metrics.counter(
+        "upload_bytes_total",
+        "Number of uploaded image bytes, the upload rate is its rate().")
+
+    return metrics
+
+
+def register_metric_gauges(
+    metrics: MetricsRegistry, services: Services,
+    logging_pipeline: LoggingPipeline = None) -> None:
+    """Register the gauges reading the state of the services.
+    A service not created yet is not reported."""
+
+    def read(name: str, attr: str):
+        def func():
+            service = services.peek(name)
+            return None if service is None else getattr(service, attr)
+        return func
+
+    metrics.gauge(
+        "password_hash_pending", "Password hashing jobs in progress or queued.",
+        read("password_hasher", "pending"))
+    metrics.gauge(
+        "password_hash_queue_depth", "Password hashing jobs waiting for a worker.",
+        read("password_hasher", "queue_depth"))
+    metrics.gauge(
+        "password_hash_rejected_total", "Password hashing jobs rejected as the pool was full.",
+        read("password_hasher", "rejected"), kind = "counter")
+    metrics.gauge(
+        "scan_pages_pending", "Document pages scanned or waiting for a worker.",
+        read("document_manager", "pending"))
+    metrics.gauge(
+        "jobs_pending", "Jobs running or waiting for a worker.",
+        read("job_manager", "pending"))
+    metrics.gauge(
+        "jobs_shared_memory_bytes", "Shared memory holding the images of the pixel jobs.",
+        read("job_manager", "shared_bytes"))
+    metrics.gauge(
+        "db_queries_in_progress", "Database queries currently executed.",
+        read("database", "queries_in_progress"))
+    metrics.gauge(
+        "account_filter_skips_total", "Account checks answered without a database query.",
+        read("user_manager", "filter_skips"), kind = "counter")
+    metrics.gauge(
+        "folder_reclaim_backlog", "Deleted user folders waiting to be removed.",
+        read("folder_reclaimer", "backlog"))
+    metrics.gauge(
+        "folder_reclaim_bytes_total", "Bytes released by removing deleted user folders.",
+        read("folder_reclaimer", "removed_bytes"), kind = "counter")
+
+    def session_cache(attr: str):
+        def func():
+            interface = services.peek("session_interface")
+            if interface is None:
+                return None
+            return len(interface.cache) if attr == "size" else getattr(interface.cache, attr)
+        return func
+
+    metrics.gauge(
+        "session_cache_hits_total", "Session lookups answered by the cache.",
+        session_cache("hits"), kind = "counter")
+    metrics.gauge(
+        "session_cache_misses_total", "Session lookups missing the cache.",
+        session_cache("misses"), kind = "counter")
+    metrics.gauge(
+        "session_cache_size", "Sessions held in the cache.",
+        session_cache("size"))
+    metrics.gauge(
+        "session_pending_writes", "Session changes waiting to be written.",
+        read("session_interface", "pending_writes"))
+
+    if logging_pipeline is not None:
+        metrics.gauge(
+            "log_queue_depth", "Log records waiting to be written.",
+            lambda: logging_pipeline.queue_depth)
+        metrics.gauge(
+            "log_records_dropped_total", "Log records dropped as the queue was full.",
+            lambda: logging_pipeline.dropped, kind = "counter")
+
+
+def _start_memory_tracking() -> None:
+    """Start tracking the memory allocated by a tracked route."""
+
+    rule = request.url_rule.rule if request.url_rule is not None else None
+
+    if rule in current_app.config["MEMORY_TRACKED_ROUTES"]:
+        scope = current_app.extensions["memory"].track(rule)
+        scope.__enter__()
+        g.memory_scope = scope
+
+
+def _stop_memory_tracking(exc: BaseException = None) -> None:
+    """Stop tracking the memory allocated by a tracked route."""
+
+    scope = g.pop("memory_scope", None)
+
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the metrics of the current application."""
+    return current_app.extensions["metrics"]
+
+
+def _start_request_timer() -> None:
+    """Mark the start of the request handling."""
+    g.request_start = time.perf_counter()
+
+
+def _record_request(response):
+    """Record the handling time and the status of the request."""
+
+    start = g.pop("request_start", None)
+
+    if start is not None:
+        metrics = get_metrics()
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        metrics.get("http_request_duration_seconds").observe(
+            time.perf_counter() - start, rule, request.method)
+        metrics.get("http_requests_total").inc(
+            rule, request.method, str(response.status_code))
+
+    return response
+
+
+# ==== application factory ====
+def route(rule: str, **options):
+    """Decorator to register a view with the applications
+    created by the application factory."""
+
+    def decorator(func):
+        _views.append((rule, func, options))
+        return func
+
+    return decorator
+
+
+def create_app(cfg: dict = None, **instances) -> Flask:
+    """Create the Flask application.
+
+    No service is created here, the services are created on their
+    first use (see `Services`), so the application may be created
+    in a master process before the worker processes are forked.
+
+    Parameters:
+    -----------
+    cfg:
+    The configuration overriding the defaults read from
+    the environment variables (see `default_config`).
+
+    instances:
+    Services created by the caller (see `Services`).
+
+    Returns:
+    --------
+    The Flask application.
+    """
+
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(cfg or {})
+
+    if app.config["LOG_CONFIG_PATH"] is not None:
+        app.extensions["logging"] = configure_logging(
+            app.config["LOG_CONFIG_PATH"], app.config["LOG_DIR"],
+            app.config["LOG_QUEUE_SIZE"], app.config["LOG_BATCH_SIZE"]
+        )
+
+    log.info("======= Server START =======")
+    log.info("Initializing FLASK application...")
+
+    CORS(app)
+    app.secret_key = app.config["SECRET_KEY"]
+    assert app.secret_key is not None, (
+        "The environment key 'SECRET_KEY' not found!")
+
+    metrics = create_metrics()
+    memory = None
+
+    # tracing the allocations slows down the process, thus opt-in
+    if app.config["MEMORY_TRACKING"]:
+        memory = MemoryTracker(
+            metrics,
+            budgets = app.config["MEMORY_BUDGETS"],
+            default_budget = app.config["MEMORY_DEFAULT_BUDGET"],
+            top_sites = app.config["MEMORY_TOP_SITES"]
+        )
+        memory.start()
+        app.extensions["memory"] = memory
+        app.before_request(_start_memory_tracking)
+        app.teardown_request(_stop_memory_tracking)
+
+    services = Services(app.config, metrics, memory, **instances)
+    app.extensions["services"] = services
+    app.extensions["metrics"] = metrics
+    app.session_interface = services.session_interface
 
+    register_metric_gauges(metrics, services, app.extensions.get("logging"))
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request)
 
-log.info("Initializing service: Editor Management ...")
-editor_manager = EditorManager()
-log.info("Service initialized successfully.")
+    # the requests are not profiled unless sampling or the admin token is set
+    RequestProfiler(
+        app.config["PROFILE_DIR"],
+        sample_rate = app.config["PROFILE_SAMPLE_RATE"],
+        admin_token = app.config["PROFILE_TOKEN"],
+        max_profiles = app.config["PROFILE_MAX_COUNT"]
+    ).init_app(app)
 
+    for rule, func, options in _views:
+        app.add_url_rule(rule, view_func = func, **options)
+
+    log.info("======= Server RUNNING =======")
+
+    return app
 
-log.info("======= Server RUNNING =======")
 
 # decorator to check if the user is logged in
 def login_required(func):
@@ -171,15 +796,15 @@ def login_required(func):
     @wraps(func)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            return redirect(url_for('authentication'))
+            return make_response(render_template('authentication.html'), UNAUTHORIZED)
         return func(*args, **kwargs)
 
     return decorated_function
 
 
 # endpoints
-@app.route('/')
-@app.route('/home')
+@route('/')
+@route('/home')
 def home():
     """Renders the home page."""
 
@@ -192,7 +817,7 @@ def home():
     )
 
 
-@app.route('/contact')
+@route('/contact')
 def contact():
     """Renders the contact page."""
 
@@ -203,7 +828,7 @@ def contact():
     )
 
 
-@app.route('/about')
+@route('/about')
 def about():
     """Renders the about page."""
 
@@ -215,13 +840,16 @@ def about():
     )
 
 
-@app.route('/register', methods = ['POST', 'GET'])
+@route('/register', methods = ['POST', 'GET'])
 def register():
     """Registers a new user."""
 
     if request.method == 'GET':
         return render_template('register.html')
 
+    services = get_services()
+    user_manager = services.user_manager
+
     user_name = request.form['username']
     user_email = request.form['email']
     user_password = request.form['password']
@@ -234,7 +862,7 @@ def register():
     try:
         user_id, auth_token = user_manager.register_user(
             user_name, user_email, user_password,
-            gen_hash_func, data_storage)
+            services.create_password_hash, services.data_storage)
     except InvalidPasswordError as err:
         log.exception(err)
         # should highlight the error in the password field on the form
@@ -251,11 +879,19 @@ def register():
         log.exception(err)
         # should highlight the error in the username or email field on the form
         return str(err)
+    except ServiceBusyError as err:
+        log.error(err)
+        return make_response(
+            "The server is busy. Please try again later.",
+            SERVICE_UNAVAILABLE
+        )
     except (DatabaseError, FolderCreationError) as err:
         log.exception(err)
         return "An error occurred while registering the user!"
 
-    # store the user ID in the session
+    # store the user ID in the session under a new session ID,
+    # the ID used before the login may be known to someone else
+    get_services().session_interface.regenerate(session)
     session['user_id'] = user_id
     session['user_name'] = user_name
 
@@ -273,7 +909,7 @@ def register():
     return response
 
 
-@app.route('/authenticate', methods = ['POST',  'GET'])
+@route('/authenticate', methods = ['POST',  'GET'])
 def authenticate():
     """Authenticates users who access
     an application directly via the URL.
@@ -282,6 +918,7 @@ def authenticate():
     """
 
     response = make_response()
+    user_manager = get_services().user_manager
 
     log.debug(request.authorization)
     token = str(request.authorization).replace("Bearer ", "")
@@ -301,13 +938,14 @@ def authenticate():
     # send the response to the client browser
     return response
 
-@app.route('/login', methods = ['POST', 'GET'])
+@route('/login', methods = ['POST', 'GET'])
 def login():
     """Logs in an existing user."""
 
     if request.method == 'GET':
         return render_template('login.html', message = "")
 
+    user_manager = get_services().user_manager
     user_name = request.form['username']
     user_password = request.form['password']
 
@@ -351,6 +989,11 @@ def login():
             f"{user_manager.calculate_next_login_timeout(user_name).minutes} minutes "
             f"{user_manager.calculate_next_login_timeout(user_name).seconds} seconds."
         ))
+    except ServiceBusyError as err:
+        log.error(err)
+        return make_response(render_template(
+            'login.html', message = "The server is busy. Please try again later."
+        ), SERVICE_UNAVAILABLE)
     except DatabaseError as err:
         log.exception(err)
         return render_template(
@@ -359,7 +1002,9 @@ def login():
 
     log.info('User successfully logged in: %s', user_name)
 
-    # store the user ID in the session
+    # store the user ID in the session under a new session ID,
+    # the ID used before the login may be known to someone else
+    get_services().session_interface.regenerate(session)
     session['user_id'] = user_id
     session['user_name'] = user_name
 
@@ -374,7 +1019,7 @@ def login():
     return response
 
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     """Logs out an active user."""
 
@@ -401,7 +1046,7 @@ def logout():
     # send the response to the client browser
     return response
 
-@app.route('/delete_account')
+@route('/delete_account')
 def delete_account():
     """Logs out an active user."""
 
@@ -418,11 +1063,15 @@ def delete_account():
     assert session.get('user_id') is None, "User ID not removed from session!"
     assert session.get('user_name') is None, "User name not removed from session!"
 
+    # revoke the other sessions of the user as well
+    services = get_services()
+    services.session_interface.revoke_user(user_id)
+
     # delete the user account
     log.info("Deleting account for user: %d ...", user_id)
 
     try:
-        user_manager.delete_user(user_id, data_storage)
+        services.user_manager.delete_user(user_id, services.data_storage)
     except InvalidUsernameError as err:
         log.error(err)
         return "Cannot delete the account. The user does not exist!"
@@ -438,7 +1087,7 @@ def delete_account():
     # send the response to the client browser
     return response
 
-@app.route('/change_password', methods = ['POST', 'GET'])
+@route('/change_password', methods = ['POST', 'GET'])
 def change_password():
     """Logs in an existing user."""
 
@@ -467,11 +1116,13 @@ def change_password():
         log.error("The new and confirmed passwords do not match!")
         return "Passwords do not match!"
 
+    services = get_services()
+
     try:
-        user_manager.change_user_password(
+        services.user_manager.change_user_password(
             session['user_id'],
             new_user_password,
-            gen_hash_func
+            services.create_password_hash
         )
     except InvalidPasswordError as err:
         # should highlight the error in the password field on the form
@@ -481,6 +1132,12 @@ def change_password():
         # should highlight the error in the username field on the form
         log.error(err)
         return str(err)
+    except ServiceBusyError as err:
+        log.error(err)
+        return make_response(
+            "The server is busy. Please try again later.",
+            SERVICE_UNAVAILABLE
+        )
     except DatabaseError as err:
         log.exception(err)
         return "An error occurred while changing the user account!"
@@ -489,13 +1146,13 @@ def change_password():
 
     return make_response(redirect(url_for('home')))
 
-@app.route('/profile')
+@route('/profile')
 def profile():
     """Opens the user profile."""
 
     return render_template('profile.html')
 
-@app.route('/editor')
+@route('/editor')
 def editor():
     """Starts image editor."""
 
@@ -504,7 +1161,7 @@ def editor():
 
     return redirect('http://localhost:5174/')
 
-@app.route('/scanner')
+@route('/scanner')
 def scanner():
     """Starts image scanner."""
 
@@ -513,16 +1170,31 @@ def scanner():
 
     return redirect('http://localhost:5173/')
 
-@app.route('/upload_image', methods = ['POST'])
+@route('/metrics')
+def metrics():
+    """Exposes the metrics in the Prometheus text format."""
+
+    return make_response(
+        get_metrics().expose(), 200, {"Content-Type": CONTENT_TYPE})
+
+@route('/profiles')
+def profiles():
+    """Lists the slowest profiled requests. Admin only."""
+
+    profiler = current_app.extensions["profiler"]
+
+    if not profiler.is_admin():
+        return make_response("Access denied!", FORBIDDEN)
+
+    limit = request.args.get('limit', type = int)
+
+    return jsonify(profiler.slowest(limit))
+
+@route('/upload_image', methods = ['POST'])
+@login_required
 def upload_image():
     """Upload a file to the server."""
 
-    # since user must always be logged into
-    # an app to upload a file, we don't need
-    # to check if the user is logged in, just
-    # check if the method is called correctly
-    assert "user_id" not in session, "Invalid route call!"
-
     data = request.get_json()
 
     # Check if a file is part of the request
@@ -537,28 +1209,304 @@ def upload_image():
     if data['filename'] == '':
         return make_response("No selected image!", 400)
 
+    # the client name must not lead out of the user data folder
+    filename = secure_filename(data['filename'])
+    if filename == '':
+        return make_response("Invalid file name!", 400)
+
     log.info("Uploading image...")
-    dst_folder = r"E:\AdvancedImageTools\server\server\data\users"
+    services = get_services()
+    editor_manager = services.editor_manager
+    dst_folder = join(services.data_storage, str(session['user_id']))
     log.debug("Upload directory: %s", dst_folder)
     image = editor_manager.decode_image(data['content'])
 
-    # save the file to the user data folder that exists on the server
+    # save the file to the user data folder, which the accounts
+    # registered before the folders were introduced do not have
     try:
-        img_path = editor_manager.save_file(dst_folder, data['filename'], image)
+        os.makedirs(dst_folder, exist_ok = True)
+        img_path = editor_manager.save_file(dst_folder, filename, image)
     except InvalidImageFormatError as err:
         log.error(err)
         return make_response("Unsupported image format!", 400)
 
+    get_metrics().get("upload_bytes_total").inc(amount = len(image))
     log.debug("Uploaded image: %s", img_path)
     log.info("Image successfully uploaded.")
 
     return make_response('File successfully uploaded.', 200)
 
+@route('/filter_image', methods = ['POST'])
+@login_required
+def filter_image():
+    """Apply a filter to an image."""
+
+    data = request.get_json()
+
+    # Check if a file is part of the request
+    if 'content' not in data:
+        return make_response("No content part in request!", 400)
+
+    # Check if a filter is part of the request
+    if 'filter' not in data:
+        return make_response("No filter part in request!", 400)
+
+    try:
+        value = float(data.get('value', 1.0))
+    except (TypeError, ValueError):
+        return make_response("Invalid filter value!", 400)
+
+    log.info("Filtering image...")
+    editor_manager = get_services().editor_manager
+    header = data['content'].split(',', maxsplit = 1)[0]
+    image = editor_manager.decode_image(data['content'])
+
+    try:
+        image = editor_manager.apply_filter(image, data['filter'], value)
+    except InvalidFilterError as err:
+        log.error(err)
+        return make_response("Unsupported filter!", 400)
+    except InvalidImageFormatError as err:
+        log.error(err)
+        return make_response("Unsupported image format!", 400)
+
+    content = base64.b64encode(image).decode('ascii')
+    log.info("Image successfully filtered.")
+
+    return jsonify({"content": f"{header},{content}"})
+
+@route('/scan_image', methods = ['POST'])
+@login_required
+def scan_image():
+    """Scan a photo of a document page."""
+
+    data = request.get_json()
+
+    # Check if a file is part of the request
+    if 'content' not in data:
+        return make_response("No content part in request!", 400)
+
+    log.info("Scanning image...")
+    services = get_services()
+    image = services.editor_manager.decode_image(data['content'])
+    scanner_manager = services.scanner_manager
+
+    try:
+        page, corners = scanner_manager.scan(
+            image, data.get('mode', 'gray'), dropout = data.get('dropout'))
+    except InvalidImageError as err:
+        log.error(err)
+        return make_response("Unsupported image format!", 400)
+    except InvalidScanModeError as err:
+        log.error(err)
+        return make_response("Unsupported scan mode!", 400)
+    except InvalidDropoutError as err:
+        log.error(err)
+        return make_response("Invalid dropout colors!", 400)
+
+    content = base64.b64encode(scanner_manager.encode_image(page)).decode('ascii')
+    log.info("Image successfully scanned.")
+
+    return jsonify({
+        "content": "data:image/png;base64," + content,
+        "corners": corners.round(2).tolist()
+    })
+
+@route('/create_document', methods = ['POST'])
+@login_required
+def create_document():
+    """Create a multi-page document scanned from a batch of photos."""
+
+    data = request.get_json()
+    document_manager = get_services().document_manager
+
+    # the thresholds of the blank and the duplicate pages of this batch
+    page_filter = data.get('filter') or {}
+    if not isinstance(page_filter, dict):
+        return make_response("Invalid page filter!", 400)
+
+    try:
+        doc_id = document_manager.create_document(
+            data.get('format', 'pdf'), data.get('mode', 'gray'),
+            page_filter, data.get('dropout'), session['user_id'])
+    except InvalidDocumentFormatError as err:
+        log.error(err)
+        return make_response("Unsupported document format!", 400)
+    except InvalidScanModeError as err:
+        log.error(err)
+        return make_response("Unsupported scan mode!", 400)
+    except InvalidPageFilterError as err:
+        log.error(err)
+        return make_response("Invalid page filter!", 400)
+    except InvalidDropoutError as err:
+        log.error(err)
+        return make_response("Invalid dropout colors!", 400)
+
+    return jsonify({"id": doc_id})
+
+@route('/upload_page', methods = ['POST'])
+@login_required
+def upload_page():
+    """Add the photo of the next page to a document."""
+
+    data = request.get_json()
+
+    # Check if a document is part of the request
+    if 'document' not in data:
+        return make_response("No document part in request!", 400)
+
+    # Check if a file is part of the request
+    if 'content' not in data:
+        return make_response("No content part in request!", 400)
+
+    services = get_services()
+    image = services.editor_manager.decode_image(data['content'])
+
+    try:
+        index = services.document_manager.add_page(
+            data['document'], image, session['user_id'])
+    except DocumentNotFoundError as err:
+        log.error(err)
+        return make_response("Document not found!", 404)
+    except DocumentStateError as err:
+        log.error(err)
+        return make_response(str(err), 409)
+
+    get_metrics().get("upload_bytes_total").inc(amount = len(image))
+
+    return jsonify({"page": index})
+
+@route('/assemble_document', methods = ['POST'])
+@login_required
+def assemble_document():
+    """Start scanning the pages of a document into a single file."""
+
+    data = request.get_json()
+
+    # Check if a document is part of the request
+    if 'document' not in data:
+        return make_response("No document part in request!", 400)
+
+    log.info("Assembling document...")
+
+    try:
+        progress = get_services().document_manager.assemble(
+            data['document'], session['user_id'])
+    except DocumentNotFoundError as err:
+        log.error(err)
+        return make_response("Document not found!", 404)
+    except DocumentStateError as err:
+        log.error(err)
+        return make_response(str(err), 409)
+
+    return make_response(jsonify(progress), 202)
+
+@route('/document_progress/<doc_id>')
+@login_required
+def document_progress(doc_id: str):
+    """Return the progress of a document."""
+
+    try:
+        return jsonify(get_services().document_manager.progress(
+            doc_id, session['user_id']))
+    except DocumentNotFoundError as err:
+        log.error(err)
+        return make_response("Document not found!", 404)
+
+@route('/download_document/<doc_id>')
+@login_required
+def download_document(doc_id: str):
+    """Download an assembled document."""
+
+    try:
+        path = get_services().document_manager.output_path(
+            doc_id, session['user_id'])
+    except DocumentNotFoundError as err:
+        log.error(err)
+        return make_response("Document not found!", 404)
+    except DocumentStateError as err:
+        log.error(err)
+        return make_response(str(err), 409)
+
+    return send_file(path, as_attachment = True, download_name = os.path.basename(path))
+
+@route('/jobs', methods = ['POST'])
+@login_required
+def submit_job():
+    """Submit a long image operation to be run in the background."""
+
+    data = request.get_json()
+
+    # Check if a job kind is part of the request
+    if 'kind' not in data:
+        return make_response("No kind part in request!", 400)
+
+    # Check if a file is part of the request
+    if 'content' not in data:
+        return make_response("No content part in request!", 400)
+
+    # the pixel jobs take decoded images, which only
+    # the services of the server can submit
+    if data['kind'] in PIXEL_JOB_KINDS:
+        return make_response("Unsupported job kind!", 400)
+
+    params = {key: value for key, value in data.items() if key != 'kind'}
+
+    try:
+        job_manager = get_services().job_manager
+        job_id = job_manager.submit(data['kind'], params, owner = session['user_id'])
+    except InvalidJobKindError as err:
+        log.error(err)
+        return make_response("Unsupported job kind!", 400)
+
+    response = make_response(jsonify(job_manager.get(job_id, session['user_id'])), 202)
+    response.headers['Location'] = url_for('get_job', job_id = job_id)
+
+    return response
+
+@route('/jobs/<job_id>')
+@login_required
+def get_job(job_id: str):
+    """Return the status of a job, and its result once done."""
+
+    try:
+        return jsonify(get_services().job_manager.get(job_id, session['user_id']))
+    except JobNotFoundError as err:
+        log.error(err)
+        return make_response("Job not found!", 404)
+
+@route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id: str):
+    """Stream the changes of a job as server-sent events
+    until the job is finished."""
+
+    job_manager = get_services().job_manager
+    owner = session['user_id']
+
+    try:
+        job = job_manager.get(job_id, owner)
+    except JobNotFoundError as err:
+        log.error(err)
+        return make_response("Job not found!", 404)
+
+    def stream():
+        previous = None
+        current = job
+
+        while True:
+            if current != previous:
+                yield f"event: {current['status']}\ndata: {json.dumps(current)}\n\n"
+            else:
+                # keeps the connection open through the proxies
+                yield ": keep-alive\n\n"
+
+            if current['status'] in FINISHED_STATUSES:
+                break
+
+            previous, current = current, job_manager.watch(
+                job_id, current, owner = owner)
 
-if __name__ == "__main__":
-    # delete user with ID 1000026 from the database
-    # and the user data folder
-    assert user_manager.user_exsists(1000028)
-    user_manager.delete_user(1000028)
-    assert not user_manager.user_exsists(1000028)
-    print("User deleted successfully!")
+    return Response(
+        stream_with_context(stream()), mimetype = 'text/event-stream',
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,5 +1,8 @@
 """Module to interact with the database."""
 
+import threading
+from logging import getLogger
+
 import sqlalchemy as sqal
 from sqlalchemy.sql.expression import bindparam
 from sqlalchemy import MetaData, select, column
@@ -7,6 +10,15 @@ from sqlalchemy.sql.schema import Table
 from sqlalchemy.sql.selectable import Select
 from sqlalchemy.engine.base import Connection
 from sqlalchemy.engine.cursor import CursorResult
+from sqlalchemy.exc import IntegrityError
+
+log = getLogger("master")
+
+# SQLSTATE code of a unique constraint violation
+UNIQUE_VIOLATION = "23505"
+
+class DuplicateRecordError(Exception):
+    """Raised when a record violates a unique constraint of a table."""
 
 class Database:
     """Class to interact with the database."""
@@ -14,7 +26,8 @@ class Database:
     def __init__(
         self, host: str, port: int, db_name: str,
         user_name: str, password: str,
-        debug: bool = False) -> None:
+        debug: bool = False, url: str = None,
+        engine_options: dict = None) -> None:
         """Connect to the database engine.
 
         Parameters:
@@ -33,6 +46,14 @@ class Database:
 
         password:
             A valid password.
+
+        url:
+            An SQLAlchemy database URL used instead of the PostgreSQL
+            server specified by the other parameters, for example
+            'sqlite:///users.db' (default: None).
+
+        engine_options:
+            Additional keyword arguments of the database engine (default: None).
         """
 
         self._host = host
@@ -41,27 +62,108 @@ class Database:
         self._user_name = user_name
         self._password = password
         self._debug = debug
+        self._url = url
+        self._engine_options = engine_options or {}
 
         self._conn = None
+        self._engine = None
 
-        url = "postgresql+psycopg2://{}:{}@{}:{}/{}".format(
-            self._user_name, self._password,
-            self._host, self._port, self._db_name
-        )
+        # number of queries in progress on each connection, used
+        # to close a replaced connection once it is no longer used
+        self._usage = {}
+        self._usage_changed = threading.Condition()
+
+        self._engine, self._conn = self._connect(user_name, password)
+
+    def _connect(self, user_name: str, password: str) -> tuple:
+        """Create a database engine and connect to it."""
+
+        url = self._url
+
+        if url is None:
+            url = "postgresql+psycopg2://{}:{}@{}:{}/{}".format(
+                user_name, password,
+                self._host, self._port, self._db_name
+            )
 
         pool_debug = "debug" if self._debug else False
 
         if self._debug:
             print("Database connection URL:", url)
 
-        engine = sqal.create_engine(url, echo_pool = pool_debug)
+        engine = sqal.create_engine(url, echo_pool = pool_debug, **self._engine_options)
 
         try:
-            self._conn = engine.connect()
+            conn = engine.connect()
         except:
             engine.dispose()
             raise
 
+        return (engine, conn)
+
+    def _acquire(self) -> Connection:
+        """Return the current connection and register a query in progress."""
+
+        with self._usage_changed:
+            conn = self._conn
+            self._usage[conn] = self._usage.get(conn, 0) + 1
+
+        return conn
+
+    def _release(self, conn: Connection) -> None:
+        """Unregister a query in progress on the connection."""
+
+        with self._usage_changed:
+            self._usage[conn] -= 1
+
+            if self._usage[conn] == 0:
+                del self._usage[conn]
+                self._usage_changed.notify_all()
+
+    def reconnect(
+        self, user_name: str, password: str,
+        drain_timeout: float = 30.0) -> None:
+        """Replace the database connection with a new one using new
+        credentials, without interrupting the queries in progress.
+
+        New queries use the new connection as soon as it is established.
+        The old connection is closed after the queries in progress on it
+        finish or the timeout elapses, whichever comes first.
+
+        Parameters:
+        -----------
+        user_name
+            A valid user name.
+
+        password:
+            A valid password.
+
+        drain_timeout:
+            The maximum time in seconds to wait for
+            the queries on the old connection to finish.
+        """
+
+        engine, conn = self._connect(user_name, password)
+
+        with self._usage_changed:
+            old_engine, old_conn = self._engine, self._conn
+            self._engine, self._conn = engine, conn
+            self._user_name = user_name
+            self._password = password
+
+            drained = self._usage_changed.wait_for(
+                lambda: old_conn not in self._usage, drain_timeout)
+
+        if not drained:
+            log.warning(
+                "Closing the old database connection with queries in progress.")
+
+        if old_conn is not None:
+            old_conn.close()
+
+        if old_engine is not None:
+            old_engine.dispose()
+
     def __del__(self):
         """Disconnect from the database
         when the object is deleted."""
@@ -74,6 +176,13 @@ class Database:
         """Get the database connection object."""
         return self._conn
 
+    @property
+    def queries_in_progress(self) -> int:
+        """Return the number of queries currently executed."""
+
+        with self._usage_changed:
+            return sum(self._usage.values())
+
     def _compile_record(self, result: list, columns) -> dict:
         """Convert the data retrieved as the result of a query
         into a dictionary of field names and their values.
@@ -94,19 +203,41 @@ class Database:
     def _execute_query(self, query: Select|str, data: list = None) -> CursorResult:
         """Execute a database query and return the result."""
 
+        conn = self._acquire()
+
         try:
             if data is None:
-                response = self._conn.execute(query)
+                response = conn.execute(query)
             else:
-                response = self._conn.execute(query, data)
+                response = conn.execute(query, data)
+
+            # the rows must be fetched before the commit, which some
+            # drivers (SQLite) refuse while a statement is in progress
+            if response.returns_rows:
+                response = response.freeze()()
         except:
-            self._conn.connection.rollback()
+            conn.connection.rollback()
+            self._release(conn)
             raise
 
-        self._conn.connection.commit()
+        try:
+            conn.connection.commit()
+        finally:
+            self._release(conn)
 
         return response
 
+    def _is_unique_violation(self, err: IntegrityError) -> bool:
+        """Check if an integrity error was caused by a unique constraint."""
+
+        code = getattr(err.orig, "pgcode", None)
+
+        if code is not None:
+            return code == UNIQUE_VIOLATION
+
+        # drivers that do not report the SQLSTATE code
+        return "unique" in str(err.orig).lower()
+
     def disconnect(self) -> None:
         """Disconnect from the database engine."""
 
@@ -114,6 +245,10 @@ class Database:
             self._conn.close()
             self._conn = None
 
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
     def get_table(self, name: str, schema: str = None) -> Table:
         """Get a database table.
 
@@ -141,7 +276,12 @@ class Database:
             When a table with the specified name does not exist in the database.
         """
 
-        return Table(name, MetaData(), autoload_with = self._conn, schema = schema)
+        conn = self._acquire()
+
+        try:
+            return Table(name, MetaData(), autoload_with = conn, schema = schema)
+        finally:
+            self._release(conn)
 
     def get_record(self, table: Table, key_column: str, key: any) -> dict:
         """Get a record from a database table.
@@ -174,6 +314,117 @@ class Database:
 
         return record
 
+    def iter_records(
+        self, table: Table, columns: list[str],
+        batch_size: int = 1000):
+        """Stream the values of the specified columns of all table records.
+
+        The records are fetched from the server in batches using a server-side
+        cursor, so the whole table is never held in memory at once.
+
+        Parameters:
+        -----------
+        table:
+            The database table to read.
+
+        columns:
+            The names of the columns to retrieve.
+
+        batch_size:
+            The number of records fetched from the server at once.
+
+        Returns:
+        --------
+        A generator of tuples containing the column values of each record.
+        """
+
+        query = select(*[table.c[col] for col in columns])
+        conn = self._acquire()
+
+        try:
+            response = conn.execution_options(
+                stream_results = True, yield_per = batch_size
+            ).execute(query)
+
+            for partition in response.partitions():
+                for row in partition:
+                    yield tuple(row)
+
+            conn.connection.commit()
+        except:
+            conn.connection.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def get_records(self, table: Table, key_column: str, keys: list) -> list[dict]:
+        """Get all records of a database table matching any of the keys.
+
+        Parameters:
+        -----------
+        table:
+            The database table where the records are stored.
+
+        key_column:
+            The name of the column that contains the key values.
+
+        keys:
+            The key values of the records to be retrieved.
+
+        Returns:
+        --------
+        The records retrieved from the database.
+        """
+
+        if len(keys) == 0:
+            return []
+
+        query = select('*').where(table.c[key_column].in_(keys))
+        response = self._execute_query(query)
+        result = response.fetchall()
+
+        return [self._compile_record(row, table.columns) for row in result]
+
+    def create_records(self, table: Table, records: list[dict]) -> list[int]:
+        """Create new records in a single transaction and return their IDs.
+
+        Parameters:
+        -----------
+        table:
+            Database table where the records are created.
+
+        records:
+            Dictionaries of table column names and the corresponding
+            values to be stored. All dictionaries must have the same keys.
+
+        Returns:
+        --------
+        The ID numbers of the created records in the order of the input records.
+
+        Raises:
+        -------
+        DuplicateRecordError:
+            When any of the records violates a unique constraint of the table.
+            None of the records is created in such case.
+        """
+
+        if len(records) == 0:
+            return []
+
+        pk_column = list(table.primary_key.columns)[0]
+        query = table.insert().returning(pk_column, sort_by_parameter_order = True)
+
+        try:
+            response = self._execute_query(query, records)
+        except IntegrityError as err:
+            if self._is_unique_violation(err):
+                raise DuplicateRecordError(
+                    f"A record violates a unique constraint: {err.orig}"
+                ) from err
+            raise
+
+        return [row[0] for row in response.fetchall()]
+
     def create_record(self, table: Table, **params) -> int|None:
         """Create a new record in the database and return it's ID.
 
@@ -189,10 +440,23 @@ class Database:
         --------
         The ID number of the record created in the database table.
         If the operation fails, then None is returned.
+
+        Raises:
+        -------
+        DuplicateRecordError:
+            When the record violates a unique constraint of the table.
         """
 
         query = table.insert().values(params)
-        result = self._execute_query(query)
+
+        try:
+            result = self._execute_query(query)
+        except IntegrityError as err:
+            if self._is_unique_violation(err):
+                raise DuplicateRecordError(
+                    f"The record violates a unique constraint: {err.orig}"
+                ) from err
+            raise
 
         # docasne riesenie. do buducna radsej sprait v tabulke primary key
         if len(result.inserted_primary_key) == 0:
@@ -228,6 +492,91 @@ class Database:
 
         return record
 
+    def delete_records(self, table: Table, column: str, keys: list) -> list[dict]:
+        """Delete all records matching any of the keys in a single transaction.
+
+        Parameters:
+        -----------
+        table:
+            The database table where the records are stored.
+
+        column:
+            The name of the column that contains the key values.
+
+        keys:
+            The key values of the records to be deleted.
+
+        Returns:
+        --------
+        The deleted records.
+        """
+
+        if len(keys) == 0:
+            return []
+
+        query = table.delete().where(table.c[column].in_(keys)).returning(table)
+        response = self._execute_query(query)
+        result = response.fetchall()
+
+        return [self._compile_record(row, table.columns) for row in result]
+
+    def insert_values(
+        self, table: Table, key_column: str,
+        value_column: str, values: dict) -> None:
+        """Insert individual values into a specific field of
+        multiple database records in a single transaction.
+
+        Parameters:
+        -----------
+        table:
+            Database table where the records are stored.
+
+        key_column:
+            The name of the column that contains the key values.
+
+        value_column:
+            The name of the column where the values are stored.
+
+        values:
+            The values to be inserted mapped to the keys of the records.
+        """
+
+        if len(values) == 0:
+            return
+
+        query = table.update().where(
+            table.c[key_column] == bindparam("_key")
+        ).values({value_column: bindparam("_value")})
+
+        data = [{"_key": key, "_value": val} for key, val in values.items()]
+        self._execute_query(query, data)
+
+    def update_records(
+        self, table: Table, key_column: str,
+        keys: list, **values) -> None:
+        """Set the same field values in all records matching any of the keys.
+
+        Parameters:
+        -----------
+        table:
+            Database table where the records are stored.
+
+        key_column:
+            The name of the column that contains the key values.
+
+        keys:
+            The key values of the records to be updated.
+
+        values:
+            Names of table columns and the corresponding values to be stored.
+        """
+
+        if len(keys) == 0:
+            return
+
+        query = table.update().where(table.c[key_column].in_(keys)).values(values)
+        self._execute_query(query)
+
     def insert_value(
         self, table: Table, key_column: str, key: int,
         value_column: str, value: any) -> None:
@@ -272,6 +621,35 @@ class Database:
 
         self._execute_query(query)
 
+    def add_column(self, table: Table, column: sqal.Column) -> bool:
+        """Add a nullable column to an existing database table.
+
+        Parameters:
+        -----------
+        table:
+            Database table the column is added to.
+
+        column:
+            The column to be added, which must not be bound to a table.
+
+        Returns:
+        --------
+        `True` if the column was added, `False` if the table has it already.
+        """
+
+        if column.name in table.c:
+            return False
+
+        preparer = self._engine.dialect.identifier_preparer
+        query = sqal.text(
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ADD COLUMN {preparer.quote(column.name)} "
+            f"{column.type.compile(dialect = self._engine.dialect)} NULL"
+        )
+        self._execute_query(query)
+
+        return True
+
 
 if __name__ == "__main__":
 
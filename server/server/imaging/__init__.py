@@ -0,0 +1,513 @@
+"""
+This module provides the image convolutions shared by the editor
+and the scanner services.
+
+All filters take 2D (grayscale) or 3D (channels last) arrays and return
+an array of the same shape and type. The image is extended beyond its
+edges as by `numpy.pad` with the given mode, so the filters never see
+a border.
+
+The filters run along one axis at a time over strips of rows: the
+filters along the columns run on the transposed image. The strips are
+processed by a shared thread pool, since NumPy releases the GIL in the
+array operations.
+
+    box_blur            running sums, a constant cost per pixel for any radius
+    gaussian_blur       three box blurs approximating a Gaussian
+    convolve1d          a kernel along one axis, one pass per kernel tap
+    convolve_separable  a kernel along both axes
+    convolve_fft        a 2D kernel in the frequency domain, for large kernels
+    convolve            picks the fastest of the above for a 2D kernel
+"""
+
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+# the minimum number of rows of a strip processed by a thread
+MIN_STRIP_ROWS = 64
+
+# the direct 2D convolution is used up to this number of kernel taps
+MAX_DIRECT_TAPS = 49
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# the number of threads processing the strips, one per CPU if not set
+_max_threads = None
+
+
+def _after_fork_in_child() -> None:
+    """Drop the thread pool inherited from the parent process,
+    whose threads do not exist in the child."""
+
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _after_fork_in_child)
+
+
+def set_max_threads(count: int|None) -> None:
+    """Limit the number of threads processing the strips, for example
+    to one in the worker processes of a pool that already uses every CPU.
+    With None, one thread per CPU is used."""
+
+    global _executor, _max_threads
+
+    if count is not None and count <= 0:
+        raise ValueError("The number of threads must be a positive integer!")
+
+    with _executor_lock:
+        _max_threads = count
+
+        # the pool is created again with the new size on its next use
+        if _executor is not None:
+            _executor.shutdown(wait = False)
+            _executor = None
+
+
+def get_executor() -> ThreadPoolExecutor|None:
+    """Return the thread pool the strips are processed by,
+    or None for a single thread, which processes the strips in turn."""
+
+    global _executor
+
+    workers = _max_threads or os.cpu_count() or 1
+    if workers == 1:
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers = workers, thread_name_prefix = "imaging")
+
+    return _executor
+
+
+# ====== strips ======
+def _map_strips(func: Callable, src: np.ndarray, out: np.ndarray, halo: int) -> np.ndarray:
+    """Compute the output rows in strips.
+
+    Parameters:
+    -----------
+    func:
+    Computes the output rows from the source rows, the strip
+    and the `halo` rows below it, and writes them into the output.
+
+    src:
+    The source rows, `halo` rows more than the output rows.
+
+    out:
+    The output rows.
+
+    halo:
+    The number of extra source rows a strip needs.
+
+    Returns:
+    --------
+    The output rows.
+    """
+
+    rows = out.shape[0]
+    executor = get_executor()
+    strips = 1 if executor is None else min(
+        os.cpu_count(), max(1, rows // MIN_STRIP_ROWS))
+
+    bounds = [rows * idx // strips for idx in range(strips + 1)]
+    tasks = [
+        (src[top:bottom + halo], out[top:bottom])
+        for top, bottom in zip(bounds[:-1], bounds[1:])
+    ]
+
+    if strips == 1:
+        func(*tasks[0])
+    else:
+        # the results are consumed to raise the exceptions of the threads
+        list(executor.map(lambda task: func(*task), tasks))
+
+    return out
+
+
+def _along_axis(func: Callable, img: np.ndarray, halo: int, axis: int) -> np.ndarray:
+    """Run a filter over the rows of the image, or over the columns of
+    an image transposed so that the filter always works on contiguous rows.
+
+    The image must be extended by `halo` along the axis,
+    the result is `halo` shorter along the axis.
+    """
+
+    if axis == 1:
+        img = np.ascontiguousarray(np.swapaxes(img, 0, 1))
+
+    out = np.empty((img.shape[0] - halo,) + img.shape[1:], dtype = np.float32)
+    _map_strips(func, img, out, halo)
+
+    return np.swapaxes(out, 0, 1) if axis == 1 else out
+
+
+def _to_dtype(img: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Convert the filtered image to the type of the source image.
+    The filtered image is rounded in place."""
+
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        np.rint(img, out = img)
+        np.clip(img, info.min, info.max, out = img)
+
+    return img.astype(dtype, order = 'C', copy = False)
+
+
+def _pad(img: np.ndarray, before: tuple, after: tuple, mode: str) -> np.ndarray:
+    """Extend the image along the rows and the columns."""
+
+    pad_width = [(before[0], after[0]), (before[1], after[1])]
+    pad_width += [(0, 0)] * (img.ndim - 2)
+
+    return np.pad(img, pad_width, mode = mode)
+
+
+# ====== running sums ======
+def _running_sums(src: np.ndarray, out: np.ndarray, sizes: tuple) -> None:
+    """Compute repeated running sums of the source rows.
+
+    Each pass sums `size` consecutive rows: the sum is updated by adding
+    the row entering the window and subtracting the row leaving it, so
+    the cost per pixel does not depend on the size.
+    """
+
+    for size in sizes:
+        rows = src.shape[0] - size + 1
+        dst = out if rows == out.shape[0] else np.empty(
+            (rows,) + src.shape[1:], dtype = np.float32)
+
+        acc = src[:size].sum(axis = 0, dtype = np.float32)
+        dst[0] = acc
+
+        for row in range(1, rows):
+            acc += src[row + size - 1]
+            acc -= src[row - 1]
+            dst[row] = acc
+
+        dst *= np.float32(1 / size)
+        src = dst
+
+
+def _box_sizes(sigma: float, passes: int = 3) -> tuple:
+    """Return the odd box sizes whose repeated box blurs approximate
+    a Gaussian blur with the standard deviation sigma."""
+
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+
+    # the number of the smaller boxes giving the closest variance
+    smaller = round(
+        (12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+        / (-4 * lower - 4))
+    smaller = min(passes, max(0, smaller))
+
+    return (lower,) * smaller + (upper,) * (passes - smaller)
+
+
+def _blur_boxes(img: np.ndarray, sizes: tuple, mode: str) -> np.ndarray:
+    """Apply box blurs of the given odd sizes along both axes."""
+
+    halo = sum(sizes) - len(sizes)
+    if halo == 0:
+        return img.copy()
+
+    padded = _pad(img, (halo // 2, halo // 2), (halo // 2, halo // 2), mode)
+
+    def run(src: np.ndarray, out: np.ndarray) -> None:
+        _running_sums(src, out, sizes)
+
+    out = _along_axis(run, padded, halo, 0)
+    out = _along_axis(run, out, halo, 1)
+
+    return _to_dtype(out, img.dtype)
+
+
+def box_blur(img: np.ndarray, radius: int, mode: str = 'edge') -> np.ndarray:
+    """Blur the image by averaging the square window around each pixel.
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    radius:
+    The window extends by the radius on each side of the pixel.
+    A radius larger than the image is clamped to the image size,
+    the window then covers the whole image from any pixel.
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The blurred image.
+    """
+
+    if radius < 0:
+        raise ValueError("The radius must not be negative!")
+
+    # the image is padded by the radius, which must not grow past the image
+    radius = min(radius, max(img.shape[:2]))
+
+    return _blur_boxes(img, (2 * radius + 1,), mode)
+
+
+def gaussian_blur(img: np.ndarray, sigma: float, mode: str = 'edge') -> np.ndarray:
+    """Blur the image by three box blurs, which approximate
+    a Gaussian blur within a few percent.
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    sigma:
+    The standard deviation of the Gaussian in pixels.
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The blurred image.
+    """
+
+    if sigma < 0:
+        raise ValueError("The standard deviation must not be negative!")
+
+    return _blur_boxes(img, _box_sizes(sigma), mode)
+
+
+# ====== kernels ======
+def _check_kernel(kernel: np.ndarray, ndim: int) -> np.ndarray:
+    """Validate the kernel shape."""
+
+    kernel = np.asarray(kernel, dtype = np.float32)
+
+    if kernel.ndim != ndim or 0 in kernel.shape:
+        raise ValueError(f"The kernel must be a non-empty {ndim}D array!")
+
+    if any(size % 2 == 0 for size in kernel.shape):
+        raise ValueError("The kernel sizes must be odd!")
+
+    return kernel
+
+
+def _correlate_rows(src: np.ndarray, out: np.ndarray, kernel: np.ndarray) -> None:
+    """Sum the source rows shifted by the kernel taps and weighted by them."""
+
+    rows = out.shape[0]
+    np.multiply(src[:rows], kernel[0], out = out)
+
+    for idx in range(1, len(kernel)):
+        if kernel[idx] != 0:
+            out += kernel[idx] * src[idx:idx + rows]
+
+
+def convolve1d(
+    img: np.ndarray, kernel: np.ndarray,
+    axis: int = 0, mode: str = 'edge') -> np.ndarray:
+    """Convolve the image with a 1D kernel along an axis.
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    kernel:
+    The kernel of an odd size.
+
+    axis:
+    0 convolves the columns, 1 convolves the rows.
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The convolved image.
+    """
+
+    kernel = _check_kernel(kernel, 1)[::-1]
+    half = len(kernel) // 2
+    before = (half, 0) if axis == 0 else (0, half)
+    padded = _pad(img, before, before, mode)
+
+    def run(src: np.ndarray, out: np.ndarray) -> None:
+        _correlate_rows(src, out, kernel)
+
+    return _to_dtype(_along_axis(run, padded, 2 * half, axis), img.dtype)
+
+
+def convolve_separable(
+    img: np.ndarray, kernel_y: np.ndarray,
+    kernel_x: np.ndarray = None, mode: str = 'edge') -> np.ndarray:
+    """Convolve the image with a separable kernel, the outer
+    product of a column and a row kernel.
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    kernel_y:
+    The kernel along the columns, of an odd size.
+
+    kernel_x:
+    The kernel along the rows (default: None, same as kernel_y).
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The convolved image.
+    """
+
+    kernel_y = _check_kernel(kernel_y, 1)[::-1]
+    kernel_x = kernel_y if kernel_x is None else _check_kernel(kernel_x, 1)[::-1]
+    half_y, half_x = len(kernel_y) // 2, len(kernel_x) // 2
+    padded = _pad(img, (half_y, half_x), (half_y, half_x), mode)
+
+    out = _along_axis(
+        lambda src, out: _correlate_rows(src, out, kernel_y), padded, 2 * half_y, 0)
+    out = _along_axis(
+        lambda src, out: _correlate_rows(src, out, kernel_x), out, 2 * half_x, 1)
+
+    return _to_dtype(out, img.dtype)
+
+
+def next_fast_size(size: int) -> int:
+    """Return the smallest size of at least `size` whose prime
+    factors are 2, 3 and 5, for which the FFT is fast."""
+
+    best = 2 ** math.ceil(math.log2(size))
+    power5 = 1
+
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            # the smallest power of two making the product large enough
+            candidate = power35 * 2 ** max(0, math.ceil(math.log2(size / power35)))
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+
+    return best
+
+
+def convolve_fft(img: np.ndarray, kernel: np.ndarray, mode: str = 'edge') -> np.ndarray:
+    """Convolve the image with a 2D kernel in the frequency domain,
+    at a cost per pixel growing with the logarithm of the kernel size.
+    The strips are convolved separately (overlap-save).
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    kernel:
+    The 2D kernel of odd sizes.
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The convolved image.
+    """
+
+    kernel = _check_kernel(kernel, 2)
+    half_y, half_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    padded = _pad(img, (half_y, half_x), (half_y, half_x), mode)
+    width = padded.shape[1]
+
+    # the spectra of the kernel mapped to the strip heights
+    spectra = {}
+    spectra_lock = threading.Lock()
+
+    def run(src: np.ndarray, out: np.ndarray) -> None:
+        shape = (next_fast_size(src.shape[0]), next_fast_size(width))
+
+        with spectra_lock:
+            spectrum = spectra.get(shape)
+            if spectrum is None:
+                spectrum = np.fft.rfft2(kernel, shape)
+                spectra[shape] = spectrum
+
+        if src.ndim == 3:
+            spectrum = spectrum[..., None]
+
+        # the circular convolution equals the linear one
+        # past the first kernel rows and columns
+        src = src.astype(np.float32, copy = False)
+        full = np.fft.irfft2(
+            np.fft.rfft2(src, shape, axes = (0, 1)) * spectrum, shape, axes = (0, 1))
+        out[:] = full[2 * half_y:src.shape[0], 2 * half_x:width]
+
+    out = np.empty((padded.shape[0] - 2 * half_y, img.shape[1]) + img.shape[2:], dtype = np.float32)
+    _map_strips(run, padded, out, 2 * half_y)
+
+    return _to_dtype(out, img.dtype)
+
+
+def convolve(img: np.ndarray, kernel: np.ndarray, mode: str = 'edge') -> np.ndarray:
+    """Convolve the image with a 2D kernel by the fastest method:
+    separable kernels along each axis, small kernels directly
+    and large kernels in the frequency domain.
+
+    Parameters:
+    -----------
+    img:
+    The image, 2D or 3D with the channels last.
+
+    kernel:
+    The 2D kernel of odd sizes.
+
+    mode:
+    How the image is extended beyond its edges, see `numpy.pad`.
+
+    Returns:
+    --------
+    The convolved image.
+    """
+
+    kernel = _check_kernel(kernel, 2)
+
+    # a kernel of rank one is the outer product of two 1D kernels
+    left, values, right = np.linalg.svd(kernel)
+    if values[1:].sum() <= 1e-6 * values[0]:
+        scale = np.sqrt(values[0])
+        return convolve_separable(img, left[:, 0] * scale, right[0] * scale, mode)
+
+    if kernel.size > MAX_DIRECT_TAPS:
+        return convolve_fft(img, kernel, mode)
+
+    flipped = kernel[::-1, ::-1]
+    half_y, half_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    padded = _pad(img, (half_y, half_x), (half_y, half_x), mode)
+    width = img.shape[1]
+
+    def run(src: np.ndarray, out: np.ndarray) -> None:
+        out[:] = 0
+        for dy, dx in zip(*np.nonzero(flipped)):
+            out += flipped[dy, dx] * src[dy:dy + out.shape[0], dx:dx + width]
+
+    out = np.empty(img.shape, dtype = np.float32)
+    _map_strips(run, padded, out, 2 * half_y)
+
+    return _to_dtype(out, img.dtype)
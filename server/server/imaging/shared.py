@@ -0,0 +1,336 @@
+"""
+This module shares pixel arrays between the server process and the
+worker processes through `multiprocessing.shared_memory` segments, so
+that an image is not pickled and piped to a worker and back.
+
+The server process owns the segments through a `SharedArrayPool`. An
+array is allocated from the pool, filled and sent to a worker as a
+`SharedArray`, a handle naming the segment, the shape and the type of
+the array, which pickles to a hundred bytes whatever the size of the
+image. The worker maps the segment and reads and writes the pixels in
+place.
+
+The segments are rounded up to a size class, a power of two, and a
+released segment is kept on the free list of its class for the next
+array of that class rather than unlinked, since a new segment costs a
+page fault per page on its first use. The free segments above the
+cache limit are unlinked.
+
+A segment is released by the pool that allocated it, once, after the
+workers are done with it. A worker never unlinks a segment, it unmaps
+the segments of a job once the job ends, since the pool may unlink them
+and a mapping would keep their memory in use. On POSIX, opening a segment
+registers it with the resource tracker, which the workers share with
+the server process, so the segments are unregistered when the pool
+unlinks them and the tracker unlinks only those leaked by a crash.
+"""
+
+import itertools
+import math
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# the smallest segment, the arrays below it share its size class
+MIN_SEGMENT_SIZE = 64 * 1024
+
+# the number of segments a process not owning them keeps mapped
+MAX_ATTACHED = 8
+
+# the segments of the pools of this process mapped to their names
+_owned = {}
+
+# the segments opened by this process, the most recently used last
+_attached = OrderedDict()
+_attached_lock = threading.Lock()
+
+
+def _after_fork_in_child() -> None:
+    """Forget the segments of the parent process, which the child
+    neither owns nor has opened itself."""
+
+    global _owned, _attached, _attached_lock
+    _owned = {}
+    _attached = OrderedDict()
+    _attached_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _after_fork_in_child)
+
+
+def size_class(nbytes: int) -> int:
+    """Return the size of the segment holding the given number of bytes."""
+    return max(MIN_SEGMENT_SIZE, 1 << (nbytes - 1).bit_length())
+
+
+def _attach(name: str) -> SharedMemory:
+    """Return the segment of the given name, open it if needed
+    and unmap the least recently used segments no longer in use."""
+
+    with _attached_lock:
+        segment = _attached.get(name)
+
+        if segment is not None:
+            _attached.move_to_end(name)
+            return segment
+
+        segment = SharedMemory(name)
+        _attached[name] = segment
+
+        excess = len(_attached) - MAX_ATTACHED
+        for old in list(_attached)[:-1]:
+            if excess <= 0:
+                break
+
+            # a segment still viewed by an array cannot be unmapped
+            try:
+                _attached[old].close()
+            except BufferError:
+                continue
+
+            del _attached[old]
+            excess -= 1
+
+        return segment
+
+
+class SharedArray:
+    """A handle of an array in a shared memory segment, which can be
+    sent to another process and opened there."""
+
+    def __init__(self, name: str, shape: tuple, dtype: np.dtype, key: int = 0) -> None:
+        """Initialize the handle.
+
+        Parameters:
+        -----------
+        name:
+        The name of the segment.
+
+        shape:
+        The shape of the array.
+
+        dtype:
+        The type of the array elements.
+
+        key:
+        The number of the allocation, which tells apart the arrays
+        allocated in turn in the same segment.
+        """
+
+        self.name = name
+        self.shape = tuple(int(length) for length in shape)
+        self.dtype = np.dtype(dtype).str
+        self.key = key
+
+    @property
+    def nbytes(self) -> int:
+        """Return the size of the array in bytes."""
+        return math.prod(self.shape) * np.dtype(self.dtype).itemsize
+
+    def open(self) -> np.ndarray:
+        """Return the array as a view of the segment, which is mapped
+        in this process on the first call. The view must not outlive
+        the allocation of the array."""
+
+        segment = _owned.get(self.name) or _attach(self.name)
+
+        return np.ndarray(self.shape, self.dtype, buffer = segment.buf)
+
+    def close(self) -> None:
+        """Unmap the segment of the array in this process, unless the
+        process owns it. The views of the array must be deleted first,
+        otherwise the segment stays mapped until it is evicted."""
+
+        with _attached_lock:
+            segment = _attached.pop(self.name, None)
+
+            if segment is None:
+                return
+
+            try:
+                segment.close()
+            except BufferError:
+                _attached[self.name] = segment
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, SharedArray) and (
+            self.name, self.shape, self.dtype, self.key) == (
+            other.name, other.shape, other.dtype, other.key)
+
+    def __hash__(self) -> int:
+        return hash((self.name, self.shape, self.dtype, self.key))
+
+    def __repr__(self) -> str:
+        return f"SharedArray({self.name!r}, {self.shape}, {self.dtype!r}, {self.key})"
+
+
+class SharedArrayPool:
+    """Allocator of the arrays in shared memory segments,
+    which reuses the released segments by their size class."""
+
+    def __init__(self, max_cached_bytes: int = 512 * 1024 ** 2) -> None:
+        """Initialize the pool. No segment is created until
+        the first array is allocated.
+
+        Parameters:
+        -----------
+        max_cached_bytes:
+        The largest total size of the released segments kept for reuse.
+        """
+
+        if max_cached_bytes < 0:
+            raise ValueError("The cache size cannot be negative!")
+
+        self._max_cached_bytes = max_cached_bytes
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # the segments and their sizes mapped to their names, the keys of
+        # the allocations mapped to the names of the allocated segments,
+        # and the names of the free segments by size class
+        self._segments = {}
+        self._sizes = {}
+        self._used = {}
+        self._free = {}
+        self._cached_bytes = 0
+        self._keys = itertools.count(1)
+
+        # the allocations served by a free segment and by a new one
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def used_bytes(self) -> int:
+        """Return the total size of the allocated segments."""
+
+        with self._lock:
+            return sum(self._sizes[name] for name in self._used)
+
+    @property
+    def cached_bytes(self) -> int:
+        """Return the total size of the free segments kept for reuse."""
+        return self._cached_bytes
+
+    def allocate(self, shape: tuple, dtype: np.dtype = np.uint8) -> SharedArray:
+        """Allocate an array, its content is undefined.
+
+        Parameters:
+        -----------
+        shape:
+        The shape of the array.
+
+        dtype:
+        The type of the array elements.
+
+        Returns:
+        --------
+        The handle of the array, to be released by `release`.
+        """
+
+        nbytes = math.prod(shape) * np.dtype(dtype).itemsize
+        size = size_class(nbytes)
+
+        with self._lock:
+            if self._closed:
+                raise ValueError("The pool is closed!")
+
+            free = self._free.get(size)
+            if free:
+                name = free.pop()
+                self._cached_bytes -= size
+                self._used[name] = key = next(self._keys)
+                self.hits += 1
+
+                return SharedArray(name, shape, dtype, key)
+
+        # creating a large segment takes a while, out of the lock
+        segment = SharedMemory(create = True, size = size)
+
+        with self._lock:
+            if self._closed:
+                segment.close()
+                segment.unlink()
+                raise ValueError("The pool is closed!")
+
+            self._segments[segment.name] = segment
+            self._sizes[segment.name] = size
+            self._used[segment.name] = key = next(self._keys)
+            _owned[segment.name] = segment
+            self.misses += 1
+
+        return SharedArray(segment.name, shape, dtype, key)
+
+    def share(self, array: np.ndarray) -> SharedArray:
+        """Allocate a copy of the array."""
+
+        handle = self.allocate(array.shape, array.dtype)
+        np.copyto(handle.open(), array)
+
+        return handle
+
+    def release(self, handle: SharedArray) -> None:
+        """Release an array, whose segment is then reused or unlinked.
+        No process may use the array afterwards.
+
+        Raises:
+        -------
+        ValueError:
+        If the array is not allocated by the pool or already released.
+        """
+
+        with self._lock:
+            # the handle of a released array does not release
+            # the next array allocated in the segment
+            if self._used.get(handle.name) != handle.key:
+                raise ValueError(f"The array {handle!r} is not allocated by the pool!")
+
+            del self._used[handle.name]
+            size = self._sizes[handle.name]
+
+            if self._cached_bytes + size <= self._max_cached_bytes:
+                self._free.setdefault(size, []).append(handle.name)
+                self._cached_bytes += size
+                return
+
+            segment = self._forget(handle.name)
+
+        self._unlink(segment)
+
+    def _forget(self, name: str) -> SharedMemory:
+        """Remove a segment from the pool, the lock must be held."""
+
+        del self._sizes[name]
+        _owned.pop(name, None)
+
+        return self._segments.pop(name)
+
+    def _unlink(self, segment: SharedMemory) -> None:
+        """Unmap and remove a segment."""
+
+        # the arrays still viewing the segment keep it mapped
+        # until they are deleted
+        try:
+            segment.close()
+        except BufferError:
+            pass
+
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """Unlink all segments, the allocated ones included."""
+
+        with self._lock:
+            self._closed = True
+            segments = [self._forget(name) for name in list(self._segments)]
+            self._used.clear()
+            self._free.clear()
+            self._cached_bytes = 0
+
+        for segment in segments:
+            self._unlink(segment)
@@ -0,0 +1,356 @@
+"""
+This module provides a non-blocking logging pipeline for the application.
+
+The logger puts the log records into a bounded queue and returns at once;
+a background thread takes the records from the queue in batches, passes
+them to the handlers and flushes the handlers once per batch. Thus the
+request threads never wait for the console or the disk. If the queue is
+full, the record is dropped and counted rather than blocking the caller.
+
+The levels of the loggers and handlers are read from the logging config
+file, which is checked for changes by the background thread, so that the
+levels can be changed without restarting the server.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import weakref
+from logging import getLogger, Handler, Logger, LogRecord
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+import yaml
+
+# the pipelines to be restarted in a child process after a fork
+_live_pipelines = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    """Restart the pipelines inherited from the parent process."""
+
+    for pipeline in list(_live_pipelines):
+        pipeline.after_fork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _after_fork_in_child)
+
+
+# ====== handlers ======
+class DroppingQueueHandler(QueueHandler):
+    """Puts the log records into a bounded queue without blocking.
+    The records that do not fit into the queue are dropped."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    @property
+    def dropped(self) -> int:
+        """Return the number of records dropped since the start."""
+        return self._dropped
+
+    def enqueue(self, record: LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+
+
+class BatchFileHandler(RotatingFileHandler):
+    """A rotating file handler that does not flush after every record.
+    The stream is flushed by the listener once per batch of records."""
+
+    def flush(self) -> None:
+        # called by emit() after every record
+        pass
+
+    def flush_batch(self) -> None:
+        """Flush the records written since the last flush."""
+        super().flush()
+
+    def close(self) -> None:
+        self.flush_batch()
+        super().close()
+
+
+# ====== listener ======
+class BatchingQueueListener:
+    """Takes the log records from a queue in batches in a background
+    thread and passes them to the handlers."""
+
+    def __init__(
+        self, log_queue: queue.Queue, handlers: list[Handler],
+        batch_size: int = 256, on_idle = None, idle_interval: float = 1.0) -> None:
+        """Initialize the listener.
+
+        Parameters:
+        -----------
+        log_queue:
+        The queue filled by a `DroppingQueueHandler`.
+
+        handlers:
+        The handlers writing the records.
+
+        batch_size:
+        The maximum number of records written between two flushes.
+
+        on_idle:
+        A function called by the background thread at least every
+        `idle_interval` seconds (default: None).
+
+        idle_interval:
+        The time in seconds between the calls of `on_idle`.
+        """
+
+        if batch_size <= 0:
+            raise ValueError("The batch size must be a positive integer!")
+
+        self.queue = log_queue
+        self.handlers = handlers
+        self._batch_size = batch_size
+        self._on_idle = on_idle
+        self._idle_interval = idle_interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start the background thread."""
+
+        if self._thread is not None:
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target = self._run, name = "log-writer", daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and write the queued records."""
+
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+        # the records queued while stopping
+        while self._write_batch(self._take_batch(block = False)):
+            pass
+
+    def reset(self, log_queue: queue.Queue) -> None:
+        """Forget the thread and use a new queue. Called in a child
+        process after a fork, where the thread no longer exists."""
+
+        self.queue = log_queue
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _take_batch(self, block: bool) -> list[LogRecord]:
+        """Take up to a batch of records from the queue. If blocking,
+        wait for the first record up to the idle interval."""
+
+        batch = []
+
+        try:
+            if block:
+                batch.append(self.queue.get(timeout = self._idle_interval))
+
+            while len(batch) < self._batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        return batch
+
+    def _write_batch(self, batch: list[LogRecord]) -> int:
+        """Pass the records to the handlers and flush the handlers."""
+
+        if len(batch) == 0:
+            return 0
+
+        for record in batch:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        for handler in self.handlers:
+            try:
+                if isinstance(handler, BatchFileHandler):
+                    handler.flush_batch()
+                else:
+                    handler.flush()
+            except Exception:
+                handler.handleError(batch[-1])
+
+        return len(batch)
+
+    def _run(self) -> None:
+        """Write the queued records until stopped."""
+
+        last_idle = time.monotonic()
+
+        while not self._stopping.is_set():
+            self._write_batch(self._take_batch(block = True))
+
+            if self._on_idle is not None and (
+                time.monotonic() - last_idle >= self._idle_interval):
+                last_idle = time.monotonic()
+                try:
+                    self._on_idle()
+                except Exception as err:
+                    # the logger itself may be broken
+                    print(f"Logging pipeline error: {err}", file = sys.stderr)
+
+
+# ====== pipeline ======
+class LoggingPipeline:
+    """Routes the records of a logger through a bounded
+    queue to its handlers written by a background thread."""
+
+    def __init__(
+        self, logger: Logger, config_path: str = None,
+        max_queue_size: int = 10000, batch_size: int = 256,
+        check_interval: float = 1.0) -> None:
+        """Move the handlers of the logger behind a queue.
+
+        Parameters:
+        -----------
+        logger:
+        The logger with the handlers already configured.
+
+        config_path:
+        The YAML logging config file the levels are read from whenever
+        it changes (default: None, the levels are not reloaded).
+
+        max_queue_size:
+        The maximum number of records waiting to be written.
+
+        batch_size:
+        The maximum number of records written between two flushes.
+
+        check_interval:
+        The time in seconds between the checks of the config file
+        and the reports of the dropped records.
+        """
+
+        if max_queue_size <= 0:
+            raise ValueError("The queue size must be a positive integer!")
+
+        self._logger = logger
+        self._config_path = config_path
+        self._config_mtime = self._get_config_mtime()
+        self._max_queue_size = max_queue_size
+        self._reported_drops = 0
+
+        handlers = list(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+        log_queue = queue.Queue(max_queue_size)
+        self._queue_handler = DroppingQueueHandler(log_queue)
+        self._listener = BatchingQueueListener(
+            log_queue, handlers, batch_size,
+            on_idle = self._on_idle, idle_interval = check_interval
+        )
+        logger.addHandler(self._queue_handler)
+
+        _live_pipelines.add(self)
+
+    @property
+    def dropped(self) -> int:
+        """Return the number of records dropped since the start."""
+        return self._queue_handler.dropped
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of records waiting to be written."""
+        return self._queue_handler.queue.qsize()
+
+    @property
+    def handlers(self) -> list[Handler]:
+        """Return the handlers behind the queue."""
+        return self._listener.handlers
+
+    def start(self) -> None:
+        """Start writing the queued records."""
+
+        self._listener.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stop the background thread and write the queued records."""
+
+        atexit.unregister(self.stop)
+        self._listener.stop()
+
+    def after_fork(self) -> None:
+        """Restart the background thread with an empty queue.
+        The records queued before the fork are written by the parent."""
+
+        log_queue = queue.Queue(self._max_queue_size)
+        self._queue_handler.queue = log_queue
+        self._listener.reset(log_queue)
+        self._listener.start()
+
+    def _get_config_mtime(self) -> int|None:
+        """Return the modification time of the config file."""
+
+        if self._config_path is None:
+            return None
+
+        try:
+            return os.stat(self._config_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload_levels(self) -> None:
+        """Apply the levels of the loggers and handlers from the config file.
+
+        Only the levels are applied, the handlers themselves are kept.
+        A handler is matched by the name it is configured under.
+        """
+
+        with open(self._config_path, encoding = "utf-8") as fs:
+            log_config = yaml.safe_load(fs.read())
+
+        for name, logger_config in log_config.get("loggers", {}).items():
+            if "level" in logger_config:
+                getLogger(name).setLevel(logger_config["level"])
+
+        handlers = {handler.name: handler for handler in self.handlers}
+        for name, handler_config in log_config.get("handlers", {}).items():
+            if name in handlers:
+                handlers[name].setLevel(handler_config.get("level", logging.NOTSET))
+
+    def _report(self, level: int, msg: str, *args) -> None:
+        """Write a record directly to the handlers. Called by the
+        background thread, bypassing the queue, which may be full."""
+
+        record = self._logger.makeRecord(
+            self._logger.name, level, __file__, 0, msg, args, None)
+        self._listener._write_batch([record])
+
+    def _on_idle(self) -> None:
+        """Report the dropped records and reload the changed levels."""
+
+        dropped = self.dropped
+        if dropped > self._reported_drops:
+            self._report(
+                logging.WARNING, "Log queue full: %d records dropped.",
+                dropped - self._reported_drops
+            )
+            self._reported_drops = dropped
+
+        mtime = self._get_config_mtime()
+        if mtime is not None and mtime != self._config_mtime:
+            self._config_mtime = mtime
+            self.reload_levels()
+            self._report(
+                logging.INFO, "Logging levels reloaded from: %s", self._config_path)
@@ -0,0 +1,431 @@
+"""
+This module provides the metrics of the application in the
+Prometheus text exposition format.
+
+Counters and histograms are recorded into per-thread shards: a thread
+only ever writes into its own shard, so recording takes no lock, not
+even the first record of a new thread. The shards are summed up when
+the metrics are collected. The collection also merges the shards of
+the threads that ended into a single retired shard, so that the number
+of shards stays bounded by the number of threads started between two
+collections.
+
+Gauges are computed by callbacks when the metrics are collected.
+"""
+
+import inspect
+import threading
+from collections import deque
+import time
+from abc import abstractmethod, ABCMeta
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable
+
+# the default histogram buckets in seconds
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Format the labels of a sample."""
+
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format the value of a sample."""
+
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ====== metrics ======
+class _ShardedMetric(metaclass=ABCMeta):
+    """A metric recorded into per-thread shards."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._new_shards = deque() # the shards registered since the last collection
+        self._shards = []          # tuples of the thread and the shard
+        self._retired = {}         # the merged shards of the ended threads
+
+    @abstractmethod
+    def _new_value(self) -> any:
+        """Return the initial value of a label combination."""
+
+    @abstractmethod
+    def _merge_value(self, dst: any, src: any) -> any:
+        """Add a value to another one and return the sum."""
+
+    def _shard(self) -> dict:
+        """Return the shard of the current thread."""
+
+        try:
+            return self._local.shard
+        except AttributeError:
+            pass
+
+        # the deque is appended to without a lock, it is
+        # only emptied by the collection, under the lock
+        shard = {}
+        self._local.shard = shard
+        self._new_shards.append((threading.current_thread(), shard))
+
+        return shard
+
+    def _retire_ended(self) -> None:
+        """Adopt the new shards and merge the shards of the ended
+        threads. Called under the lock."""
+
+        while self._new_shards:
+            self._shards.append(self._new_shards.popleft())
+
+        live = []
+
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+
+            for key, value in list(shard.items()):
+                self._retired[key] = self._merge_value(
+                    self._retired.get(key, self._new_value()), value)
+
+        self._shards = live
+
+    def snapshot(self) -> dict:
+        """Return the values summed up over all shards."""
+
+        with self._lock:
+            self._retire_ended()
+            shards = [shard for _, shard in self._shards]
+            total = {
+                key: self._merge_value(self._new_value(), value)
+                for key, value in self._retired.items()
+            }
+
+        for shard in shards:
+            # the shard may be extended by its thread meanwhile
+            for key, value in list(shard.items()):
+                total[key] = self._merge_value(
+                    total.get(key, self._new_value()), value)
+
+        return total
+
+
+class Counter(_ShardedMetric):
+    """A monotonically increasing value."""
+
+    kind = "counter"
+
+    def _new_value(self) -> float:
+        return 0
+
+    def _merge_value(self, dst: float, src: float) -> float:
+        return dst + src
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        """Increase the counter of the label values."""
+
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        """Return the counter of the label values."""
+        return self.snapshot().get(label_values, 0)
+
+    def expose(self) -> list[str]:
+        """Return the samples in the text exposition format."""
+
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self.snapshot().items())
+        ]
+
+
+class Histogram(_ShardedMetric):
+    """Counts the observed values in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, doc: str, labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS) -> None:
+        """Initialize the histogram.
+
+        Parameters:
+        -----------
+        name:
+        The metric name.
+
+        doc:
+        The description of the metric.
+
+        labels:
+        The label names.
+
+        buckets:
+        The upper bounds of the buckets in increasing order.
+        """
+
+        super().__init__(name, doc, labels)
+
+        if list(buckets) != sorted(buckets):
+            raise ValueError("The buckets must be in increasing order!")
+
+        self.buckets = tuple(buckets)
+
+    def _new_value(self) -> list:
+        # the bucket counts, the count of larger values and the sum
+        return [0] * (len(self.buckets) + 2)
+
+    def _merge_value(self, dst: list, src: list) -> list:
+        for idx, value in enumerate(src):
+            dst[idx] += value
+        return dst
+
+    def observe(self, value: float, *label_values) -> None:
+        """Record a value of the label values."""
+
+        shard = self._shard()
+        counts = shard.get(label_values)
+
+        if counts is None:
+            counts = self._new_value()
+            shard[label_values] = counts
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *label_values):
+        """Return a context manager recording its duration in seconds."""
+        return _Timer(self, label_values)
+
+    def expose(self) -> list[str]:
+        """Return the samples in the text exposition format."""
+
+        lines = []
+
+        for key, counts in sorted(self.snapshot().items()):
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labels, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class _Timer:
+    """Records the duration of a code block into a histogram."""
+
+    def __init__(self, histogram: Histogram, label_values: tuple) -> None:
+        self._histogram = histogram
+        self._label_values = label_values
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(
+            time.perf_counter() - self._start, *self._label_values)
+
+
+class Gauge:
+    """A value computed by a callback when the metrics are collected."""
+
+    def __init__(
+        self, name: str, doc: str, func: Callable[[], float|dict|None],
+        labels: tuple = (), kind: str = "gauge") -> None:
+        """Initialize the gauge.
+
+        Parameters:
+        -----------
+        name:
+        The metric name.
+
+        doc:
+        The description of the metric.
+
+        func:
+        Returns the value, or the values mapped to the tuples of the label
+        values, or None if the value is not available.
+
+        labels:
+        The label names.
+
+        kind:
+        The metric type, 'counter' for values that only increase.
+        """
+
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._func = func
+
+    def expose(self) -> list[str]:
+        """Return the samples in the text exposition format."""
+
+        values = self._func()
+
+        if values is None:
+            return []
+
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+# ====== registry ======
+class MetricsRegistry:
+    """Holds the metrics of the application."""
+
+    def __init__(self) -> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric) -> any:
+        """Add a metric, return the registered metric of the same name."""
+
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, doc: str, labels: tuple = ()) -> Counter:
+        """Register a counter."""
+        return self._register(Counter(name, doc, labels))
+
+    def histogram(
+        self, name: str, doc: str, labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        """Register a histogram."""
+        return self._register(Histogram(name, doc, labels, buckets))
+
+    def gauge(
+        self, name: str, doc: str, func: Callable,
+        labels: tuple = (), kind: str = "gauge") -> Gauge:
+        """Register a gauge computed by a callback."""
+        return self._register(Gauge(name, doc, func, labels, kind))
+
+    def get(self, name: str) -> any:
+        """Return the registered metric of the name."""
+        return self._metrics[name]
+
+    def expose(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose())
+
+        return "\n".join(lines) + "\n"
+
+
+def instrument(obj: object, component: str, histogram: Histogram, errors: Counter) -> object:
+    """Record the duration and the errors of the public method calls
+    of an object. The methods are replaced on the object itself.
+    The calls of the generator methods last until the generator
+    is exhausted or closed.
+
+    Parameters:
+    -----------
+    obj:
+    The instrumented object.
+
+    component:
+    The value of the 'component' label.
+
+    histogram:
+    The histogram with the labels 'component' and 'method'.
+
+    errors:
+    The counter with the labels 'component' and 'method'.
+
+    Returns:
+    --------
+    The instrumented object.
+    """
+
+    def wrap(name: str, method):
+
+        # a generator method runs its body while it is iterated
+        if inspect.isgeneratorfunction(method):
+
+            @wraps(method)
+            def generator_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return (yield from method(*args, **kwargs))
+                except Exception:
+                    errors.inc(component, name)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, component, name)
+
+            return generator_wrapper
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                errors.inc(component, name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, component, name)
+
+        return wrapper
+
+    for name in dir(type(obj)):
+        if name.startswith("_"):
+            continue
+
+        # properties are not instrumented
+        if not callable(getattr(type(obj), name)):
+            continue
+
+        setattr(obj, name, wrap(name, getattr(obj, name)))
+
+    return obj
@@ -0,0 +1,243 @@
+"""
+This module measures the memory allocated by the requests
+and the service calls using the `tracemalloc` module.
+
+Tracing the allocations slows down the whole process, so the tracker
+is opt-in. For each tracked scope, a request or a service call, the
+peak of the traced memory above the memory at the start of the scope
+is recorded, and the allocation sites that grew the most are found by
+comparing the snapshots taken at the start and at the end of the scope.
+If the peak exceeds the memory budget of the scope, a warning with the
+top allocation sites is logged.
+
+Note that the traced memory is process-wide: allocations made by other
+threads during the scope are counted as well, so the figures are exact
+only for scopes that do not overlap.
+"""
+
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from logging import getLogger
+
+from server.monitoring import MetricsRegistry
+
+log = getLogger("master")
+
+# the histogram buckets in bytes, from 64 kB to 1 GB
+MEMORY_BUCKETS = tuple(64 * 1024 * 4 ** exp for exp in range(8))
+
+# the allocations of the tracing itself are not reported
+_IGNORED_FILES = (
+    tracemalloc.__file__, "<frozen importlib._bootstrap>",
+    os.path.join(os.path.dirname(__file__), "*")
+)
+
+
+class _Scope:
+    """The state of a tracked scope."""
+
+    def __init__(self, name: str, start: int) -> None:
+        self.name = name
+        self.start = start
+        # the highest traced memory seen by the nested scopes
+        self.peak = start
+        self.snapshot = None
+
+
+class MemoryTracker:
+    """Records the peak memory and the top allocation sites of scopes."""
+
+    def __init__(
+        self, metrics: MetricsRegistry,
+        budgets: dict = None,
+        default_budget: int = None,
+        top_sites: int = 5,
+        frames: int = 1) -> None:
+        """Initialize the tracker.
+
+        Parameters:
+        -----------
+        metrics:
+        The registry the memory metrics are added to.
+
+        budgets:
+        The memory budgets in bytes mapped to the scope names,
+        for example '/upload_image' or 'editor_manager.decode_image'.
+
+        default_budget:
+        The memory budget in bytes of the scopes without
+        an explicit budget (default: None, no budget).
+
+        top_sites:
+        The number of the allocation sites reported. Zero disables
+        the snapshots, which are the costly part of the tracking.
+
+        frames:
+        The number of frames stored per allocation.
+        """
+
+        self._budgets = dict(budgets or {})
+        self._default_budget = default_budget
+        self._top_sites = top_sites
+        self._frames = frames
+        self._local = threading.local()
+
+        # the top allocation sites of the last run of each scope
+        self._last_sites = {}
+
+        self._peak_bytes = metrics.histogram(
+            "memory_peak_bytes",
+            "Peak traced memory allocated within a scope.", ("scope",),
+            buckets = MEMORY_BUCKETS)
+        self._exceeded = metrics.counter(
+            "memory_budget_exceeded_total",
+            "Number of scopes exceeding their memory budget.", ("scope",))
+        metrics.gauge(
+            "memory_top_site_bytes",
+            "Memory allocated by the top allocation sites in the last run of a scope.",
+            self._get_last_sites, ("scope", "site"))
+        metrics.gauge(
+            "memory_traced_bytes", "Memory currently traced.",
+            lambda: tracemalloc.get_traced_memory()[0]
+            if tracemalloc.is_tracing() else None)
+
+    def start(self) -> None:
+        """Start tracing the allocations."""
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+
+    def stop(self) -> None:
+        """Stop tracing the allocations."""
+        tracemalloc.stop()
+
+    def _get_last_sites(self) -> dict:
+        """Return the sizes of the last top sites mapped to the scope and site."""
+
+        return {
+            (scope, site): size
+            for scope, sites in list(self._last_sites.items())
+            for site, size in sites
+        }
+
+    def _get_stack(self) -> list[_Scope]:
+        """Return the scopes open in the current thread."""
+
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot|None:
+        """Take a snapshot of the allocations if the sites are reported."""
+
+        if self._top_sites == 0:
+            return None
+
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, path) for path in _IGNORED_FILES])
+
+    @contextmanager
+    def track(self, name: str):
+        """Track the memory allocated within the block.
+
+        Parameters:
+        -----------
+        name:
+        The scope name, which selects the memory budget.
+        """
+
+        if not tracemalloc.is_tracing():
+            yield
+            return
+
+        stack = self._get_stack()
+
+        # the memory held by the snapshot itself is not counted
+        snapshot = self._take_snapshot()
+
+        # the peak is reset for the new scope, so the enclosing
+        # scope keeps the peak reached so far
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+
+        scope = _Scope(name, current)
+        scope.snapshot = snapshot
+        stack.append(scope)
+        tracemalloc.reset_peak()
+
+        try:
+            yield
+        finally:
+            stack.pop()
+            peak = max(scope.peak, tracemalloc.get_traced_memory()[1])
+
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+
+            self._finish(scope, peak - scope.start)
+
+    def _finish(self, scope: _Scope, peak: int) -> None:
+        """Record the peak memory of a scope and check its budget."""
+
+        self._peak_bytes.observe(peak, scope.name)
+
+        sites = []
+        if scope.snapshot is not None:
+            stats = self._take_snapshot().compare_to(scope.snapshot, "lineno")
+            sites = [
+                (str(stat.traceback[0]), stat.size_diff)
+                for stat in stats[:self._top_sites] if stat.size_diff > 0
+            ]
+            self._last_sites[scope.name] = sites
+
+        budget = self._budgets.get(scope.name, self._default_budget)
+
+        if budget is not None and peak > budget:
+            self._exceeded.inc(scope.name)
+            log.warning(
+                "Memory budget exceeded in '%s': peak %d kB, budget %d kB. "
+                "Top allocation sites: %s", scope.name, peak // 1024, budget // 1024,
+                "; ".join(f"{site} ({size // 1024} kB)" for site, size in sites) or "n/a"
+            )
+        else:
+            log.debug("Peak memory in '%s': %d kB", scope.name, peak // 1024)
+
+    def track_calls(self, obj: object, component: str, names: tuple) -> object:
+        """Track the memory allocated by the method calls of an object.
+        The methods are replaced on the object itself.
+
+        Parameters:
+        -----------
+        obj:
+        The tracked object.
+
+        component:
+        The prefix of the scope names, which are '<component>.<method>'.
+
+        names:
+        The names of the tracked methods.
+
+        Returns:
+        --------
+        The tracked object.
+        """
+
+        def wrap(scope: str, method):
+
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                with self.track(scope):
+                    return method(*args, **kwargs)
+
+            return wrapper
+
+        for name in names:
+            setattr(obj, name, wrap(f"{component}.{name}", getattr(obj, name)))
+
+        return obj
@@ -0,0 +1,228 @@
+"""
+This module provides on-demand profiling of the requests.
+
+A request is profiled if it carries the profiling header with the admin
+token or if it is picked by random sampling. The profile is dumped into
+the profile folder as a `.prof` file readable by `pstats` or `snakeviz`,
+next to a `.json` file with the route, the timing and the top functions.
+
+Only the profiles of the slowest sampled requests are kept, the others
+are removed, so that the disk usage stays bounded. If the profiler is
+not attached to the application, the requests are not affected at all.
+"""
+
+import cProfile
+import datetime as dt
+import heapq
+import io
+import json
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+from logging import getLogger
+
+from flask import Flask, g, request
+
+DirPath = str
+
+log = getLogger("master")
+
+PROFILE_HEADER = "X-Profile"
+
+
+class RequestProfiler:
+    """Profiles the sampled requests of an application."""
+
+    def __init__(
+        self, profile_dir: DirPath,
+        sample_rate: float = 0.0,
+        admin_token: str = None,
+        max_profiles: int = 50,
+        top_functions: int = 20) -> None:
+        """Initialize the profiler.
+
+        Parameters:
+        -----------
+        profile_dir:
+        The folder the profiles are stored in.
+
+        sample_rate:
+        The fraction of the requests profiled at random (default: 0.0).
+
+        admin_token:
+        The value of the profiling header which triggers the profiling
+        of a request (default: None, the header is ignored).
+
+        max_profiles:
+        The number of the slowest profiles kept.
+
+        top_functions:
+        The number of functions with the highest cumulative time
+        listed in the profile metadata.
+        """
+
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("The sample rate must be between 0 and 1!")
+
+        if max_profiles <= 0:
+            raise ValueError("The number of profiles must be a positive integer!")
+
+        self._profile_dir = profile_dir
+        self._sample_rate = sample_rate
+        self._admin_token = admin_token
+        self._max_profiles = max_profiles
+        self._top_functions = top_functions
+
+        # a min-heap of the durations, so the fastest profile is dropped first
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Return `True` if any request can be profiled."""
+        return self._sample_rate > 0.0 or self._admin_token is not None
+
+    def init_app(self, app: Flask) -> None:
+        """Attach the profiler to the application."""
+
+        app.extensions["profiler"] = self
+
+        if not self.enabled:
+            return
+
+        os.makedirs(self._profile_dir, exist_ok = True)
+        app.before_request(self._start)
+        app.teardown_request(self._finish)
+
+    def is_admin(self) -> bool:
+        """Check if the current request carries the admin token."""
+
+        token = request.headers.get(PROFILE_HEADER)
+
+        return (
+            token is not None and self._admin_token is not None and
+            secrets.compare_digest(token, self._admin_token)
+        )
+
+    def _should_profile(self) -> str|None:
+        """Return the reason for profiling the current request or None."""
+
+        if self.is_admin():
+            return "header"
+
+        if self._sample_rate > 0.0 and random.random() < self._sample_rate:
+            return "sample"
+
+        return None
+
+    def _start(self) -> None:
+        """Start profiling the current request if picked."""
+
+        trigger = self._should_profile()
+        if trigger is None:
+            return
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active in the process
+            return
+
+        g.profile = (profile, trigger, time.perf_counter())
+
+    def _finish(self, exc: BaseException = None) -> None:
+        """Stop profiling the current request and store the profile."""
+
+        started = g.pop("profile", None)
+        if started is None:
+            return
+
+        profile, trigger, start = started
+        profile.disable()
+        elapsed = time.perf_counter() - start
+
+        try:
+            self._store(profile, trigger, elapsed)
+        except OSError as err:
+            log.error("Failed to store the request profile: %s", err)
+
+    def _summarize(self, profile: cProfile.Profile) -> list[dict]:
+        """Return the functions with the highest cumulative time."""
+
+        stats = pstats.Stats(profile, stream = io.StringIO())
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+
+        summary = []
+
+        for func in stats.fcn_list[:self._top_functions]:
+            calls, _, total_time, cum_time, _ = stats.stats[func]
+            summary.append({
+                "function": pstats.func_std_string(func),
+                "calls": calls,
+                "total_time": total_time,
+                "cumulative_time": cum_time
+            })
+
+        return summary
+
+    def _store(self, profile: cProfile.Profile, trigger: str, elapsed: float) -> None:
+        """Dump the profile if it is among the slowest ones."""
+
+        with self._lock:
+            if (len(self._slowest) >= self._max_profiles and
+                elapsed <= self._slowest[0][0]):
+                return
+
+        now = dt.datetime.now()
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        endpoint = request.endpoint or "unmatched"
+        name = f"{now.strftime('%Y-%m-%d_%H-%M-%S-%f')}_{endpoint}_{elapsed * 1000:.0f}ms"
+        base_path = os.path.join(self._profile_dir, name)
+
+        meta = {
+            "route": rule,
+            "method": request.method,
+            "path": request.path,
+            "time": now.isoformat(),
+            "duration": elapsed,
+            "trigger": trigger,
+            "profile": base_path + ".prof",
+            "top_functions": self._summarize(profile)
+        }
+
+        profile.dump_stats(base_path + ".prof")
+
+        with open(base_path + ".json", "w", encoding = "utf-8") as stream:
+            json.dump(meta, stream, indent = 2)
+
+        with self._lock:
+            heapq.heappush(self._slowest, (elapsed, base_path, meta))
+            dropped = []
+            while len(self._slowest) > self._max_profiles:
+                dropped.append(heapq.heappop(self._slowest)[1])
+
+        for path in dropped:
+            for ext in (".prof", ".json"):
+                try:
+                    os.remove(path + ext)
+                except OSError:
+                    pass
+
+        log.info("Request profiled: %s %s (%.1f ms)", request.method, rule, elapsed * 1000)
+
+    def slowest(self, limit: int = None) -> list[dict]:
+        """Return the metadata of the slowest profiled requests,
+        the slowest first, without the function summaries."""
+
+        with self._lock:
+            entries = sorted(self._slowest, reverse = True)
+
+        return [
+            {key: val for key, val in meta.items() if key != "top_functions"}
+            for _, _, meta in entries[:limit]
+        ]
@@ -9,11 +9,24 @@ In a production environment, more secure encryption algorithms
 will be employed.
 """
 
+import copy
 import datetime as dt
 import hashlib
+import io
 import json
+import os
+import threading
+import time
 from abc import abstractmethod, ABCMeta
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from typing import BinaryIO, Callable
 import jwt
+import numpy as np
+from werkzeug.security import generate_password_hash
+
+log = getLogger("master")
 
 
 # ====== encryptor ======
@@ -31,7 +44,7 @@ class IEncryptor(metaclass=ABCMeta):
         """
 
     @abstractmethod
-    def encrypt(self, data: bytes) -> bytes:
+    def encrypt(self, data: bytes, offset: int = 0) -> bytes:
         """Encrypt the data.
 
         Parameters:
@@ -39,13 +52,17 @@ class IEncryptor(metaclass=ABCMeta):
         data:
         The data to encrypt.
 
+        offset:
+        The position of the data within the encrypted stream.
+        Allows to encrypt any part of a stream separately.
+
         Returns:
         --------
         The encrypted data.
         """
 
     @abstractmethod
-    def decrypt(self, data: bytes) -> bytes:
+    def decrypt(self, data: bytes, offset: int = 0) -> bytes:
         """Decrypt the data.
 
         Parameters:
@@ -53,11 +70,76 @@ class IEncryptor(metaclass=ABCMeta):
         data:
         The data to decrypt.
 
+        offset:
+        The position of the data within the encrypted stream.
+        Allows to decrypt any part of a stream separately.
+
         Returns:
         --------
         The decrypted data.
         """
 
+    @abstractmethod
+    def derive(self, nonce: bytes) -> 'IEncryptor':
+        """Create an encryptor with a key derived from
+        the key of this encryptor and a nonce.
+
+        Parameters:
+        -----------
+        nonce:
+        A unique value, such as random bytes generated for each file.
+
+        Returns:
+        --------
+        The new encryptor.
+        """
+
+    @abstractmethod
+    def encrypt_stream(
+        self, src: BinaryIO, dst: BinaryIO,
+        chunk_size: int = 1048576) -> int:
+        """Encrypt the data read from a binary stream
+        chunk by chunk and write it to another stream.
+
+        Parameters:
+        -----------
+        src:
+        The stream to read the data from.
+
+        dst:
+        The stream to write the encrypted data to.
+
+        chunk_size:
+        The number of bytes processed at once.
+
+        Returns:
+        --------
+        The number of bytes written.
+        """
+
+    @abstractmethod
+    def decrypt_stream(
+        self, src: BinaryIO, dst: BinaryIO,
+        chunk_size: int = 1048576) -> int:
+        """Decrypt the data read from a binary stream
+        chunk by chunk and write it to another stream.
+
+        Parameters:
+        -----------
+        src:
+        The stream to read the encrypted data from.
+
+        dst:
+        The stream to write the decrypted data to.
+
+        chunk_size:
+        The number of bytes processed at once.
+
+        Returns:
+        --------
+        The number of bytes written.
+        """
+
 
 class XOREncryptor(IEncryptor):
     """A class to encrypt and decrypt
@@ -82,14 +164,78 @@ class XOREncryptor(IEncryptor):
         # Derive a key from the provided string
         self.key = hashlib.sha256(key.encode()).digest()
 
-    def encrypt(self, data: bytes) -> bytes:
+    def _xor(self, src: np.ndarray, dst: np.ndarray, offset: int = 0) -> None:
+        """XOR the bytes of the source array with the key stream
+        starting at the given position and store them to the
+        destination array. Both arrays may be the same array."""
+
+        key = np.frombuffer(self.key, dtype = np.uint8)
+        key_len = key.size
+
+        # align the key with the position of the data in the key stream
+        key = np.roll(key, -(offset % key_len))
+
+        # the data is viewed as rows of key length, so that the
+        # key is broadcast over the rows instead of being repeated
+        full_len = src.size - src.size % key_len
+        np.bitwise_xor(
+            src[:full_len].reshape(-1, key_len), key,
+            out = dst[:full_len].reshape(-1, key_len)
+        )
+
+        tail_len = src.size - full_len
+        np.bitwise_xor(src[full_len:], key[:tail_len], out = dst[full_len:])
+
+    def _xor_stream(self, src: BinaryIO, dst: BinaryIO, chunk_size: int) -> int:
+        """XOR a stream chunk by chunk using a single reusable buffer."""
+
+        if chunk_size <= 0:
+            raise ValueError("The chunk size must be a positive integer!")
+
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        array = np.frombuffer(buffer, dtype = np.uint8)
+        offset = 0
+
+        while True:
+            size = src.readinto(view)
+            if not size:
+                break
+
+            self._xor(array[:size], array[:size], offset)
+            dst.write(view[:size])
+            offset += size
+
+        return offset
+
+    def encrypt(self, data: bytes, offset: int = 0) -> bytes:
         """Encrypt data using XOR with the derived key."""
-        key_repeated = (self.key * (len(data) // len(self.key) + 1))[:len(data)]
-        return bytes(a ^ b for a, b in zip(data, key_repeated))
+        src = np.frombuffer(data, dtype = np.uint8)
+        dst = np.empty_like(src)
+        self._xor(src, dst, offset)
+        return dst.tobytes()
 
-    def decrypt(self, data: bytes) -> bytes:
+    def decrypt(self, data: bytes, offset: int = 0) -> bytes:
         """Decrypt data using XOR with the derived key."""
-        return self.encrypt(data)
+        return self.encrypt(data, offset)
+
+    def derive(self, nonce: bytes) -> 'XOREncryptor':
+        """Create an encryptor with a key derived from the key and a nonce."""
+        derived = copy.copy(self)
+        derived.key = hashlib.sha256(self.key + nonce).digest()
+        return derived
+
+    def encrypt_stream(
+        self, src: BinaryIO, dst: BinaryIO,
+        chunk_size: int = 1048576) -> int:
+        """Encrypt a stream using XOR with the derived key."""
+        return self._xor_stream(src, dst, chunk_size)
+
+    def decrypt_stream(
+        self, src: BinaryIO, dst: BinaryIO,
+        chunk_size: int = 1048576) -> int:
+        """Decrypt a stream using XOR with the derived key."""
+        return self._xor_stream(src, dst, chunk_size)
 
 
 class Credentials:
@@ -107,6 +253,10 @@ class Credentials:
 
         self._encryptor = encryptor
 
+        # the decrypted credentials mapped to the file
+        # paths along with the file signatures
+        self._cache = {}
+
     def _validate_credentials(self, credentials: dict) -> None:
         """Validate the credentials dictionary."""
 
@@ -153,12 +303,9 @@ class Credentials:
         # Convert the credentials dictionary to a JSON string
         credentials_bin = json.dumps(credentials).encode('utf-8')
 
-        # Encrypt the credentials using XOR
-        encr_credentials = self._encryptor.encrypt(credentials_bin)
-
-        # Store the encrypted credentials in a file
+        # Encrypt the credentials and store them in a file
         with open(file_path, 'wb') as file:
-            file.write(encr_credentials)
+            self._encryptor.encrypt_stream(io.BytesIO(credentials_bin), file)
 
     def load(self, file_path: str) -> dict:
         """Get the database credentials from a file.
@@ -176,12 +323,20 @@ class Credentials:
         The values of the keys are non-empty strings.
         """
 
-        # Read the encrypted credentials from the file
+        # Return the cached credentials if the file has not changed
+        signature = self._get_signature(file_path)
+        cached = self._cache.get(file_path)
+
+        if cached is not None and cached[0] == signature:
+            return dict(cached[1])
+
+        # Read and decrypt the credentials from the file
+        decr_stream = io.BytesIO()
+
         with open(file_path, 'rb') as file:
-            encr_credentials = file.read()
+            self._encryptor.decrypt_stream(file, decr_stream)
 
-        # Decrypt the credentials using XOR
-        decr_credentials = self._encryptor.decrypt(encr_credentials)
+        decr_credentials = decr_stream.getvalue()
 
         # Decode the credentials to a dictionary and return it
         credentials = json.loads(decr_credentials.decode('utf-8'))
@@ -189,7 +344,544 @@ class Credentials:
         # Validate the credentials dictionary
         self._validate_credentials(credentials)
 
-        return credentials
+        self._cache[file_path] = (signature, credentials)
+
+        return dict(credentials)
+
+    def _get_signature(self, file_path: str) -> tuple[int, int, int]:
+        """Return the modification time, inode and size of
+        a file, which change whenever the file is replaced."""
+
+        stat = os.stat(file_path)
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def changed(self, file_path: str) -> bool:
+        """Check if a credentials file changed since it was last loaded.
+
+        Parameters:
+        -----------
+        file_path:
+        The path to the file containing the encrypted credentials.
+
+        Returns:
+        --------
+        `True` if the file was not loaded yet or it has changed, otherwise `False`.
+        """
+
+        cached = self._cache.get(file_path)
+        return cached is None or cached[0] != self._get_signature(file_path)
+
+    def forget(self, file_path: str) -> None:
+        """Drop the cached credentials of a file, so that
+        the file is taken as changed until it is loaded again.
+
+        Parameters:
+        -----------
+        file_path:
+        The path to the file containing the encrypted credentials.
+        """
+
+        self._cache.pop(file_path, None)
+
+
+class CredentialsWatcher:
+    """Watches a credentials file and reloads the
+    credentials in a background thread when it changes."""
+
+    def __init__(
+        self, credentials: Credentials, file_path: str,
+        on_change: Callable[[dict], None], interval: float = 5.0) -> None:
+        """Initialize the watcher.
+
+        Parameters:
+        -----------
+        credentials:
+        The credentials object used to load the file.
+
+        file_path:
+        The path to the file containing the encrypted credentials.
+
+        on_change:
+        A callable that takes the reloaded credentials. It is called
+        in the background thread, so it may take time to complete.
+
+        interval:
+        The time in seconds between checks of the file.
+        """
+
+        self._credentials = credentials
+        self._file_path = file_path
+        self._on_change = on_change
+        self._interval = interval
+
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def check(self) -> bool:
+        """Reload the credentials if the file has changed.
+
+        Returns:
+        --------
+        `True` if the credentials were reloaded, otherwise `False`.
+        """
+
+        try:
+            if not self._credentials.changed(self._file_path):
+                return False
+
+            credentials = self._credentials.load(self._file_path)
+        except (OSError, ValueError, TypeError) as err:
+            # the file may be in the middle of being replaced
+            log.warning("Failed to reload the credentials: %s", err)
+            return False
+
+        # the credentials not applied are loaded again on the next check
+        try:
+            self._on_change(credentials)
+        except Exception:
+            self._credentials.forget(self._file_path)
+            raise
+
+        return True
+
+    def start(self) -> None:
+        """Start watching the file in a background thread."""
+
+        if self._thread is not None:
+            return
+
+        # the current file content is considered to be in use
+        self._credentials.load(self._file_path)
+
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target = self._run, name = "credentials-watcher", daemon = True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching the file."""
+
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Check the file periodically until stopped."""
+
+        while not self._stopping.wait(self._interval):
+            try:
+                self.check()
+            except Exception as err:
+                # keep watching, the next change may succeed
+                log.exception(err)
+
+
+# ====== encrypted storage ======
+class InvalidEncryptedFileError(Exception):
+    """Raised when a file is not a valid encrypted file."""
+
+
+class EncryptedStorage:
+    """Stores files encrypted at rest.
+
+    Each file starts with a header holding a magic value and a random
+    nonce, from which the file key is derived, followed by the encrypted
+    content of the same size as the original content. The files are
+    encrypted and decrypted in blocks, so the memory used does not
+    depend on the file size and any byte range of a file can be read
+    without decrypting the rest of the file.
+    """
+
+    MAGIC = b"AITENC1\0"
+    NONCE_SIZE = 16
+    HEADER_SIZE = len(MAGIC) + NONCE_SIZE
+
+    def __init__(self, encryptor: IEncryptor, block_size: int = 1048576) -> None:
+        """Initialize the storage.
+
+        Parameters:
+        -----------
+        encryptor:
+        The encryptor from which the file encryptors are derived.
+
+        block_size:
+        The number of bytes encrypted or decrypted at once.
+        """
+
+        if block_size <= 0:
+            raise ValueError("The block size must be a positive integer!")
+
+        self._encryptor = encryptor
+        self._block_size = block_size
+
+    def _read_header(self, file: BinaryIO) -> IEncryptor:
+        """Read the file header and return the file encryptor."""
+
+        header = file.read(self.HEADER_SIZE)
+
+        if len(header) != self.HEADER_SIZE or not header.startswith(self.MAGIC):
+            raise InvalidEncryptedFileError(
+                "The file is not an encrypted file or it is damaged!")
+
+        return self._encryptor.derive(header[len(self.MAGIC):])
+
+    def is_encrypted(self, file_path: str) -> bool:
+        """Check if a file starts with the header of an encrypted file."""
+
+        with open(file_path, 'rb') as file:
+            return file.read(len(self.MAGIC)) == self.MAGIC
+
+    def size(self, file_path: str) -> int:
+        """Return the size of the original content of an encrypted file."""
+        return max(0, os.path.getsize(file_path) - self.HEADER_SIZE)
+
+    def write(self, file_path: str, src: BinaryIO) -> int:
+        """Encrypt the data read from a stream and store it in a file.
+
+        Parameters:
+        -----------
+        file_path:
+        The path to the file to create.
+
+        src:
+        The stream to read the data from.
+
+        Returns:
+        --------
+        The number of content bytes written.
+        """
+
+        nonce = os.urandom(self.NONCE_SIZE)
+
+        with open(file_path, 'wb') as file:
+            file.write(self.MAGIC + nonce)
+            return self._encryptor.derive(nonce).encrypt_stream(
+                src, file, self._block_size)
+
+    def read(self, file_path: str, dst: BinaryIO) -> int:
+        """Decrypt a file and write the content to a stream.
+
+        Parameters:
+        -----------
+        file_path:
+        The path to the encrypted file.
+
+        dst:
+        The stream to write the content to.
+
+        Returns:
+        --------
+        The number of content bytes written.
+
+        Raises:
+        -------
+        InvalidEncryptedFileError:
+        If the file is not a valid encrypted file.
+        """
+
+        with open(file_path, 'rb') as file:
+            encryptor = self._read_header(file)
+            return encryptor.decrypt_stream(file, dst, self._block_size)
+
+    def read_range(self, file_path: str, start: int, length: int) -> bytes:
+        """Decrypt a byte range of the file content.
+
+        Only the blocks covering the range are read and decrypted.
+
+        Parameters:
+        -----------
+        file_path:
+        The path to the encrypted file.
+
+        start:
+        The position of the first content byte to read.
+
+        length:
+        The maximum number of content bytes to read.
+
+        Returns:
+        --------
+        The decrypted bytes.
+
+        Raises:
+        -------
+        InvalidEncryptedFileError:
+        If the file is not a valid encrypted file.
+        """
+
+        if start < 0 or length < 0:
+            raise ValueError("The range must not be negative!")
+
+        with open(file_path, 'rb') as file:
+            encryptor = self._read_header(file)
+            file.seek(self.HEADER_SIZE + start)
+
+            blocks = []
+            position = start
+
+            while length > 0:
+                block = file.read(min(length, self._block_size))
+                if not block:
+                    break
+
+                blocks.append(encryptor.decrypt(block, position))
+                position += len(block)
+                length -= len(block)
+
+        return b"".join(blocks)
+
+
+# ====== password hashing ======
+class HashingPoolSaturatedError(Exception):
+    """Raised when the password hashing pool cannot accept more work."""
+
+
+class PasswordHasher:
+    """Runs the CPU-bound password hashing functions on a dedicated,
+    size-limited pool of worker processes, so that a burst of logins
+    does not starve the threads serving the other requests."""
+
+    def __init__(
+        self, max_workers: int = 2, max_pending: int = 16,
+        iterations: int = 600000, timeout: float = 30.0) -> None:
+        """Initialize the password hasher.
+
+        Parameters:
+        -----------
+        max_workers:
+        The number of worker processes that compute the hashes.
+
+        max_pending:
+        The maximum number of hashing jobs that may be running or
+        waiting in the queue. Any further job is rejected immediately.
+
+        iterations:
+        The work factor (number of PBKDF2 iterations) used
+        when generating new password hashes.
+
+        timeout:
+        The time in seconds to wait for the result of a hashing job.
+        """
+
+        if max_workers <= 0:
+            raise ValueError("The number of workers must be a positive integer!")
+
+        if max_pending < max_workers:
+            raise ValueError(
+                "The maximum of pending jobs must not be "
+                "lower than the number of workers!"
+            )
+
+        if iterations <= 0:
+            raise ValueError("The number of iterations must be a positive integer!")
+
+        self._max_workers = max_workers
+        self._max_pending = max_pending
+        self._iterations = iterations
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+        # the worker processes are started on the first
+        # hashing job, not at the time the hasher is created
+        self._executor = None
+
+    @property
+    def method(self) -> str:
+        """Return the hashing method descriptor for
+        the `generate_password_hash` function."""
+        return f"pbkdf2:sha256:{self._iterations}"
+
+    @property
+    def iterations(self) -> int:
+        """Return the work factor used to generate new hashes."""
+        return self._iterations
+
+    @property
+    def pending(self) -> int:
+        """Return the number of hashing jobs
+        that are running or waiting in the queue."""
+        return self._pending
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of hashing jobs
+        waiting for a free worker process."""
+        return max(0, self._pending - self._max_workers)
+
+    @property
+    def rejected(self) -> int:
+        """Return the number of hashing jobs rejected
+        since the hasher was created."""
+        return self._rejected
+
+    def calibrate(
+        self, target_latency: float,
+        min_iterations: int = 100000,
+        probe_iterations: int = 50000) -> int:
+        """Measure the hashing speed on the current machine and set
+        the work factor so that a single hash takes approximately
+        the target time to compute.
+
+        Parameters:
+        -----------
+        target_latency:
+        The time in seconds a single hash should take to compute.
+
+        min_iterations:
+        The lowest work factor accepted regardless of the measurement.
+
+        probe_iterations:
+        The work factor used to measure the hashing speed.
+
+        Returns:
+        --------
+        The calibrated work factor.
+        """
+
+        if target_latency <= 0:
+            raise ValueError("The target latency must be greater than 0!")
+
+        start = time.perf_counter()
+        generate_password_hash(
+            "calibration", method = f"pbkdf2:sha256:{probe_iterations}")
+        elapsed = time.perf_counter() - start
+
+        # the PBKDF2 cost grows linearly with the number of iterations
+        iterations = int(probe_iterations * target_latency / elapsed)
+        self._iterations = max(min_iterations, iterations)
+
+        return self._iterations
+
+    def run(self, func: Callable, *args) -> any:
+        """Run a hashing function in a worker process and return its result.
+
+        Parameters:
+        -----------
+        func:
+        A module-level (picklable) hashing function.
+
+        args:
+        The arguments passed to the function.
+
+        Returns:
+        --------
+        The value returned by the hashing function.
+
+        Raises:
+        -------
+        HashingPoolSaturatedError:
+        If the maximum number of pending hashing jobs has been reached.
+
+        TimeoutError:
+        If the result is not available within the configured timeout.
+
+        BrokenProcessPool:
+        If a worker process died. The next call starts a new pool.
+        """
+
+        with self._lock:
+            if self._pending >= self._max_pending:
+                self._rejected += 1
+                raise HashingPoolSaturatedError(
+                    "The password hashing pool is saturated: "
+                    f"{self._pending} jobs pending!"
+                )
+
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self._max_workers)
+
+            executor = self._executor
+            self._pending += 1
+
+        try:
+            future = executor.submit(func, *args)
+        except BaseException as err:
+            self._job_done(None)
+            if isinstance(err, BrokenProcessPool):
+                self._reset_executor(executor)
+            raise
+
+        # a job that timed out still occupies a worker process,
+        # so it is pending until it is done, not until we give up
+        future.add_done_callback(self._job_done)
+
+        try:
+            return future.result(self._timeout)
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise
+
+    def _reset_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Drop the pool broken by a dead worker process, such as one
+        killed out of memory, so the next hash starts a new pool."""
+
+        with self._lock:
+            if self._executor is not executor:
+                return
+
+            self._executor = None
+
+        log.error("A password hashing worker process died, restarting the pool.")
+        executor.shutdown(wait = False, cancel_futures = True)
+
+    def _job_done(self, future: Future) -> None:
+        """Count a hashing job as no longer pending."""
+
+        with self._lock:
+            self._pending -= 1
+
+    def map(self, func: Callable, *iterables, chunksize: int = 32) -> list:
+        """Run a hashing function over the items of the iterables
+        on all worker processes and return the results in order.
+
+        The jobs are sent to the workers in chunks and they are not
+        subject to the limit of pending jobs. This is intended for
+        batch administration tasks, not for serving requests.
+
+        Parameters:
+        -----------
+        func:
+        A module-level (picklable) hashing function.
+
+        iterables:
+        The iterables supplying the function arguments.
+
+        chunksize:
+        The number of jobs sent to a worker process at once.
+
+        Returns:
+        --------
+        The values returned by the hashing function.
+
+        Raises:
+        -------
+        BrokenProcessPool:
+        If a worker process died. The next call starts a new pool.
+        """
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self._max_workers)
+
+            executor = self._executor
+
+        try:
+            return list(executor.map(func, *iterables, chunksize = chunksize))
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures = True)
+                self._executor = None
 
 
 # ====== authenticator ======
@@ -0,0 +1,909 @@
+"""Document management service.
+
+Assembles the pages scanned from a batch of photos into a single
+multi-page PDF or TIFF file:
+
+- The uploaded photos are spooled into the folder of the document,
+  so a batch is never held in memory.
+- The signatures of the photos are computed first on small copies of
+  the pages. Blank pages and pages repeating the page before them are
+  dropped before they are scanned at full resolution.
+- The photos are scanned by a pool of worker processes, each of which
+  returns its page already compressed for the output file.
+- The compressed pages are appended to the output file in page order as
+  soon as they and all the pages before them are finished. Only a few
+  pages per worker are in flight at a time, which bounds the memory
+  used by a document of any length.
+- The progress of a document can be queried while it is assembled.
+- A document belongs to the user who created it, the other users
+  cannot tell it exists.
+- The documents are deleted with their files once they have been
+  finished, or left unassembled, for longer than the retention time.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from logging import getLogger
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+from server import imaging
+from server.services.scanner_management import (
+    ScannerManager, PageSignature, InvalidImageError,
+    InvalidScanModeError, SCAN_MODES, parse_dropout
+)
+
+DirPath = str
+
+log = getLogger('master')
+
+DOCUMENT_FORMATS = ('pdf', 'tiff')
+
+# the shortest time in seconds between two sweeps of the expired documents
+SWEEP_INTERVAL = 60.0
+
+# the thresholds of the dropped pages, which may be set for each document
+DEFAULT_PAGE_FILTER = {
+    # the pages of at most this fraction of ink are blank
+    'blank_ink': 0.0003,
+    # the pages of a lower brightness deviation are blank
+    'blank_deviation': 3.0,
+    # the largest number of bits of the page hashes that differ
+    'duplicate_distance': 256,
+    # the lowest correlation of the page thumbnails
+    'duplicate_similarity': 0.85,
+    'drop_blank': True,
+    'drop_duplicates': True
+}
+
+
+class DocumentNotFoundError(Exception):
+    pass
+
+class InvalidDocumentFormatError(Exception):
+    pass
+
+class DocumentStateError(Exception):
+    pass
+
+class InvalidPageFilterError(Exception):
+    pass
+
+
+# ====== writers ======
+class PdfWriter:
+    """Writes a PDF file page by page.
+
+    Every page is a single image. The objects of a page are written as
+    soon as the page is added and only their offsets are kept, the page
+    tree and the cross-reference table are written when the file is closed.
+    """
+
+    def __init__(self, stream: BinaryIO, resolution: float = 150.0) -> None:
+        """Initialize the writer.
+
+        Parameters:
+        -----------
+        stream:
+        The binary stream the file is written to.
+
+        resolution:
+        The resolution of the pages in pixels per inch,
+        which sets the size of the printed page.
+        """
+
+        self._stream = stream
+        self._resolution = resolution
+        self._offsets = {}
+        self._pages = []
+
+        # the catalog refers to the page tree written at the end
+        self._stream.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        self._next_id = 3
+
+    @staticmethod
+    def encode_page(
+        page: np.ndarray, binary: bool,
+        resolution: float, quality: int) -> tuple:
+        """Compress a grayscale or an RGB page into the image data of a PDF
+        page, 1 bit per pixel for a binary page and JPEG otherwise. Returns
+        the image (width, height, color space, bits per pixel, filter, data)."""
+
+        height, width = page.shape[:2]
+        space = 'DeviceRGB' if page.ndim == 3 else 'DeviceGray'
+
+        if binary:
+            # the rows start at whole bytes, a set bit is white
+            data = zlib.compress(np.packbits(page >= 128, axis = 1).tobytes(), 6)
+            return width, height, space, 1, 'FlateDecode', data
+
+        stream = io.BytesIO()
+        Image.fromarray(page).save(stream, format = 'JPEG', quality = quality)
+
+        return width, height, space, 8, 'DCTDecode', stream.getvalue()
+
+    def _write_object(self, obj_id: int, body: bytes, data: bytes = None) -> None:
+        """Write an object, optionally followed by a stream of data."""
+
+        self._offsets[obj_id] = self._stream.tell()
+        self._stream.write(b'%d 0 obj\n' % obj_id + body)
+
+        if data is not None:
+            self._stream.write(b'\nstream\n' + data + b'\nendstream')
+
+        self._stream.write(b'\nendobj\n')
+
+    def add_page(self, encoded: tuple) -> None:
+        """Append a page compressed by `encode_page`."""
+
+        width, height, space, bits, name, data = encoded
+        image_id, content_id, page_id = range(self._next_id, self._next_id + 3)
+        self._next_id += 3
+
+        # the page size in points
+        page_width = width * 72 / self._resolution
+        page_height = height * 72 / self._resolution
+
+        self._write_object(image_id, (
+            b'<< /Type /XObject /Subtype /Image /Width %d /Height %d '
+            b'/ColorSpace /%s /BitsPerComponent %d /Filter /%s /Length %d >>'
+        ) % (
+            width, height, space.encode('ascii'), bits,
+            name.encode('ascii'), len(data)), data)
+
+        content = b'q %.3f 0 0 %.3f 0 0 cm /Im0 Do Q' % (page_width, page_height)
+        self._write_object(content_id, b'<< /Length %d >>' % len(content), content)
+
+        self._write_object(page_id, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.3f %.3f] '
+            b'/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>'
+        ) % (page_width, page_height, image_id, content_id))
+
+        self._pages.append(page_id)
+
+    def close(self) -> None:
+        """Write the page tree and the cross-reference table."""
+
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self._pages)
+        self._write_object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            kids, len(self._pages)))
+
+        xref = self._stream.tell()
+        self._stream.write(b'xref\n0 %d\n0000000000 65535 f \n' % self._next_id)
+        for obj_id in range(1, self._next_id):
+            self._stream.write(b'%010d 00000 n \n' % self._offsets[obj_id])
+
+        self._stream.write(
+            b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+                self._next_id, xref))
+
+
+class TiffWriter:
+    """Writes a multi-page TIFF file page by page.
+
+    The pages are encoded as single-page TIFF files, which are appended
+    to the file and linked into its chain of image directories.
+    """
+
+    def __init__(self, stream: BinaryIO, resolution: float = 150.0) -> None:
+        """Initialize the writer.
+
+        Parameters:
+        -----------
+        stream:
+        The binary stream the file is written to, open for reading
+        as well, since the directories are linked in place.
+
+        resolution:
+        The resolution of the pages in pixels per inch.
+        """
+
+        self._writer = TiffImagePlugin.AppendingTiffWriter(stream, new = True)
+
+    @staticmethod
+    def encode_page(
+        page: np.ndarray, binary: bool,
+        resolution: float, quality: int) -> bytes:
+        """Compress a grayscale or an RGB page into a single-page TIFF
+        file, CCITT Group 4 for a binary page and Deflate otherwise."""
+
+        stream = io.BytesIO()
+
+        if binary:
+            Image.fromarray(page >= 128).save(
+                stream, format = 'TIFF', compression = 'group4',
+                dpi = (resolution, resolution))
+        else:
+            Image.fromarray(page).save(
+                stream, format = 'TIFF', compression = 'tiff_deflate',
+                dpi = (resolution, resolution))
+
+        return stream.getvalue()
+
+    def add_page(self, encoded: bytes) -> None:
+        """Append a page compressed by `encode_page`."""
+
+        self._writer.write(encoded)
+        self._writer.newFrame()
+
+    def close(self) -> None:
+        """Finish the last image directory."""
+        self._writer.close()
+
+
+WRITERS = {'pdf': PdfWriter, 'tiff': TiffWriter}
+
+
+# ====== workers ======
+def _init_worker() -> None:
+    """Initialize a worker process of the scanning pool."""
+
+    # the pool already runs a process on every CPU
+    imaging.set_max_threads(1)
+
+def _sign_page(path: str, options: dict) -> PageSignature:
+    """Compute the signature of a spooled photo in a worker process."""
+
+    with open(path, 'rb') as fs:
+        data = fs.read()
+
+    return ScannerManager(**options).sign_page(data)
+
+def _scan_page(
+    path: str, mode: str, dropout: tuple, fmt: str,
+    resolution: float, quality: int, options: dict) -> object:
+    """Scan a spooled photo in a worker process and
+    return the page compressed for the output file."""
+
+    with open(path, 'rb') as fs:
+        data = fs.read()
+
+    page, _ = ScannerManager(**options).scan(data, mode, dropout = dropout)
+    binary = mode not in ('gray', 'color')
+
+    return WRITERS[fmt].encode_page(page, binary, resolution, quality)
+
+
+# ====== documents ======
+class _Document:
+    """The state of a document."""
+
+    def __init__(
+        self, doc_id: str, fmt: str, mode: str, dropout: tuple,
+        page_filter: dict, folder: DirPath, owner: int = None) -> None:
+
+        self.id = doc_id
+        self.owner = owner
+        self.format = fmt
+        self.mode = mode
+        self.dropout = dropout
+        self.page_filter = page_filter
+        self.folder = folder
+        self.status = 'uploading'
+        self.error = None
+        self.pages = 0
+        self.processed = 0
+        self.failed = []
+        self.blank = []
+        self.duplicates = []
+        self.started = None
+        self.finished = None
+        self.updated = time.time()
+        self.done = threading.Event()
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.folder, f'document.{self.format}')
+
+    def page_path(self, index: int) -> str:
+        return os.path.join(self.folder, 'pages', f'{index:05d}')
+
+    def progress(self) -> dict:
+        """Return the progress of the document."""
+
+        if self.started is None:
+            elapsed = None
+        else:
+            elapsed = round((self.finished or time.time()) - self.started, 3)
+
+        return {
+            'id': self.id,
+            'format': self.format,
+            'mode': self.mode,
+            'status': self.status,
+            'error': self.error,
+            'pages': self.pages,
+            'processed': self.processed,
+            'failed': list(self.failed),
+            'blank': list(self.blank),
+            'duplicates': list(self.duplicates),
+            'elapsed': elapsed
+        }
+
+
+class DocumentManager:
+    """Manager of the multi-page documents scanned in batches."""
+
+    def __init__(
+        self, storage_dir: DirPath,
+        max_workers: int = None,
+        pages_per_worker: int = 2,
+        resolution: float = 150.0,
+        jpeg_quality: int = 90,
+        scanner_options: dict = None,
+        retention: float = 86400.0) -> None:
+        """Initialize the document manager.
+
+        Parameters:
+        -----------
+        storage_dir:
+        The folder where the documents are assembled.
+
+        max_workers:
+        The number of worker processes that scan the pages
+        (default: None, one per CPU).
+
+        pages_per_worker:
+        The number of pages of a document per worker process that are
+        scanned or waiting to be written at a time. More pages keep the
+        workers busy while a slow page holds up the writing, at the cost
+        of memory.
+
+        resolution:
+        The resolution of the pages in pixels per inch
+        written into the output files.
+
+        jpeg_quality:
+        The JPEG quality of the grayscale pages of a PDF file.
+
+        scanner_options:
+        The arguments of the `ScannerManager` scanning the pages (default: None).
+
+        retention:
+        The time in seconds the documents are kept after they are finished
+        or after their last page is uploaded if they are not assembled.
+        """
+
+        max_workers = max_workers or os.cpu_count() or 1
+
+        if max_workers <= 0:
+            raise ValueError("The number of workers must be a positive integer!")
+
+        if pages_per_worker <= 0:
+            raise ValueError("The number of pages per worker must be a positive integer!")
+
+        os.makedirs(storage_dir, exist_ok = True)
+
+        self._storage_dir = storage_dir
+        self._max_workers = max_workers
+        self._window = max_workers * pages_per_worker
+        self._resolution = resolution
+        self._jpeg_quality = jpeg_quality
+        self._scanner_options = dict(scanner_options or {})
+        self._retention = retention
+        self._last_sweep = 0.0
+
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._pending = 0
+
+        # the worker processes are started on the first
+        # assembled document, not at the time the manager is created
+        self._executor = None
+
+    @property
+    def pending(self) -> int:
+        """Return the number of pages being scanned or waiting for a worker."""
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Return the pool of the worker processes, start it on the first call."""
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self._max_workers, initializer = _init_worker)
+
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Drop the pool broken by a dead worker process, such as one
+        killed out of memory, so the next document starts a new pool."""
+
+        with self._lock:
+            if self._executor is not executor:
+                return
+
+            self._executor = None
+
+        log.error("A scanning worker process died, restarting the pool.")
+        executor.shutdown(wait = False, cancel_futures = True)
+
+    def _get_document(self, doc_id: str, owner: int = None) -> _Document:
+        """Return the document with the given id.
+
+        Raises:
+        -------
+        DocumentNotFoundError:
+        If there is no such document or it belongs to another user.
+        """
+
+        document = self._documents.get(doc_id)
+        if document is None or document.owner != owner:
+            raise DocumentNotFoundError(f'Document "{doc_id}" not found!')
+
+        return document
+
+    def create_document(
+        self, fmt: str = 'pdf', mode: str = 'gray',
+        page_filter: dict = None, dropout: list = None, owner: int = None) -> str:
+        """Create an empty document.
+
+        Parameters:
+        -----------
+        fmt:
+        The format of the output file, 'pdf' or 'tiff'.
+
+        mode:
+        The scan mode of the pages (see `ScannerManager.scan`).
+
+        page_filter:
+        The thresholds of the blank and the duplicate pages overriding
+        the defaults (see `DEFAULT_PAGE_FILTER`). The checks are turned
+        off by 'drop_blank' and 'drop_duplicates' (default: None).
+
+        dropout:
+        The hue ranges of the colors dropped from the pages
+        (see `ScannerManager.whiten_page`, default: None).
+
+        owner:
+        The id of the user the document belongs to (default: None).
+        The other methods find the document for its owner only.
+
+        Returns:
+        --------
+        The id of the document.
+
+        Raises:
+        -------
+        InvalidDocumentFormatError:
+        If the format is not supported.
+
+        InvalidScanModeError:
+        If the scan mode is not supported.
+
+        InvalidPageFilterError:
+        If a threshold is unknown or not a number.
+
+        InvalidDropoutError:
+        If the dropout ranges are not valid.
+        """
+
+        page_filter = self._create_page_filter(page_filter or {})
+        dropout = parse_dropout(dropout) if dropout else None
+
+        if fmt not in DOCUMENT_FORMATS:
+            raise InvalidDocumentFormatError(f'Unsupported document format: "{fmt}"')
+
+        if mode not in SCAN_MODES:
+            raise InvalidScanModeError(f'Unsupported scan mode: "{mode}"')
+
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self.sweep()
+
+        doc_id = uuid.uuid4().hex
+        folder = os.path.join(self._storage_dir, doc_id)
+        os.makedirs(os.path.join(folder, 'pages'))
+
+        with self._lock:
+            self._documents[doc_id] = _Document(
+                doc_id, fmt, mode, dropout, page_filter, folder, owner)
+
+        log.info("Created %s document %s.", fmt, doc_id)
+
+        return doc_id
+
+    def _create_page_filter(self, overrides: dict) -> dict:
+        """Return the default page filter updated by the overrides."""
+
+        unknown = set(overrides) - set(DEFAULT_PAGE_FILTER)
+        if unknown:
+            raise InvalidPageFilterError(f'Unknown page filter: "{", ".join(sorted(unknown))}"')
+
+        page_filter = dict(DEFAULT_PAGE_FILTER)
+
+        for name, value in overrides.items():
+            # a bool is an int as well, but not a threshold
+            if isinstance(DEFAULT_PAGE_FILTER[name], bool):
+                valid = isinstance(value, bool)
+            else:
+                valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+
+            if not valid:
+                raise InvalidPageFilterError(f'Invalid value of the page filter "{name}": {value!r}')
+
+            page_filter[name] = value
+
+        return page_filter
+
+    def _check_page(
+        self, signature: PageSignature,
+        previous: PageSignature, page_filter: dict) -> str|None:
+        """Return 'blank' or 'duplicate' if the page is to be dropped, otherwise None."""
+
+        if page_filter['drop_blank'] and signature.is_blank(
+            page_filter['blank_ink'], page_filter['blank_deviation']):
+            return 'blank'
+
+        if page_filter['drop_duplicates'] and previous is not None and signature.is_duplicate(
+            previous, page_filter['duplicate_distance'], page_filter['duplicate_similarity']):
+            return 'duplicate'
+
+        return None
+
+    def add_page(self, doc_id: str, data: bytes, owner: int = None) -> int:
+        """Add the photo of the next page to the document. The photo
+        is stored on the disk until the document is assembled.
+
+        Parameters:
+        -----------
+        doc_id:
+        The id of the document.
+
+        data:
+        The content of the image file.
+
+        owner:
+        The id of the user the document belongs to.
+
+        Returns:
+        --------
+        The index of the page in the document.
+
+        Raises:
+        -------
+        DocumentNotFoundError:
+        If there is no such document.
+
+        DocumentStateError:
+        If the document is already being assembled.
+        """
+
+        document = self._get_document(doc_id, owner)
+
+        with self._lock:
+            if document.status != 'uploading':
+                raise DocumentStateError(f'Document "{doc_id}" is already {document.status}!')
+
+            document.updated = time.time()
+
+        # the page is counted once it is complete, so the document
+        # is never assembled with a page still being written
+        try:
+            fd, path = tempfile.mkstemp('.part', dir = os.path.dirname(document.page_path(0)))
+        except FileNotFoundError:
+            # the photos are removed once the document is assembled
+            raise DocumentStateError(f'Document "{doc_id}" is already {document.status}!')
+
+        try:
+            with os.fdopen(fd, 'wb') as fs:
+                fs.write(data)
+
+            with self._lock:
+                if document.status != 'uploading':
+                    raise DocumentStateError(f'Document "{doc_id}" is already {document.status}!')
+
+                index = document.pages
+                os.replace(path, document.page_path(index))
+                document.pages += 1
+                document.updated = time.time()
+        except BaseException:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        return index
+
+    def assemble(self, doc_id: str, owner: int = None) -> dict:
+        """Start assembling the document in a background thread.
+
+        Parameters:
+        -----------
+        doc_id:
+        The id of the document.
+
+        owner:
+        The id of the user the document belongs to.
+
+        Returns:
+        --------
+        The progress of the document (see `progress`).
+
+        Raises:
+        -------
+        DocumentNotFoundError:
+        If there is no such document.
+
+        DocumentStateError:
+        If the document has no pages or it is already being assembled.
+        """
+
+        document = self._get_document(doc_id, owner)
+
+        with self._lock:
+            if document.status != 'uploading':
+                raise DocumentStateError(f'Document "{doc_id}" is already {document.status}!')
+
+            if document.pages == 0:
+                raise DocumentStateError(f'Document "{doc_id}" has no pages!')
+
+            document.status = 'processing'
+            document.started = time.time()
+
+        thread = threading.Thread(
+            target = self._assemble, args = (document,),
+            name = f'document-{doc_id[:8]}', daemon = True)
+        thread.start()
+
+        return document.progress()
+
+    def _assemble(self, document: _Document) -> None:
+        """Scan the pages of the document and write them into the output file."""
+
+        log.info("Assembling document %s of %d pages...", document.id, document.pages)
+
+        executor = self._get_executor()
+        page_filter = document.page_filter
+        signed = page_filter['drop_blank'] or page_filter['drop_duplicates']
+
+        # the jobs running mapped to their kind and page
+        running = {}
+        # the signatures waiting for the pages before them to be checked
+        signatures = {}
+        # the compressed pages waiting for the pages before them,
+        # None for the pages that are dropped
+        finished = {}
+        next_page = 0
+        next_check = 0
+        next_write = 0
+        written = 0
+        previous = None
+
+        def submit(kind: str, index: int) -> None:
+            if kind == 'sign':
+                future = executor.submit(
+                    _sign_page, document.page_path(index), self._scanner_options)
+            else:
+                future = executor.submit(
+                    _scan_page, document.page_path(index), document.mode,
+                    document.dropout, document.format, self._resolution,
+                    self._jpeg_quality, self._scanner_options)
+
+            running[future] = (kind, index)
+
+            with self._lock:
+                self._pending += 1
+
+        try:
+            with open(document.output_path, 'w+b') as stream:
+                writer = WRITERS[document.format](stream, self._resolution)
+
+                while next_write < document.pages:
+                    while (next_page < document.pages
+                           and len(running) + len(signatures) + len(finished) < self._window):
+                        submit('sign' if signed else 'scan', next_page)
+                        next_page += 1
+
+                    done, _ = wait(running, return_when = FIRST_COMPLETED)
+
+                    for future in done:
+                        kind, index = running.pop(future)
+
+                        with self._lock:
+                            self._pending -= 1
+
+                        try:
+                            result = future.result()
+                        except InvalidImageError as err:
+                            log.warning("Page %d of document %s skipped: %s", index, document.id, err)
+                            finished[index] = None
+                            document.failed.append(index)
+                            continue
+
+                        if kind == 'sign':
+                            signatures[index] = result
+                        else:
+                            finished[index] = result
+
+                    # the pages are checked in order, each against the
+                    # last page before it that is not blank
+                    while next_check in signatures or (signed and next_check in finished):
+                        signature = signatures.pop(next_check, None)
+
+                        if signature is not None:
+                            verdict = self._check_page(signature, previous, page_filter)
+
+                            if verdict is None:
+                                submit('scan', next_check)
+                            else:
+                                log.info("Page %d of document %s dropped as %s.",
+                                         next_check, document.id, verdict)
+                                finished[next_check] = None
+                                (document.blank if verdict == 'blank'
+                                 else document.duplicates).append(next_check)
+
+                            if verdict != 'blank':
+                                previous = signature
+
+                        next_check += 1
+
+                    # the pages are written in order
+                    while next_write in finished:
+                        encoded = finished.pop(next_write)
+                        if encoded is not None:
+                            writer.add_page(encoded)
+                            written += 1
+
+                        next_write += 1
+                        document.processed = next_write
+
+                writer.close()
+
+            if written == 0:
+                raise InvalidImageError("No page of the document is left!")
+
+        except Exception as err:
+            log.error("Assembling document %s failed: %s", document.id, err)
+
+            if isinstance(err, BrokenProcessPool):
+                self._reset_executor(executor)
+
+            for future in running:
+                future.cancel()
+
+            with self._lock:
+                self._pending -= len(running)
+
+            document.error = str(err)
+            document.status = 'failed'
+
+        else:
+            log.info("Document %s assembled.", document.id)
+            document.status = 'done'
+
+        finally:
+            document.finished = document.updated = time.time()
+            shutil.rmtree(os.path.join(document.folder, 'pages'), ignore_errors = True)
+            document.done.set()
+
+    def progress(self, doc_id: str, owner: int = None) -> dict:
+        """Return the progress of the document.
+
+        Parameters:
+        -----------
+        doc_id:
+        The id of the document.
+
+        owner:
+        The id of the user the document belongs to.
+
+        Returns:
+        --------
+        A dictionary of the document 'id', 'format', 'mode', 'status'
+        ('uploading', 'processing', 'done' or 'failed'), 'error', the number
+        of 'pages' uploaded, the number of pages 'processed' in order,
+        the indices of the pages that 'failed' to be scanned, of the
+        'blank' pages and of the 'duplicates' dropped and the seconds
+        'elapsed' since the start of the assembly.
+
+        Raises:
+        -------
+        DocumentNotFoundError:
+        If there is no such document.
+        """
+        return self._get_document(doc_id, owner).progress()
+
+    def wait(self, doc_id: str, timeout: float = None, owner: int = None) -> dict:
+        """Wait until the document is assembled and return its progress."""
+
+        document = self._get_document(doc_id, owner)
+        document.done.wait(timeout)
+
+        return document.progress()
+
+    def output_path(self, doc_id: str, owner: int = None) -> str:
+        """Return the path of the assembled file of the document
+        belonging to the given user.
+
+        Raises:
+        -------
+        DocumentNotFoundError:
+        If there is no such document.
+
+        DocumentStateError:
+        If the document is not assembled yet.
+        """
+
+        document = self._get_document(doc_id, owner)
+
+        if document.status != 'done':
+            raise DocumentStateError(f'Document "{doc_id}" is {document.status}!')
+
+        return document.output_path
+
+    def _folder_updated(self, folder: DirPath) -> float:
+        """Return the last time the folder or an entry of it was changed."""
+
+        updated = os.stat(folder).st_mtime
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                updated = max(updated, entry.stat(follow_symlinks = False).st_mtime)
+
+        return updated
+
+    def sweep(self) -> int:
+        """Delete the documents finished, or last uploaded to, longer than
+        the retention time ago, with their files. The documents being
+        assembled are kept. The folders of the documents left by a stopped
+        server are deleted once they have not changed for the retention time.
+
+        Returns:
+        --------
+        The number of deleted documents.
+        """
+
+        self._last_sweep = time.monotonic()
+        before = time.time() - self._retention
+
+        with self._lock:
+            expired = [
+                document for document in self._documents.values()
+                if document.status != 'processing' and document.updated < before]
+
+            for document in expired:
+                del self._documents[document.id]
+                document.status = 'expired'
+
+            known = set(self._documents)
+
+        folders = [document.folder for document in expired]
+
+        # the documents of the other processes sharing the folder are
+        # unknown too, but they change within the retention time
+        for entry in os.scandir(self._storage_dir):
+            if entry.is_dir() and entry.name not in known and entry.path not in folders:
+                try:
+                    if self._folder_updated(entry.path) < before:
+                        folders.append(entry.path)
+                except FileNotFoundError:
+                    continue
+
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors = True)
+
+        if folders:
+            log.info("Deleted %d expired documents.", len(folders))
+
+        return len(folders)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures = True)
+                self._executor = None
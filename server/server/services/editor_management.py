@@ -1,19 +1,49 @@
 """Editor management service."""
-from os.path import join, splitext
+from os.path import join, splitext, getsize
 from logging import getLogger
 import base64
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from server.imaging import box_blur, gaussian_blur
 
 DirPath = str
 FilePath = str
 
 log = getLogger('master')
 
+# the largest values of the filters: the blurs pad the image by
+# a few times their value on every side
+MAX_FILTER_VALUES = {
+    'blur_box': 256.0,
+    'blur_gaussian': 100.0,
+    'sharpen': 10.0
+}
+
 class InvalidImageFormatError(Exception):
     pass
 
+class InvalidFilterError(Exception):
+    pass
+
 class EditorManager:
     """Manager for the editor application."""
 
+    def __init__(self, storage: object = None) -> None:
+        """Initialize the editor manager.
+
+        Parameters:
+        -----------
+        storage:
+        The encrypted storage used to encrypt the saved files at rest
+        (default: None). If not provided, the files are saved as they are.
+        """
+
+        self._storage = storage
+
     def _validate_image_format(self, ext: str) -> None:
         """Validate the image format."""
 
@@ -46,6 +76,108 @@ class EditorManager:
 
         return decoded
 
+    def apply_filter(self, img: bytes, name: str, value: float) -> bytes:
+        """Apply a filter to the image.
+
+        Parameters:
+        -----------
+        img:
+        The decoded image data.
+
+        name:
+        The filter name: 'blur_box' (the value is the radius in pixels),
+        'blur_gaussian' (the value is the standard deviation in pixels)
+        or 'sharpen' (the value is the strength, 1.0 doubles the details).
+        The values are limited by `MAX_FILTER_VALUES`.
+
+        value:
+        The filter parameter.
+
+        Returns:
+        --------
+        The filtered image data in the format of the source image.
+
+        Raises:
+        -------
+        InvalidFilterError:
+        If the filter is not supported or its value is out of range.
+
+        InvalidImageFormatError:
+        If the image data cannot be decoded.
+        """
+
+        self._validate_filter(name, value)
+
+        try:
+            image = Image.open(io.BytesIO(img))
+            fmt = image.format or 'PNG'
+            image.load()
+        except (OSError, ValueError) as err:
+            raise InvalidImageFormatError(f"Failed to decode the image: {err}") from err
+
+        # the palette indices cannot be filtered
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        pixels = self.filter_pixels(np.asarray(image), name, value)
+
+        stream = io.BytesIO()
+        Image.fromarray(pixels).save(stream, format = fmt)
+
+        return stream.getvalue()
+
+    def _validate_filter(self, name: str, value: float) -> None:
+        """Check the filter name and value."""
+
+        if name not in MAX_FILTER_VALUES:
+            raise InvalidFilterError(f'Unsupported filter: "{name}"')
+
+        if not math.isfinite(value) or not 0 <= value <= MAX_FILTER_VALUES[name]:
+            raise InvalidFilterError(f'Invalid value of the filter "{name}": {value}')
+
+    def filter_pixels(self, pixels: np.ndarray, name: str, value: float) -> np.ndarray:
+        """Apply a filter to the decoded pixels of an image.
+
+        Parameters:
+        -----------
+        pixels:
+        The 8-bit pixels, 2D (grayscale) or 3D (channels last).
+
+        name:
+        The filter name (see `apply_filter`).
+
+        value:
+        The filter parameter.
+
+        Returns:
+        --------
+        The filtered pixels, an array of the same shape and type.
+
+        Raises:
+        -------
+        InvalidFilterError:
+        If the filter is not supported or its value is out of range.
+        """
+
+        self._validate_filter(name, value)
+
+        if name == 'blur_box':
+            return box_blur(pixels, int(round(value)))
+
+        if name == 'blur_gaussian':
+            return gaussian_blur(pixels, value)
+
+        return self._sharpen(pixels, value)
+
+    def _sharpen(self, pixels: np.ndarray, amount: float) -> np.ndarray:
+        """Sharpen the image by adding the difference between the
+        image and its blurred copy (unsharp masking)."""
+
+        blurred = gaussian_blur(pixels.astype(np.float32), 1.5)
+        sharpened = pixels + amount * (pixels - blurred)
+
+        return np.clip(np.rint(sharpened), 0, 255).astype(np.uint8)
+
     def save_file(self, dst: DirPath, name: str, file: bytes) -> FilePath:
         """Upload a file to the server storage.
 
@@ -77,7 +209,63 @@ class EditorManager:
         # save the file to the storage without error
         # handling fow now - the caller will handle
         # any exceptions
+        if self._storage is not None:
+            self._storage.write(dst_file, io.BytesIO(file))
+            return dst_file
+
         with open(dst_file, 'wb') as stream:
             stream.write(file)
 
         return dst_file
+
+    def file_size(self, path: FilePath) -> int:
+        """Return the size of the content of a saved file.
+
+        Parameters:
+        -----------
+        path:
+        The path to the saved file.
+
+        Returns:
+        --------
+        The size of the file content in bytes.
+        """
+
+        if self._storage is not None and self._storage.is_encrypted(path):
+            return self._storage.size(path)
+
+        return getsize(path)
+
+    def read_file(self, path: FilePath, start: int = 0, length: int = None) -> bytes:
+        """Read the content of a saved file or its byte range.
+
+        Files encrypted at rest are decrypted, reading only the blocks
+        that cover the requested range. Files saved before the encryption
+        was enabled are read as they are.
+
+        Parameters:
+        -----------
+        path:
+        The path to the saved file.
+
+        start:
+        The position of the first byte to read.
+
+        length:
+        The maximum number of bytes to read (default: None).
+        By default, the file is read up to its end.
+
+        Returns:
+        --------
+        The file content.
+        """
+
+        if length is None:
+            length = max(0, self.file_size(path) - start)
+
+        if self._storage is not None and self._storage.is_encrypted(path):
+            return self._storage.read_range(path, start, length)
+
+        with open(path, 'rb') as stream:
+            stream.seek(start)
+            return stream.read(length)
@@ -0,0 +1,1592 @@
+"""Scanner management service.
+
+Turns a photo of a document page into a flat, cleaned scan:
+
+1. The photo is decoded to grayscale, or to color if the colors are kept
+   or some of them are dropped.
+2. The page is detected on a downscaled proxy of the photo: the page is
+   separated from the darker background by a global threshold and its
+   corners are found as the extreme points of the page region.
+3. The page edges are refined at full resolution: the strongest edge
+   is searched along the normals of each side of the coarse quadrilateral
+   and a line is fitted to the edge points. The refined corners are the
+   intersections of the lines.
+4. The skew of the text lines is estimated on a binarized proxy of the
+   flat page by searching the angle whose row projection profile has the
+   highest variance, first in coarse and then in finer steps.
+5. The page is mapped onto a rectangle by a perspective transformation,
+   which also rotates the text lines level, so the full resolution page
+   is resampled only once.
+6. The page is cleaned into a grayscale or a color image whose paper is
+   turned white by a lookup table per channel, the colors of the dropped
+   hues included, or into a binary image, binarized by a global threshold
+   or by local thresholds following uneven lighting.
+
+All stages are vectorized NumPy operations. The full resolution image is
+touched only by the decoding, the edge refinement (a few thousand pixels),
+the sampling of the skew proxy and the perspective transformation.
+
+Pages too large for a single photo or scan are stitched from overlapping
+tiles: their offsets are found by phase correlation on downscaled proxies
+and refined on full resolution crops of the overlaps, and the tiles are
+blended with feathered seams into a memory-mapped canvas, a strip of rows
+at a time.
+"""
+
+import io
+import os
+import tempfile
+from logging import getLogger
+
+import numpy as np
+from PIL import Image
+
+from server.imaging import box_blur, convolve1d, next_fast_size
+
+log = getLogger('master')
+
+SCAN_MODES = ('gray', 'color', 'binary', 'sauvola', 'bradley')
+
+
+class InvalidImageError(Exception):
+    pass
+
+class PageNotFoundError(Exception):
+    pass
+
+class InvalidScanModeError(Exception):
+    pass
+
+class InvalidDropoutError(Exception):
+    pass
+
+class OverlapNotFoundError(Exception):
+    pass
+
+
+class PageSignature:
+    """Cheap statistics of a page, which tell the blank
+    pages and the repeated pages of a batch apart."""
+
+    def __init__(
+        self, ink: float, deviation: float,
+        dhash: int, thumbnail: np.ndarray) -> None:
+        """Initialize the signature.
+
+        Parameters:
+        -----------
+        ink:
+        The fraction of the page covered by ink.
+
+        deviation:
+        The standard deviation of the page brightness.
+
+        dhash:
+        The difference hash of the page, a bit per pair of neighbor
+        cells of a grid set if the left cell has more ink.
+
+        thumbnail:
+        The ink coverage of the cells of a finer grid,
+        normalized to zero mean and unit norm.
+        """
+
+        self.ink = ink
+        self.deviation = deviation
+        self.dhash = dhash
+        self.thumbnail = thumbnail
+
+    def is_blank(self, max_ink: float, min_deviation: float) -> bool:
+        """Return True if the page has almost no ink or almost no contrast."""
+        return self.ink <= max_ink or self.deviation < min_deviation
+
+    def distance(self, other: 'PageSignature') -> int:
+        """Return the number of bits the hashes of the pages differ in."""
+        return (self.dhash ^ other.dhash).bit_count()
+
+    def similarity(self, other: 'PageSignature') -> float:
+        """Return the correlation of the thumbnails of the pages."""
+        return float(np.dot(self.thumbnail.ravel(), other.thumbnail.ravel()))
+
+    def is_duplicate(
+        self, other: 'PageSignature',
+        max_distance: int, min_similarity: float) -> bool:
+        """Return True if the pages look the same. The hashes are
+        compared first, the thumbnails only if the hashes are close."""
+
+        return (
+            self.distance(other) <= max_distance
+            and self.similarity(other) >= min_similarity)
+
+
+def _otsu_threshold(hist: np.ndarray) -> int:
+    """Return the threshold maximizing the between-class
+    variance of a 256-bin histogram."""
+
+    hist = hist.astype(np.float64)
+    levels = np.arange(256, dtype = np.float64)
+
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    mass_bg = np.cumsum(hist * levels)
+    mass_fg = mass_bg[-1] - mass_bg
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean_bg = mass_bg / weight_bg
+        mean_fg = mass_fg / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+
+    # a single-valued image has no threshold
+    if np.isnan(variance).all():
+        return int(np.argmax(hist))
+
+    return int(np.nanargmax(variance))
+
+
+def _block_sums(img: np.ndarray, block: int, dtype: type = np.uint32) -> np.ndarray:
+    """Return the sums of the non-overlapping square blocks of an image
+    whose sides are multiples of the block size."""
+
+    # adding strided slices is much faster than reducing short axes
+    rows = img[0::block].astype(dtype)
+    for offset in range(1, block):
+        rows += img[offset::block]
+
+    sums = rows[:, 0::block].copy()
+    for offset in range(1, block):
+        sums += rows[:, offset::block]
+
+    return sums
+
+
+def _window_sums(img: np.ndarray, size: int) -> np.ndarray:
+    """Return the sums of the square window around each pixel computed
+    from a summed-area table, so the cost per pixel does not depend on
+    the window size. The image is mirrored at the edges."""
+
+    padded = np.pad(img, size // 2, mode = 'symmetric')
+
+    table = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype = np.float64)
+    np.cumsum(padded, axis = 0, dtype = np.float64, out = table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis = 1, out = table[1:, 1:])
+
+    sums = table[size:, size:] - table[:-size, size:]
+    sums -= table[size:, :-size]
+    sums += table[:-size, :-size]
+
+    return sums
+
+
+def _grid_means(img: np.ndarray, grid: tuple) -> np.ndarray:
+    """Return the means of the cells of a grid of (rows, columns)
+    laid over the image, the remainder rows and columns left out."""
+
+    rows, cols = grid
+    height, width = img.shape[0] // rows, img.shape[1] // cols
+    cells = img[:rows * height, :cols * width].reshape(rows, height, cols, width)
+
+    return cells.mean(axis = (1, 3), dtype = np.float32)
+
+
+def _histogram(img: np.ndarray) -> np.ndarray:
+    """Return the 256-bin histogram of an 8-bit image."""
+    return np.bincount(img.ravel(), minlength = 256)
+
+
+def _hues(rgb: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the hues in degrees and the saturations
+    of the HSV model of an array of RGB colors."""
+
+    rgb = rgb.astype(np.float32)
+    high = rgb.max(axis = -1)
+    chroma = high - rgb.min(axis = -1)
+    red, green, blue = np.moveaxis(rgb, -1, 0)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        hue = np.select(
+            [high == red, high == green],
+            [(green - blue) / chroma, (blue - red) / chroma + 2],
+            (red - green) / chroma + 4)
+        saturation = np.where(high > 0, chroma / high, 0)
+
+    return np.nan_to_num(hue * 60) % 360, saturation
+
+
+def parse_dropout(ranges) -> tuple:
+    """Validate the hue ranges of the colors dropped from a page.
+
+    Parameters:
+    -----------
+    ranges:
+    A list of (start, end) hues in degrees. A range whose start is
+    greater than its end wraps around 0, e.g. (330, 30) for the reds.
+
+    Returns:
+    --------
+    The ranges as a tuple of pairs of floats.
+
+    Raises:
+    -------
+    InvalidDropoutError:
+    If the ranges are not valid.
+    """
+
+    if not isinstance(ranges, (list, tuple)):
+        raise InvalidDropoutError('The dropout must be a list of hue ranges!')
+
+    parsed = []
+    for hue_range in ranges:
+        if (not isinstance(hue_range, (list, tuple)) or len(hue_range) != 2
+            or not all(
+                isinstance(hue, (int, float)) and not isinstance(hue, bool)
+                for hue in hue_range)):
+            raise InvalidDropoutError(f'Invalid hue range: "{hue_range}"')
+
+        if not all(0 <= hue <= 360 for hue in hue_range):
+            raise InvalidDropoutError(f'The hues must be within 0 and 360 degrees: "{hue_range}"')
+
+        parsed.append((float(hue_range[0]), float(hue_range[1])))
+
+    return tuple(parsed)
+
+
+def _spectrum(img: np.ndarray, shape: tuple) -> np.ndarray:
+    """Return the spectrum of the zero-mean image zero-padded to the shape."""
+    return np.fft.rfft2(img - img.mean(dtype = np.float32), shape)
+
+
+def _phase_correlation(
+    spectrum_a: np.ndarray, spectrum_b: np.ndarray,
+    shape: tuple, limit: tuple, peaks: int) -> np.ndarray:
+    """Return the strongest offsets of the image `b` within the image `a`
+    found by the phase correlation of their spectra, each as (dy, dx).
+
+    The offsets are periodic in the shape, those reaching the limit
+    are taken as negative. They are unambiguous if the shape is at least
+    as large as both images side by side and the limit is the shape of `a`."""
+
+    cross = spectrum_a * np.conj(spectrum_b)
+    cross /= np.abs(cross) + 1e-9
+    corr = np.fft.irfft2(cross, shape)
+
+    top = np.argpartition(corr.ravel(), -peaks)[-peaks:]
+    top = top[np.argsort(corr.ravel()[top])[::-1]]
+    offsets = np.stack(np.unravel_index(top, shape), axis = 1)
+
+    return np.where(offsets >= limit, offsets - np.array(shape), offsets)
+
+
+def _overlap(shape_a: tuple, shape_b: tuple, offset: np.ndarray) -> tuple:
+    """Return the slices of the overlap of the image `b` placed at
+    the offset within the image `a`, in the coordinates of `a`."""
+
+    top, left = max(0, offset[0]), max(0, offset[1])
+    bottom = min(shape_a[0], offset[0] + shape_b[0])
+    right = min(shape_a[1], offset[1] + shape_b[1])
+
+    return slice(top, max(top, bottom)), slice(left, max(left, right))
+
+
+def _correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """Return the normalized cross-correlation of two images of the same shape."""
+
+    a = a - a.mean(dtype = np.float32)
+    b = b - b.mean(dtype = np.float32)
+    norm = np.sqrt(np.sum(a * a) * np.sum(b * b))
+
+    return float(np.sum(a * b) / norm) if norm > 0 else 0.0
+
+
+def _feather(size: int, width: int) -> np.ndarray:
+    """Return the blending weights along a side of a tile,
+    rising from its edges to 1 over the feathering width."""
+
+    ramp = np.minimum(np.arange(1, size + 1), np.arange(size, 0, -1))
+    return np.minimum(ramp / width, 1).astype(np.float32)
+
+
+class ScannerManager:
+    """Manager for the scanner application."""
+
+    def __init__(
+        self, proxy_size: int = 384,
+        min_page_area: float = 0.2,
+        min_contrast: float = 24.0,
+        edge_samples: int = 48,
+        max_skew: float = 10.0,
+        skew_resolution: float = 0.05,
+        skew_proxy_size: int = 1024,
+        skew_points: int = 16000,
+        signature_size: int = 256,
+        paper_proxy_size: int = 256,
+        dropout_saturation: float = 0.25,
+        stitch_proxy_size: int = 512,
+        stitch_refine_size: int = 256,
+        stitch_feather: int = 64,
+        min_overlap: float = 0.02,
+        min_tile_match: float = 0.5) -> None:
+        """Initialize the scanner manager.
+
+        Parameters:
+        -----------
+        proxy_size:
+        The length of the longer side of the downscaled
+        image the page is detected on.
+
+        min_page_area:
+        The minimum area of a detected page relative to the photo.
+
+        min_contrast:
+        The minimum difference between the mean brightness
+        of the page and the background.
+
+        edge_samples:
+        The number of points along each page side at which the
+        edge is searched at full resolution.
+
+        max_skew:
+        The largest skew of the text lines in degrees that is corrected.
+
+        skew_resolution:
+        The precision of the skew estimation in degrees.
+        Smaller skews are not corrected.
+
+        skew_proxy_size:
+        The length of the longer side of the downscaled
+        page the skew is estimated on.
+
+        skew_points:
+        The maximum number of ink pixels the skew is estimated from.
+
+        signature_size:
+        The length of the longer side of the downscaled
+        page the page signatures are computed on.
+
+        paper_proxy_size:
+        The length of the longer side of the downscaled
+        page the paper color is estimated on.
+
+        dropout_saturation:
+        The lowest saturation of the colors dropped from a page,
+        which keeps the black and gray ink.
+
+        stitch_proxy_size:
+        The length of the longest side of the downscaled
+        tiles the offsets of the stitched tiles are searched on.
+
+        stitch_refine_size:
+        The length of the sides of the full resolution crops
+        of the overlaps the offsets are refined on.
+
+        stitch_feather:
+        The width in pixels over which the weights of the
+        stitched tiles rise from their edges.
+
+        min_overlap:
+        The minimum area of the overlap of two stitched tiles
+        relative to the smaller tile.
+
+        min_tile_match:
+        The minimum correlation of the overlap of two stitched tiles.
+        """
+
+        self._proxy_size = proxy_size
+        self._min_page_area = min_page_area
+        self._min_contrast = min_contrast
+        self._edge_samples = edge_samples
+        self._max_skew = max_skew
+        self._skew_resolution = skew_resolution
+        self._skew_proxy_size = skew_proxy_size
+        self._skew_points = skew_points
+        self._signature_size = signature_size
+        self._paper_proxy_size = paper_proxy_size
+        self._dropout_saturation = dropout_saturation
+        self._stitch_proxy_size = stitch_proxy_size
+        self._stitch_refine_size = stitch_refine_size
+        self._stitch_feather = stitch_feather
+        self._min_overlap = min_overlap
+        self._min_tile_match = min_tile_match
+
+    def decode_image(
+        self, data: bytes, max_size: int = None,
+        color: bool = False) -> np.ndarray:
+        """Decode an image file into an 8-bit grayscale or RGB array.
+
+        Parameters:
+        -----------
+        data:
+        The content of the image file (any format supported by Pillow).
+
+        max_size:
+        If set, a JPEG image is decoded at the smallest scale whose
+        sides are at least as long (default: None, the full scale).
+
+        color:
+        If `True`, the image is decoded in RGB (default: False).
+
+        Returns:
+        --------
+        The grayscale or the RGB image.
+
+        Raises:
+        -------
+        InvalidImageError:
+        If the data is not a valid image file.
+        """
+
+        try:
+            image = Image.open(io.BytesIO(data))
+
+            # JPEG images are decoded directly to grayscale,
+            # skipping the conversion of the color channels
+            image.draft(
+                'RGB' if color else 'L',
+                image.size if max_size is None else (max_size, max_size))
+
+            return np.asarray(image.convert('RGB' if color else 'L'))
+        except (OSError, ValueError) as err:
+            raise InvalidImageError(f"Failed to decode the image: {err}") from err
+
+    def encode_image(self, img: np.ndarray, fmt: str = 'PNG') -> bytes:
+        """Encode an 8-bit grayscale or RGB array into an image file.
+
+        Parameters:
+        -----------
+        img:
+        The grayscale or the RGB image.
+
+        fmt:
+        The image file format (default: PNG).
+
+        Returns:
+        --------
+        The content of the image file.
+        """
+
+        stream = io.BytesIO()
+        Image.fromarray(img).save(stream, format = fmt)
+
+        return stream.getvalue()
+
+    def _create_proxy(self, img: np.ndarray) -> tuple[np.ndarray, int]:
+        """Downscale the image by an integer factor by averaging
+        pixel blocks. Returns the proxy and the factor."""
+
+        factor = max(1, int(np.ceil(max(img.shape) / self._proxy_size)))
+        height = img.shape[0] // factor
+        width = img.shape[1] // factor
+
+        blocks = img[:height * factor, :width * factor].reshape(
+            height, factor, width, factor)
+
+        return blocks.mean(axis = (1, 3), dtype = np.float32), factor
+
+    def _find_page_region(self, proxy: np.ndarray) -> np.ndarray:
+        """Return the mask of the bright region connected to the
+        center of the proxy, which is assumed to be the page."""
+
+        smooth = box_blur(proxy, 2)
+        threshold = _otsu_threshold(_histogram(np.clip(smooth, 0, 255).astype(np.uint8)))
+
+        # remove small holes and specks such as the text on the page
+        mask = box_blur((smooth > threshold).astype(np.float32), 1) > 0.5
+
+        # a threshold splitting the noise of a plain image
+        # separates two classes of nearly the same brightness
+        if mask.all() or not mask.any() or (
+            smooth[mask].mean() - smooth[~mask].mean() < self._min_contrast):
+            raise PageNotFoundError("The page does not stand out from the background!")
+
+        # grow the region from the central part of the page
+        height, width = mask.shape
+        region = np.zeros_like(mask)
+        center = (
+            slice(height * 2 // 5, height * 3 // 5 + 1),
+            slice(width * 2 // 5, width * 3 // 5 + 1)
+        )
+        region[center] = mask[center]
+
+        if not region.any():
+            raise PageNotFoundError("No page found in the center of the image!")
+
+        while True:
+            grown = region.copy()
+            for _ in range(8):
+                grown[1:] |= grown[:-1]
+                grown[:-1] |= grown[1:]
+                grown[:, 1:] |= grown[:, :-1]
+                grown[:, :-1] |= grown[:, 1:]
+                grown &= mask
+
+            if np.array_equal(grown, region):
+                return region
+
+            region = grown
+
+    def _find_coarse_corners(self, region: np.ndarray) -> np.ndarray:
+        """Return the corners of the page region as the extreme points
+        along the diagonals, ordered top-left, top-right, bottom-right,
+        bottom-left."""
+
+        ys, xs = np.nonzero(region)
+        diag = xs + ys
+        anti = xs - ys
+
+        indices = [
+            np.argmin(diag), np.argmax(anti),
+            np.argmax(diag), np.argmin(anti)
+        ]
+
+        return np.array([[xs[idx], ys[idx]] for idx in indices], dtype = np.float64)
+
+    def _fit_edge_line(
+        self, img: np.ndarray, start: np.ndarray,
+        end: np.ndarray, inward: np.ndarray, band: int) -> np.ndarray|None:
+        """Find the page edge near a side of the coarse quadrilateral.
+
+        Returns the line as (a, b, c) with a*x + b*y = c and (a, b)
+        of unit length, or None if no edge is found.
+        """
+
+        direction = end - start
+        normal = np.array([-direction[1], direction[0]])
+        normal /= np.linalg.norm(normal)
+
+        # the normal points out of the page
+        if normal @ inward > 0:
+            normal = -normal
+
+        # sample the profiles across the side, skipping the corners
+        ts = np.linspace(0.1, 0.9, self._edge_samples)[:, None]
+        offsets = np.arange(-band, band + 1, dtype = np.float64)
+        points = start + ts * direction
+        coords = points[:, None, :] + offsets[None, :, None] * normal
+
+        xs = np.clip(np.rint(coords[..., 0]).astype(np.intp), 0, img.shape[1] - 1)
+        ys = np.clip(np.rint(coords[..., 1]).astype(np.intp), 0, img.shape[0] - 1)
+        profiles = img[ys, xs].astype(np.float32)
+
+        # smooth the profiles and find the steepest drop outwards
+        kernel = np.array([1, 2, 3, 2, 1], dtype = np.float32) / 9
+        profiles = convolve1d(profiles, kernel, axis = 1)
+        drops = profiles[:, :-1] - profiles[:, 1:]
+        drops[:, :3] = 0
+        drops[:, -3:] = 0
+
+        best = np.argmax(drops, axis = 1)
+        strength = drops[np.arange(len(best)), best]
+
+        # a sub-pixel position from the parabola through the neighbors
+        left = drops[np.arange(len(best)), np.maximum(best - 1, 0)]
+        right = drops[np.arange(len(best)), np.minimum(best + 1, drops.shape[1] - 1)]
+        denom = left - 2 * strength + right
+        shift = np.where(denom < 0, 0.5 * (left - right) / np.where(denom < 0, denom, 1), 0)
+
+        edge = points + (offsets[best] + 0.5 + shift)[:, None] * normal
+
+        # only the clear edges are used
+        valid = strength > max(8.0, 0.5 * np.median(strength))
+        if valid.sum() < 4:
+            return None
+
+        line = None
+        edge = edge[valid]
+
+        # total least squares fit, repeated without the outliers
+        for _ in range(2):
+            center = edge.mean(axis = 0)
+            _, _, vt = np.linalg.svd(edge - center)
+            line_normal = vt[1]
+            line = np.array([line_normal[0], line_normal[1], line_normal @ center])
+
+            residuals = np.abs(edge @ line_normal - line[2])
+            keep = residuals <= max(1.0, 2.5 * np.median(residuals))
+            if keep.sum() < 4 or keep.all():
+                break
+            edge = edge[keep]
+
+        return line
+
+    def _refine_corners(self, img: np.ndarray, corners: np.ndarray, factor: int) -> np.ndarray:
+        """Refine the corners found on the proxy at full resolution."""
+
+        # the coarse corners are off by a few proxy pixels
+        band = 3 * factor + 4
+        centroid = corners.mean(axis = 0)
+        lines = []
+
+        for idx in range(4):
+            start, end = corners[idx], corners[(idx + 1) % 4]
+            inward = centroid - (start + end) / 2
+            line = self._fit_edge_line(img, start, end, inward, band)
+
+            if line is None:
+                log.debug("Page edge %d not refined.", idx)
+                return corners
+
+            lines.append(line)
+
+        refined = np.empty_like(corners)
+
+        for idx in range(4):
+            # the corner lies between the previous and the current side
+            prev_line, line = lines[idx - 1], lines[idx]
+            matrix = np.array([prev_line[:2], line[:2]])
+
+            if abs(np.linalg.det(matrix)) < 1e-6:
+                return corners
+
+            refined[idx] = np.linalg.solve(matrix, [prev_line[2], line[2]])
+
+        # the refinement must not move the corners far
+        if np.abs(refined - corners).max() > 2 * band:
+            log.debug("Page corners not refined, the edges are ambiguous.")
+            return corners
+
+        return refined
+
+    def detect_page(self, img: np.ndarray) -> np.ndarray:
+        """Detect the corners of the page.
+
+        Parameters:
+        -----------
+        img:
+        The grayscale photo.
+
+        Returns:
+        --------
+        The corners of the page as (x, y) pixel coordinates in the order
+        top-left, top-right, bottom-right, bottom-left.
+
+        Raises:
+        -------
+        PageNotFoundError:
+        If no page is found or the page found is too small.
+        """
+
+        proxy, factor = self._create_proxy(img)
+        region = self._find_page_region(proxy)
+
+        if region.mean() < self._min_page_area:
+            raise PageNotFoundError("The page found is too small!")
+
+        # the center of a proxy pixel in the full resolution coordinates
+        corners = self._find_coarse_corners(region) * factor + (factor - 1) / 2
+
+        return self._refine_corners(img, corners, factor)
+
+    def _find_page(self, img: np.ndarray) -> np.ndarray:
+        """Return the corners of the page, or of the whole image if no page is found."""
+
+        try:
+            return self.detect_page(img)
+        except PageNotFoundError as err:
+            log.warning("%s Scanning the whole image.", err)
+            height, width = img.shape
+
+            return np.array(
+                [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+                dtype = np.float64)
+
+    def _compute_homography(self, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """Return the homography mapping the dst points onto the src points."""
+
+        rows = []
+        rhs = []
+
+        for (x, y), (u, v) in zip(src, dst):
+            rows.append([u, v, 1, 0, 0, 0, -u * x, -v * x])
+            rows.append([0, 0, 0, u, v, 1, -u * y, -v * y])
+            rhs.extend([x, y])
+
+        params = np.linalg.solve(np.array(rows), np.array(rhs))
+
+        return np.append(params, 1.0).reshape(3, 3)
+
+    def _page_transform(self, corners: np.ndarray) -> tuple[np.ndarray, tuple]:
+        """Return the homography mapping the flat page onto the photo
+        and the size of the flat page as (height, width)."""
+
+        top_left, top_right, bottom_right, bottom_left = corners
+        # the corners are pixel centers, so the page is one pixel larger
+        width = int(round(max(
+            np.linalg.norm(top_right - top_left),
+            np.linalg.norm(bottom_right - bottom_left)))) + 1
+        height = int(round(max(
+            np.linalg.norm(bottom_left - top_left),
+            np.linalg.norm(bottom_right - top_right)))) + 1
+
+        target = np.array(
+            [[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]],
+            dtype = np.float64)
+
+        return self._compute_homography(corners, target), (height, width)
+
+    def _rotation(self, angle: float, shape: tuple) -> np.ndarray:
+        """Return the transformation mapping an image rotated clockwise
+        by the angle in degrees about its center onto the source image."""
+
+        cos, sin = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+        center_x, center_y = (shape[1] - 1) / 2, (shape[0] - 1) / 2
+
+        # the y axis points down, so the rotation matrix is transposed
+        return np.array([
+            [cos, sin, center_x - cos * center_x - sin * center_y],
+            [-sin, cos, center_y + sin * center_x - cos * center_y],
+            [0, 0, 1]
+        ])
+
+    def _warp(
+        self, img: np.ndarray, hom: np.ndarray,
+        shape: tuple, strip_rows: int = 256) -> np.ndarray:
+        """Resample the image by bilinear interpolation.
+
+        The homography maps the output pixels onto the source pixels.
+        The output is computed in strips of rows, which limits the memory
+        used by the temporary arrays. The pixels mapped outside of the
+        image take the value of the nearest edge pixel. The channels of
+        a color image share the coordinates and the weights.
+        """
+
+        hom = hom.astype(np.float32)
+        height, width = shape
+        channels = img.shape[2:]
+        src = img.reshape((-1,) + channels)
+        src_height, src_width = img.shape[:2]
+        out = np.empty((height, width) + channels, dtype = np.uint8)
+        us = np.arange(width, dtype = np.float32)
+
+        for top in range(0, height, strip_rows):
+            vs = np.arange(top, min(top + strip_rows, height), dtype = np.float32)[:, None]
+
+            # the source coordinates of the output pixels
+            inv_den = 1.0 / (hom[2, 0] * us + (hom[2, 1] * vs + hom[2, 2]))
+            xs = (hom[0, 0] * us + (hom[0, 1] * vs + hom[0, 2])) * inv_den
+            ys = (hom[1, 0] * us + (hom[1, 1] * vs + hom[1, 2])) * inv_den
+
+            np.clip(xs, 0, src_width - 1.001, out = xs)
+            np.clip(ys, 0, src_height - 1.001, out = ys)
+
+            x0 = xs.astype(np.intp)
+            y0 = ys.astype(np.intp)
+            xs -= x0
+            ys -= y0
+
+            if channels:
+                xs, ys = xs[..., None], ys[..., None]
+
+            # bilinear interpolation of the four neighbors
+            idx = y0 * src_width + x0
+            p00 = src[idx].astype(np.float32)
+            p01 = src[idx + 1].astype(np.float32)
+            idx += src_width
+            p10 = src[idx].astype(np.float32)
+            p11 = src[idx + 1].astype(np.float32)
+
+            p00 += xs * (p01 - p00)
+            p10 += xs * (p11 - p10)
+            p00 += ys * (p10 - p00)
+
+            out[top:top + len(vs)] = p00 + 0.5
+
+        return out
+
+    def _sample(self, img: np.ndarray, hom: np.ndarray, shape: tuple) -> np.ndarray:
+        """Resample the image at the nearest pixels, which is enough for
+        the proxies decimating it. The homography maps the output pixels
+        onto the source pixels."""
+
+        hom = hom.astype(np.float32)
+        us = np.arange(shape[1], dtype = np.float32)
+        vs = np.arange(shape[0], dtype = np.float32)[:, None]
+
+        inv_den = 1.0 / (hom[2, 0] * us + (hom[2, 1] * vs + hom[2, 2]))
+        xs = (hom[0, 0] * us + (hom[0, 1] * vs + hom[0, 2])) * inv_den
+        ys = (hom[1, 0] * us + (hom[1, 1] * vs + hom[1, 2])) * inv_den
+
+        xs = np.clip(xs + 0.5, 0, img.shape[1] - 1).astype(np.intp)
+        idx = np.clip(ys + 0.5, 0, img.shape[0] - 1).astype(np.intp)
+
+        # gathering by flat indices is faster than by pairs of them
+        idx *= img.shape[1]
+        idx += xs
+
+        return img.ravel().take(idx)
+
+    def warp_page(
+        self, img: np.ndarray, corners: np.ndarray,
+        angle: float = 0.0, strip_rows: int = 256) -> np.ndarray:
+        """Map the page onto a rectangle by a perspective transformation.
+
+        Parameters:
+        -----------
+        img:
+        The grayscale photo.
+
+        corners:
+        The page corners as returned by `detect_page`.
+
+        angle:
+        The skew of the page content in degrees, counterclockwise, which
+        is corrected by the same transformation (default: 0.0).
+
+        strip_rows:
+        The number of output rows computed at once, which
+        limits the memory used by the temporary arrays.
+
+        Returns:
+        --------
+        The page as a grayscale image.
+        """
+
+        hom, shape = self._page_transform(corners)
+
+        if angle != 0.0:
+            hom = hom @ self._rotation(angle, shape)
+
+        return self._warp(img, hom, shape, strip_rows)
+
+    def _skew_scores(
+        self, xs: np.ndarray, ys: np.ndarray,
+        angles: np.ndarray, bin_size: float) -> np.ndarray:
+        """Score the candidate skew angles of the ink pixels.
+
+        The pixels are projected onto the direction perpendicular to the
+        text lines for each angle. At the right angle, the bins of the
+        profile fall either on the lines or between them, so the profile
+        has the highest variance, or the highest sum of squares since
+        the number of pixels is the same.
+        """
+
+        radians = np.radians(angles)[:, None]
+        offsets = (xs * np.sin(radians) + ys * np.cos(radians)) / bin_size
+
+        # each angle gets its own range of bins
+        bins = int(np.ceil(2 * np.sqrt((xs ** 2 + ys ** 2).max()) / bin_size)) + 2
+        idx = (offsets + bins / 2).astype(np.intp)
+        idx += np.arange(len(angles))[:, None] * bins
+        hist = np.bincount(idx.ravel(), minlength = len(angles) * bins)
+
+        return (hist.reshape(len(angles), bins).astype(np.float64) ** 2).sum(axis = 1)
+
+    def _search_skew(
+        self, xs: np.ndarray, ys: np.ndarray, center: float,
+        span: float, step: float, bin_size: float) -> tuple[float, float]:
+        """Search the best skew angle around the center in finer
+        and finer steps down to the resolution of the profile bins.
+        Returns the angle and the last step."""
+
+        best = center
+        # a step shifting the far ends of the lines by less than a bin
+        min_step = max(
+            self._skew_resolution,
+            np.degrees(bin_size / max(1.0, 2 * np.abs(xs).max())))
+
+        while True:
+            angles = best + np.arange(-span, span + step / 2, step)
+            scores = self._skew_scores(xs, ys, angles, bin_size)
+            idx = int(np.argmax(scores))
+            best = float(angles[idx])
+
+            if step <= min_step:
+                break
+            span, step = step, max(min_step, step / 8)
+
+        # a sub-step position from the parabola through the neighbors
+        if 0 < idx < len(angles) - 1:
+            left, mid, right = scores[idx - 1:idx + 2]
+            denom = left - 2 * mid + right
+            if denom < 0:
+                best += 0.5 * step * (left - right) / denom
+
+        return best, step
+
+    def _find_skew(self, img: np.ndarray, hom: np.ndarray, shape: tuple) -> float:
+        """Estimate the skew of the text lines on a page.
+
+        Parameters:
+        -----------
+        img:
+        The grayscale image.
+
+        hom:
+        The transformation mapping the page pixels onto the image pixels.
+
+        shape:
+        The size of the page as (height, width).
+
+        Returns:
+        --------
+        The angle of the text lines in degrees, counterclockwise.
+        """
+
+        # the page is downscaled to the proxy, which is binarized
+        # by Bradley's local thresholds
+        factor = max(1.0, max(shape) / self._skew_proxy_size)
+        proxy_shape = (max(1, int(shape[0] / factor)), max(1, int(shape[1] / factor)))
+        proxy = self._sample(img, hom @ np.diag([factor, factor, 1.0]), proxy_shape)
+
+        window = max(15, min(proxy_shape) // 40) | 1
+        ink = self.adaptive_threshold(proxy, 'bradley', window) == 0
+
+        ys, xs = np.nonzero(ink)
+        if len(xs) < 0.001 * ink.size:
+            return 0.0
+
+        # the angle does not depend on the scale, so the search
+        # runs in the proxy pixels on a random subset of the ink
+        if len(xs) > self._skew_points:
+            picked = np.random.default_rng(0).choice(len(xs), self._skew_points, replace = False)
+            xs, ys = xs[picked], ys[picked]
+
+        xs = (xs - (proxy_shape[1] - 1) / 2).astype(np.float32)
+        ys = (ys - (proxy_shape[0] - 1) / 2).astype(np.float32)
+
+        angle, _ = self._search_skew(
+            xs, ys, 0.0, self._max_skew, self._max_skew / 8, 1.0)
+
+        return angle
+
+    def estimate_skew(self, page: np.ndarray) -> float:
+        """Estimate the skew of the text lines on the page.
+
+        The skew is searched on a downscaled copy of the page,
+        so the estimation takes about the same time for any page size.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale page.
+
+        Returns:
+        --------
+        The angle of the text lines in degrees, counterclockwise, or 0.0
+        if the page has too little ink to tell.
+        """
+
+        return self._find_skew(page, np.eye(3), page.shape)
+
+    def deskew(self, page: np.ndarray, angle: float = None) -> tuple[np.ndarray, float]:
+        """Rotate the page so that the text lines are horizontal.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale page.
+
+        angle:
+        The skew in degrees (default: None, estimated by `estimate_skew`).
+
+        Returns:
+        --------
+        A tuple of the straightened page and the skew angle.
+        """
+
+        if angle is None:
+            angle = self.estimate_skew(page)
+
+        # resampling blurs the page more than a tiny skew would harm it
+        if abs(angle) < self._skew_resolution:
+            return page, angle
+
+        return self._warp(page, self._rotation(angle, page.shape), page.shape), angle
+
+    def page_signature(self, img: np.ndarray, corners: np.ndarray = None) -> PageSignature:
+        """Compute the signature of a page on a downscaled copy of it.
+
+        Parameters:
+        -----------
+        img:
+        The grayscale photo, which may be decoded at a reduced scale
+        (see `decode_image`), since only a small copy of the page is used.
+
+        corners:
+        The page corners (default: None, detected by `detect_page`).
+
+        Returns:
+        --------
+        The signature of the page.
+        """
+
+        if corners is None:
+            corners = self._find_page(img)
+
+        hom, shape = self._page_transform(corners)
+        factor = max(shape) / self._signature_size
+        # the grids of the hashes need at least 32 rows and columns
+        proxy_shape = (max(32, int(shape[0] / factor)), max(32, int(shape[1] / factor)))
+        proxy = self._sample(img, hom @ np.diag([
+            shape[1] / proxy_shape[1], shape[0] / proxy_shape[0], 1.0]), proxy_shape)
+
+        # the nearest pixels hit the ink as often as the ink covers the
+        # page, and the local thresholds do not take shadows for ink
+        window = max(15, min(proxy_shape) // 16) | 1
+        ink = self.adaptive_threshold(proxy, 'bradley', window) == 0
+
+        # the margins are left out, where the background may show
+        # along the page edges or the scanner casts a shadow
+        top, left = int(proxy_shape[0] * 0.03), int(proxy_shape[1] * 0.03)
+        proxy = proxy[top:proxy_shape[0] - top, left:proxy_shape[1] - left]
+        ink = ink[top:proxy_shape[0] - top, left:proxy_shape[1] - left]
+
+        # the cells are small enough to tell the words apart, since the
+        # coarse cells of the lines of text on a page are all alike
+        cells = _grid_means(ink, (32, 33))
+        dhash = int.from_bytes(np.packbits(cells[:, :-1] > cells[:, 1:]).tobytes(), 'big')
+
+        thumbnail = _grid_means(ink, (32, 32))
+        thumbnail -= thumbnail.mean()
+        norm = np.linalg.norm(thumbnail)
+        if norm > 0:
+            thumbnail /= norm
+
+        return PageSignature(float(ink.mean()), float(proxy.std()), dhash, thumbnail)
+
+    def sign_page(self, data: bytes) -> PageSignature:
+        """Compute the signature of the page on a photo, which is decoded
+        at a reduced scale if possible (see `page_signature`).
+
+        Raises:
+        -------
+        InvalidImageError:
+        If the data is not a valid image file.
+        """
+
+        img = self.decode_image(data, max_size = max(self._proxy_size, 2 * self._signature_size))
+
+        return self.page_signature(img)
+
+    def estimate_paper(self, page: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Estimate the ink and the paper levels of each channel of the page.
+
+        The levels are estimated on a strided proxy of the page. The paper
+        is the brighter class of a global threshold of the brightness, and
+        its level in each channel is the peak of the channel histogram less
+        three times the spread of the paper around the peak, so the noise
+        and the texture of the paper fall above it.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale or the RGB page.
+
+        Returns:
+        --------
+        A tuple of the ink and the paper levels, an array of a level per channel.
+        """
+
+        channels = page.shape[2] if page.ndim == 3 else 1
+        step = max(1, -(-max(page.shape[:2]) // self._paper_proxy_size))
+        proxy = page[::step, ::step].reshape(-1, channels)
+        brightness = proxy.mean(axis = 1, dtype = np.float32).astype(np.uint8)
+
+        threshold = _otsu_threshold(_histogram(brightness))
+        paper = proxy[brightness > threshold]
+        ink = proxy[brightness <= threshold]
+
+        if len(paper) == 0:
+            paper = proxy
+
+        white = np.empty(channels, dtype = np.float32)
+        for channel in range(channels):
+            hist = np.convolve(_histogram(paper[:, channel]), np.ones(5), mode = 'same')
+            peak = int(np.argmax(hist))
+
+            # the median absolute deviation is not swayed by the ink
+            # the threshold left in the paper class
+            spread = 1.4826 * np.median(np.abs(paper[:, channel].astype(np.int16) - peak))
+            white[channel] = max(peak - 3 * spread, 1)
+
+        black = np.percentile(ink, 5, axis = 0) if len(ink) else np.zeros(channels)
+
+        # a page of faint or no ink keeps at least half of the range
+        return np.minimum(black, white / 2).astype(np.float32), white
+
+    def _dropout_table(self, luts: np.ndarray, dropout: tuple) -> np.ndarray:
+        """Return the table of the dropped colors, indexed by
+        the 5 most significant bits of each channel."""
+
+        # the colors are tested at the centers of the cells of the table
+        # as they look once the paper is white
+        centers = np.arange(4, 256, 8)
+        colors = np.stack(np.meshgrid(
+            luts[0, centers], luts[1, centers], luts[2, centers],
+            indexing = 'ij'), axis = -1)
+
+        hue, saturation = _hues(colors)
+
+        in_range = np.zeros(hue.shape, dtype = bool)
+        for start, end in dropout:
+            if start <= end:
+                in_range |= (hue >= start) & (hue <= end)
+            else:
+                in_range |= (hue >= start) | (hue <= end)
+
+        # the dark pixels are kept, their hue is mostly noise
+        table = (
+            in_range
+            & (saturation >= self._dropout_saturation)
+            & (colors.max(axis = -1) >= 64))
+
+        return table.ravel()
+
+    def whiten_page(self, page: np.ndarray, dropout: tuple = None) -> np.ndarray:
+        """Turn the paper of the page white.
+
+        The levels of the ink and the paper of each channel (see `estimate_paper`)
+        are stretched onto black and white by a lookup table per channel, which
+        also removes the color cast of the paper. The colors whose hue is in one
+        of the dropout ranges, such as the lines and the boxes printed on a form,
+        are turned white as well. A color is looked up in a table of 32 levels
+        per channel, so the whole page is cleaned in a single pass.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale or the RGB page.
+
+        dropout:
+        The hue ranges of the dropped colors (see `parse_dropout`, default:
+        None, no color is dropped). A grayscale page has no colors to drop.
+
+        Returns:
+        --------
+        The whitened page.
+
+        Raises:
+        -------
+        InvalidDropoutError:
+        If the dropout ranges are not valid.
+        """
+
+        if dropout:
+            dropout = parse_dropout(dropout)
+
+        black, white = self.estimate_paper(page)
+        log.debug('Paper levels: %s, ink levels: %s', white.tolist(), black.tolist())
+
+        levels = np.arange(256, dtype = np.float32)
+        luts = (levels - black[:, None]) * (255.0 / (white - black))[:, None]
+        luts = np.clip(luts + 0.5, 0, 255).astype(np.uint8)
+
+        if page.ndim == 2:
+            return luts[0][page]
+
+        out = np.empty_like(page)
+        for channel in range(page.shape[2]):
+            np.take(luts[channel], page[..., channel], out = out[..., channel])
+
+        if dropout and page.shape[2] == 3:
+            index = (page[..., 0] & 0xF8).astype(np.uint16) << 7
+            index |= (page[..., 1] & 0xF8).astype(np.uint16) << 2
+            index |= page[..., 2] >> 3
+
+            out[self._dropout_table(luts, dropout)[index]] = 255
+
+        return out
+
+    def adaptive_threshold(
+        self, page: np.ndarray, method: str = 'sauvola',
+        window: int = None, k: float = None) -> np.ndarray:
+        """Binarize the page by thresholds computed from
+        the neighborhood of each pixel.
+
+        Sauvola's threshold is `m * (1 + k * (s / 128 - 1))` and Bradley's
+        threshold is `m * (1 - k)`, where m and s are the mean and the
+        standard deviation of the window around the pixel. Unlike a global
+        threshold, both follow uneven lighting and shadows across the page.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale page.
+
+        method:
+        'sauvola' or 'bradley'.
+
+        window:
+        The window size in pixels (default: None, 1/40 of the
+        shorter side of the page, which spans a few lines of text).
+
+        k:
+        The sensitivity (default: None, 0.2 for Sauvola and 0.15 for Bradley).
+
+        Returns:
+        --------
+        The binary page, ink 0 and paper 255.
+
+        Raises:
+        -------
+        InvalidScanModeError:
+        If the method is not supported.
+        """
+
+        if method not in ('sauvola', 'bradley'):
+            raise InvalidScanModeError(f'Unsupported thresholding method: "{method}"')
+
+        if window is None:
+            window = max(15, min(page.shape) // 40)
+
+        # the statistics vary slowly at the scale of the window, so they
+        # are computed on a grid of small blocks rather than per pixel
+        block = max(1, window // 8)
+        cells = (window // block) | 1
+        area = (cells * block) ** 2
+
+        height, width = page.shape
+        padded = np.pad(page, (
+            (0, -height % block),
+            (0, -width % block)
+        ), mode = 'edge')
+
+        mean = _window_sums(_block_sums(padded, block), cells) / area
+
+        if method == 'bradley':
+            threshold = mean * (1 - (0.15 if k is None else k))
+        else:
+            # the variance is E[x^2] - E[x]^2 of the window
+            squares = np.square(padded, dtype = np.uint16)
+            variance = _window_sums(_block_sums(squares, block), cells) / area
+            std = np.sqrt(np.maximum(variance - mean * mean, 0))
+
+            k = 0.2 if k is None else k
+            threshold = mean * (1 + k * (std / 128 - 1))
+
+        # the pixels are compared with the threshold of their block:
+        # x <= t holds for an integer x exactly if x < floor(t) + 1
+        levels = np.clip(np.floor(threshold) + 1, 0, 255).astype(np.uint8)
+        levels = np.repeat(levels, block, axis = 1)
+        paper = padded.reshape(-1, block, padded.shape[1]) >= levels[:, None, :]
+
+        return paper.reshape(padded.shape)[:height, :width].view(np.uint8) * np.uint8(255)
+
+    def clean_page(self, page: np.ndarray, mode: str = 'gray') -> np.ndarray:
+        """Clean the page image.
+
+        Parameters:
+        -----------
+        page:
+        The grayscale page, or the RGB page in the 'color' mode.
+
+        mode:
+        'gray' and 'color' stretch the contrast between the ink and the
+        paper, which turns white (see `whiten_page`), 'binary' separates
+        the ink from the paper by a global threshold, 'sauvola' and
+        'bradley' by local thresholds (see `adaptive_threshold`).
+
+        Returns:
+        --------
+        The cleaned page.
+
+        Raises:
+        -------
+        InvalidScanModeError:
+        If the mode is not supported.
+        """
+
+        if mode not in SCAN_MODES:
+            raise InvalidScanModeError(f'Unsupported scan mode: "{mode}"')
+
+        if mode in ('sauvola', 'bradley'):
+            return self.adaptive_threshold(page, mode)
+
+        if mode == 'binary':
+            threshold = _otsu_threshold(_histogram(page))
+            lut = np.where(np.arange(256) > threshold, 255, 0).astype(np.uint8)
+            return lut[page]
+
+        return self.whiten_page(page)
+
+    def _tile_gray(self, tile: np.ndarray, rows: slice = slice(None), cols: slice = slice(None)) -> np.ndarray:
+        """Return a region of a tile in grayscale."""
+
+        region = tile[rows, cols]
+        if region.ndim == 2:
+            return region
+
+        return np.asarray(Image.fromarray(np.ascontiguousarray(region)).convert('L'))
+
+    def _match_tiles(
+        self, proxy_a: np.ndarray, proxy_b: np.ndarray,
+        offsets: np.ndarray) -> tuple[np.ndarray, float]:
+        """Return the offset of the proxy `b` within the proxy `a` whose
+        overlap correlates best, and the correlation of the overlap."""
+
+        best, score = None, -1.0
+        min_area = self._min_overlap * min(proxy_a.size, proxy_b.size)
+
+        for offset in offsets:
+            rows, cols = _overlap(proxy_a.shape, proxy_b.shape, offset)
+            height, width = rows.stop - rows.start, cols.stop - cols.start
+
+            if height * width < min_area or min(height, width) < 8:
+                continue
+
+            overlap = _correlation(proxy_a[rows, cols], proxy_b[
+                rows.start - offset[0]:rows.stop - offset[0],
+                cols.start - offset[1]:cols.stop - offset[1]])
+
+            if overlap > score:
+                best, score = offset, overlap
+
+        return best, score
+
+    def _refine_offset(
+        self, tile_a: np.ndarray, tile_b: np.ndarray, proxy_a: np.ndarray,
+        offset: np.ndarray, factor: int) -> np.ndarray:
+        """Refine the offset of the tile `b` within the tile `a` found on
+        the proxies by the phase correlation of full resolution crops
+        of the overlap, taken where the proxy of `a` varies the most."""
+
+        offset = offset * factor
+        rows, cols = _overlap(tile_a.shape, tile_b.shape, offset)
+        height = min(self._stitch_refine_size, rows.stop - rows.start)
+        width = min(self._stitch_refine_size, cols.stop - cols.start)
+
+        # the candidate crops on a grid over the overlap
+        best, spread = (rows.start, cols.start), -1.0
+        for top in np.linspace(rows.start, rows.stop - height, 5).astype(int):
+            for left in np.linspace(cols.start, cols.stop - width, 5).astype(int):
+                crop = proxy_a[
+                    top // factor:(top + height) // factor + 1,
+                    left // factor:(left + width) // factor + 1]
+                if crop.std() > spread:
+                    best, spread = (top, left), crop.std()
+
+        top, left = best
+        crop_a = self._tile_gray(tile_a, slice(top, top + height), slice(left, left + width))
+        crop_b = self._tile_gray(tile_b,
+            slice(top - offset[0], top - offset[0] + height),
+            slice(left - offset[1], left - offset[1] + width))
+
+        shape = crop_a.shape
+        residual = _phase_correlation(
+            _spectrum(crop_a, shape), _spectrum(crop_b, shape),
+            shape, (height // 2, width // 2), 1)[0]
+
+        return offset + residual
+
+    def _place_tiles(
+        self, tiles: list, proxies: list, factor: int) -> np.ndarray:
+        """Return the positions of the tiles relative to the first one.
+
+        The offsets of all the pairs of tiles are searched on the proxies.
+        The tiles are placed one at a time, the tile overlapping a placed
+        tile the best first, and only the offsets used are refined at
+        full resolution."""
+
+        height = max(proxy.shape[0] for proxy in proxies)
+        width = max(proxy.shape[1] for proxy in proxies)
+        shape = (next_fast_size(2 * height), next_fast_size(2 * width))
+        spectra = [_spectrum(proxy, shape) for proxy in proxies]
+
+        matches = {}
+        for i in range(len(tiles)):
+            for j in range(i + 1, len(tiles)):
+                offsets = _phase_correlation(
+                    spectra[i], spectra[j], shape, proxies[i].shape, 5)
+                offset, score = self._match_tiles(proxies[i], proxies[j], offsets)
+
+                log.debug('Tiles %d and %d: offset %s, correlation %.3f', i, j, offset, score)
+
+                if score >= self._min_tile_match:
+                    matches[i, j] = (offset, score)
+                    matches[j, i] = (-offset, score)
+
+        positions = {0: np.zeros(2, dtype = np.int64)}
+
+        while len(positions) < len(tiles):
+            edges = [
+                (score, i, j, offset) for (i, j), (offset, score) in matches.items()
+                if i in positions and j not in positions
+            ]
+
+            if not edges:
+                missing = sorted(set(range(len(tiles))) - set(positions))
+                raise OverlapNotFoundError(f'No overlap found for the tiles {missing}!')
+
+            _, i, j, offset = max(edges, key = lambda edge: edge[0])
+            offset = self._refine_offset(tiles[i], tiles[j], proxies[i], offset, factor)
+            positions[j] = positions[i] + offset
+
+        return np.array([positions[index] for index in range(len(tiles))])
+
+    def stitch(
+        self, tiles: list, path: str, color: bool = False,
+        strip_rows: int = 256) -> tuple[np.ndarray, np.ndarray]:
+        """Stitch overlapping scans of parts of a large page.
+
+        The tiles are aligned by phase correlation on downscaled proxies,
+        which finds their offsets whatever their order and layout, and
+        the offsets are refined at full resolution. The tiles are blended
+        into the canvas in strips of rows, their weights feathered towards
+        their edges so the seams do not show. The decoded tiles and the
+        canvas are memory-mapped files, so only the proxies and a strip
+        of the canvas are held in memory.
+
+        Parameters:
+        -----------
+        tiles:
+        The contents of the image files of the tiles,
+        each overlapping at least one other tile.
+
+        path:
+        The path of the canvas, a NumPy .npy file.
+
+        color:
+        If `True`, the tiles are stitched in RGB (default: False).
+
+        strip_rows:
+        The number of rows of the canvas blended at a time.
+
+        Returns:
+        --------
+        A tuple of the canvas, memory-mapped in read mode, and the
+        positions (y, x) of the top left corners of the tiles in it.
+        The canvas is white where no tile covers it.
+
+        Raises:
+        -------
+        InvalidImageError:
+        If a tile is not a valid image file.
+
+        OverlapNotFoundError:
+        If a tile does not overlap any other tile.
+        """
+
+        scratch = os.path.dirname(os.path.abspath(path))
+
+        with tempfile.TemporaryDirectory(dir = scratch, ignore_cleanup_errors = True) as folder:
+            mapped = []
+            for index, data in enumerate(tiles):
+                tile = self.decode_image(data, color = color)
+                mapped.append(np.lib.format.open_memmap(
+                    os.path.join(folder, f'{index}.npy'), mode = 'w+',
+                    dtype = np.uint8, shape = tile.shape))
+                mapped[-1][:] = tile
+                del tile
+
+            # the same scale for all the proxies keeps their offsets comparable
+            factor = -(-max(max(tile.shape[:2]) for tile in mapped) // self._stitch_proxy_size)
+            proxies = [
+                np.asarray(Image.fromarray(self._tile_gray(tile)).reduce(factor))
+                for tile in mapped
+            ]
+
+            positions = self._place_tiles(mapped, proxies, factor)
+            positions -= positions.min(axis = 0)
+            log.info('Tile positions: %s', positions.tolist())
+
+            corners = positions + [tile.shape[:2] for tile in mapped]
+            height, width = (int(side) for side in corners.max(axis = 0))
+            channels = mapped[0].shape[2:]
+            canvas = np.lib.format.open_memmap(
+                path, mode = 'w+', dtype = np.uint8, shape = (height, width) + channels)
+
+            weights = [
+                (_feather(tile.shape[0], self._stitch_feather),
+                 _feather(tile.shape[1], self._stitch_feather))
+                for tile in mapped
+            ]
+
+            for start in range(0, height, strip_rows):
+                end = min(start + strip_rows, height)
+                total = np.zeros((end - start, width) + channels, dtype = np.float32)
+                weight_sum = np.zeros((end - start, width), dtype = np.float32)
+
+                for tile, (top, left), (weight_y, weight_x) in zip(mapped, positions, weights):
+                    first, last = max(start, top), min(end, top + tile.shape[0])
+                    if first >= last:
+                        continue
+
+                    rows = slice(first - top, last - top)
+                    cols = slice(left, left + tile.shape[1])
+                    weight = np.minimum(weight_y[rows, None], weight_x[None, :])
+
+                    weight_sum[first - start:last - start, cols] += weight
+                    if channels:
+                        weight = weight[..., None]
+                    total[first - start:last - start, cols] += tile[rows] * weight
+
+                if channels:
+                    weight_sum = weight_sum[..., None]
+
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    strip = np.where(weight_sum > 0, total / weight_sum + 0.5, 255)
+                canvas[start:end] = strip.astype(np.uint8)
+
+            canvas.flush()
+            del canvas, mapped
+
+        return np.load(path, mmap_mode = 'r'), positions
+
+    def scan(
+        self, data: bytes, mode: str = 'gray', deskew: bool = True,
+        dropout: tuple = None) -> tuple[np.ndarray, np.ndarray]:
+        """Scan a photo of a document page.
+
+        Parameters:
+        -----------
+        data:
+        The content of the image file.
+
+        mode:
+        The scan mode, 'gray', 'color', 'binary', 'sauvola'
+        or 'bradley' (see `clean_page`).
+
+        deskew:
+        If `True`, the skew of the text lines is corrected (default: True).
+
+        dropout:
+        The hue ranges of the colors dropped from the page
+        (see `whiten_page`, default: None, no color is dropped).
+
+        Returns:
+        --------
+        A tuple of the cleaned page and the page corners found in the photo.
+        If no page is found, the whole photo is taken as the page.
+
+        Raises:
+        -------
+        InvalidImageError:
+        If the data is not a valid image file.
+
+        InvalidScanModeError:
+        If the mode is not supported.
+
+        InvalidDropoutError:
+        If the dropout ranges are not valid.
+        """
+
+        if mode not in SCAN_MODES:
+            raise InvalidScanModeError(f'Unsupported scan mode: "{mode}"')
+
+        if dropout:
+            dropout = parse_dropout(dropout)
+
+        # the colors are kept only as long as they are needed
+        color = mode == 'color' or bool(dropout)
+        img = self.decode_image(data, color = color)
+        gray = np.asarray(Image.fromarray(img).convert('L')) if color else img
+
+        corners = self._find_page(gray)
+        angle = 0.0
+
+        # the skew is estimated on the page seen through the perspective
+        # transformation, so the full resolution page is resampled once
+        if deskew:
+            angle = self._find_skew(gray, *self._page_transform(corners))
+
+            if abs(angle) < self._skew_resolution:
+                angle = 0.0
+
+        page = self.warp_page(img, corners, angle)
+
+        if color:
+            page = self.whiten_page(page, dropout)
+
+            if mode == 'color':
+                return page, corners
+
+            page = np.asarray(Image.fromarray(page).convert('L'))
+
+        return self.clean_page(page, mode), corners
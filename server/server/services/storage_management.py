@@ -0,0 +1,227 @@
+"""Storage management service.
+
+Folders queued for removal are first moved into a reclaim folder by a
+single rename, which takes constant time regardless of the folder size.
+The contents of the reclaim folder are then removed incrementally by a
+background thread with a limited rate of file system operations.
+
+The reclaim folder itself is the persistent queue: folders left in it
+when the server stops are removed after the next start, and a folder
+whose removal fails is retried after a while.
+"""
+
+import os
+import threading
+import time
+from logging import getLogger
+
+DirPath = str
+
+log = getLogger("master")
+
+class ReclaimError(Exception):
+    """Raised when a folder cannot be queued for removal."""
+
+class FolderReclaimer:
+    """Removes queued folders in a background thread."""
+
+    def __init__(
+        self, reclaim_dir: DirPath,
+        max_files_per_sec: int = 500,
+        max_bytes_per_sec: int = 50 * 1024 * 1024,
+        retry_interval: float = 60.0) -> None:
+        """Initialize the reclaimer.
+
+        Parameters:
+        -----------
+        reclaim_dir:
+        The folder where the folders queued for removal are moved.
+        Must reside on the same file system as the queued folders.
+
+        max_files_per_sec:
+        The maximum number of files and folders removed per second.
+
+        max_bytes_per_sec:
+        The maximum number of bytes of file data released per second.
+
+        retry_interval:
+        The time in seconds after which the removal of
+        a folder is retried if it failed.
+        """
+
+        if max_files_per_sec <= 0:
+            raise ValueError("The file removal rate must be a positive integer!")
+
+        if max_bytes_per_sec <= 0:
+            raise ValueError("The byte removal rate must be a positive integer!")
+
+        if retry_interval <= 0:
+            raise ValueError("The retry interval must be greater than 0!")
+
+        os.makedirs(reclaim_dir, exist_ok = True)
+
+        self._reclaim_dir = reclaim_dir
+        self._max_files_per_sec = max_files_per_sec
+        self._max_bytes_per_sec = max_bytes_per_sec
+        self._retry_interval = retry_interval
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # folders left over from the previous run are pending
+        self._backlog = len(os.listdir(reclaim_dir))
+        self._removed_files = 0
+        self._removed_bytes = 0
+
+    @property
+    def backlog(self) -> int:
+        """Return the number of folders waiting to be removed."""
+        return self._backlog
+
+    @property
+    def removed_files(self) -> int:
+        """Return the number of files and folders removed since the start."""
+        return self._removed_files
+
+    @property
+    def removed_bytes(self) -> int:
+        """Return the number of bytes released since the start."""
+        return self._removed_bytes
+
+    def queue(self, path: DirPath) -> None:
+        """Queue a folder for removal.
+
+        Parameters:
+        -----------
+        path:
+        The folder to be removed.
+
+        Raises:
+        -------
+        ReclaimError:
+        If the folder cannot be moved into the reclaim folder.
+        """
+
+        # a unique name prevents collisions if a folder
+        # of the same name is queued more than once
+        name = f"{os.path.basename(path)}_{time.time_ns()}"
+
+        try:
+            os.rename(path, os.path.join(self._reclaim_dir, name))
+        except OSError as err:
+            raise ReclaimError(
+                f"The folder cannot be queued for removal: {err}"
+            ) from err
+
+        with self._lock:
+            self._backlog += 1
+
+        self._wakeup.set()
+
+    def start(self) -> None:
+        """Start the background thread."""
+
+        if self._thread is not None:
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target = self._run, name = "folder-reclaimer", daemon = True)
+        self._thread.start()
+
+        # process the folders left over from the previous run
+        self._wakeup.set()
+
+    def stop(self, timeout: float = None) -> None:
+        """Stop the background thread.
+
+        The folder being removed is left partially removed
+        and its removal resumes after the next start.
+        """
+
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        """Remove the queued folders until stopped."""
+
+        failed = False
+
+        while not self._stopping.is_set():
+            # the failed removals are retried even if nothing is queued
+            self._wakeup.wait(self._retry_interval if failed else None)
+            self._wakeup.clear()
+            failed = False
+
+            for name in sorted(os.listdir(self._reclaim_dir)):
+                if self._stopping.is_set():
+                    return
+
+                try:
+                    self._remove_tree(os.path.join(self._reclaim_dir, name))
+                except OSError as err:
+                    log.error("Failed to reclaim folder '%s': %s", name, err)
+                    failed = True
+                    continue
+
+                # the removal was interrupted by stopping the thread
+                if self._stopping.is_set():
+                    return
+
+                with self._lock:
+                    self._backlog = max(0, self._backlog - 1)
+
+    def _throttle(self, files: int, size: int, started: float) -> None:
+        """Sleep until the removal rate is within the limits."""
+
+        elapsed = time.monotonic() - started
+        required = max(
+            files / self._max_files_per_sec,
+            size / self._max_bytes_per_sec
+        )
+
+        if required > elapsed:
+            self._stopping.wait(required - elapsed)
+
+    def _remove_tree(self, root: DirPath) -> None:
+        """Remove a folder tree file by file with a limited rate."""
+
+        started = time.monotonic()
+        files = 0
+        size = 0
+
+        for dir_path, dir_names, file_names in os.walk(root, topdown = False):
+            for name in file_names:
+                if self._stopping.is_set():
+                    return
+
+                file_path = os.path.join(dir_path, name)
+                file_size = os.lstat(file_path).st_size
+                os.remove(file_path)
+
+                files += 1
+                size += file_size
+                self._removed_files += 1
+                self._removed_bytes += file_size
+                self._throttle(files, size, started)
+
+            for name in dir_names:
+                # symbolic links to folders are listed as folders
+                sub_path = os.path.join(dir_path, name)
+                if os.path.islink(sub_path):
+                    os.remove(sub_path)
+                else:
+                    os.rmdir(sub_path)
+
+                files += 1
+                self._removed_files += 1
+
+        os.rmdir(root)
+        self._removed_files += 1
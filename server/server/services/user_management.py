@@ -2,18 +2,33 @@
 used to manage the users of the system.
 """
 
+import hashlib
 import logging
+import math
 import os
 import datetime as dt
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Callable
 from types import SimpleNamespace
-from server.security import ExpiredTokenError, InvalidTokenError
+import sqlalchemy as sqal
+from server.database import DuplicateRecordError
+from server.security import (
+    ExpiredTokenError, InvalidTokenError,
+    HashingPoolSaturatedError
+)
 
 log = logging.getLogger("master")
 
 Path = str
 
+# the columns added to the users table after its first release
+ADDED_COLUMNS = (
+    sqal.Column("user_deleted_at", sqal.DateTime),
+)
+
 class InvalidUsernameError(Exception):
     """Raised when the username is invalid."""
 
@@ -44,6 +59,102 @@ class FolderRemovalError(Exception):
 class MaxLoginAttemptsExceededError(Exception):
     """Raised when the maximum login attempts are exceeded."""
 
+class ServiceBusyError(Exception):
+    """Raised when the service is too busy to process the request."""
+
+class CountingBloomFilter:
+    """A probabilistic set of strings that answers whether a value
+    is definitely absent or possibly present in the set.
+
+    Each slot holds an 8-bit counter instead of a single bit,
+    so that values can also be removed from the filter.
+    """
+
+    def __init__(
+        self, capacity: int, error_rate: float = 0.01,
+        max_bytes: int = None) -> None:
+        """Initialize the filter.
+
+        Parameters:
+        -----------
+        capacity:
+        The expected number of values stored in the filter.
+
+        error_rate:
+        The accepted probability of a false positive
+        answer when the filter holds `capacity` values.
+
+        max_bytes:
+        The upper limit of memory used by the filter counters
+        (default: None). If the limit is lower than the size
+        required by the error rate, the error rate will be higher.
+        """
+
+        if capacity <= 0:
+            raise ValueError("The filter capacity must be a positive integer!")
+
+        if not 0 < error_rate < 1:
+            raise ValueError("The error rate must be between 0 and 1!")
+
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+
+        if max_bytes is not None:
+            size = min(size, max_bytes)
+
+        self._size = max(size, 1)
+        self._hash_count = max(1, round(self._size / capacity * math.log(2)))
+        self._counters = bytearray(self._size)
+        self._lock = threading.Lock()
+
+    def _slots(self, value: str) -> list[int]:
+        """Return the counter slots of a value using double hashing."""
+
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size = 16).digest()
+        hash_a = int.from_bytes(digest[:8], "little")
+        hash_b = int.from_bytes(digest[8:], "little") | 1
+
+        return [(hash_a + i * hash_b) % self._size for i in range(self._hash_count)]
+
+    def add(self, value: str) -> None:
+        """Add a value to the filter."""
+
+        with self._lock:
+            for slot in self._slots(value):
+                # saturated counters are never changed, since
+                # the number of values they hold is not known
+                if self._counters[slot] < 255:
+                    self._counters[slot] += 1
+
+    def remove(self, value: str) -> None:
+        """Remove a value previously added to the filter."""
+
+        with self._lock:
+            slots = self._slots(value)
+
+            # a value that is not in the filter must not
+            # decrement the counters of the other values
+            if not all(self._counters[slot] for slot in slots):
+                return
+
+            for slot in slots:
+                if self._counters[slot] < 255:
+                    self._counters[slot] -= 1
+
+    def __contains__(self, value: str) -> bool:
+        """Return `False` if the value is definitely absent, otherwise `True`."""
+        return all(self._counters[slot] for slot in self._slots(value))
+
+    @property
+    def size(self) -> int:
+        """Return the memory in bytes used by the filter counters."""
+        return self._size
+
+    @property
+    def hash_count(self) -> int:
+        """Return the number of counter slots per value."""
+        return self._hash_count
+
+
 class UserManager:
     """Registers a new user in the system."""
 
@@ -51,7 +162,12 @@ class UserManager:
         self, db: object, table: str,
         schema: str, uid_column: str,
         auth: object, max_login_tries: int,
-        login_wnd: int, login_lock_wnd: int
+        login_wnd: int, login_lock_wnd: int,
+        hasher: object = None,
+        filter_capacity: int = 0,
+        filter_error_rate: float = 0.01,
+        filter_max_bytes: int = None,
+        reclaimer: object = None
         ) -> None:
         """Initialize the user manager.
 
@@ -85,6 +201,28 @@ class UserManager:
         The time period (in minutes) for which the user account
         will be locked after the maximum failed login attempts
         are exceeded.
+
+        hasher:
+        The password hasher used to run the password hash functions
+        on a pool of worker processes (default: None). If not provided,
+        the hash functions are called on the calling thread.
+
+        filter_capacity:
+        The expected number of user accounts held by the in-memory filter
+        of existing user names and emails (default: 0). The filter lets the
+        registration skip the database lookups for names and emails that
+        are definitely not taken. Set to 0 to disable the filter.
+
+        filter_error_rate:
+        The accepted false positive rate of the account filter.
+
+        filter_max_bytes:
+        The maximum memory in bytes used by the account filter (default: None).
+
+        reclaimer:
+        The folder reclaimer that removes the data folders of deleted users
+        in the background (default: None). If not provided, the folders are
+        removed on the calling thread and must be empty.
         """
 
         # validate the input parameters
@@ -112,6 +250,9 @@ class UserManager:
         if login_lock_wnd < 0:
             raise ValueError("The login lock window must be a positive integer!")
 
+        if filter_capacity < 0:
+            raise ValueError("The filter capacity must be a positive integer!")
+
         # set the user manager variables
         self._db = db
         self.users_table = self._db.get_table(table, schema)
@@ -120,6 +261,18 @@ class UserManager:
         self._max_login_tries = max_login_tries
         self._login_wnd = login_wnd
         self._login_lock_wnd = login_lock_wnd
+        self._hasher = hasher
+        self._reclaimer = reclaimer
+
+        # build the filter of existing user names and emails
+        self._account_filter = None
+        self._filter_capacity = filter_capacity
+        self._filter_skips = 0
+
+        if filter_capacity != 0:
+            self._account_filter = CountingBloomFilter(
+                filter_capacity, filter_error_rate, filter_max_bytes)
+            self._load_account_filter()
 
         # set the user manager state variables
         self._failed_login_attempts = 0
@@ -169,12 +322,73 @@ class UserManager:
         record = self._db.get_record(
             self.users_table, key_column = "user_id", key = user_id)
 
-        if len(record) == 0:
+        # the record of a deleted user is only marked as deleted,
+        # the column is missing until the table is upgraded
+        if len(record) == 0 or record.get("user_deleted_at") is not None:
             raise UserNotFoundError(f"No such user exists with ID: {user_id}")
 
+    def _load_account_filter(self) -> None:
+        """Fill the account filter with the names
+        and emails of the existing user accounts."""
+
+        count = 0
+
+        for name, email in self._db.iter_records(
+            self.users_table, ["user_name", "user_email"]):
+            self._add_to_account_filter(name, email)
+            count += 1
+
+        log.debug("Account filter loaded with %d user accounts.", count)
+
+        if count > self._filter_capacity:
+            log.warning(
+                "The number of user accounts exceeds the capacity "
+                "of the account filter. The rate of false positive "
+                "lookups will be higher than configured."
+            )
+
+    def _add_to_account_filter(self, name: str, email: str) -> None:
+        """Add the user name and email to the account filter."""
+
+        if self._account_filter is None:
+            return
+
+        self._account_filter.add(f"name:{name}")
+        self._account_filter.add(f"email:{email}")
+
+    def _remove_from_account_filter(self, name: str, email: str) -> None:
+        """Remove the user name and email from the account filter."""
+
+        if self._account_filter is None:
+            return
+
+        self._account_filter.remove(f"name:{name}")
+        self._account_filter.remove(f"email:{email}")
+
+    def _account_possibly_exists(self, name: str, email: str) -> bool:
+        """Check the account filter for the user name and email.
+
+        Returns `False` only if neither the name nor the email
+        is registered, otherwise the database must be queried.
+        """
+
+        if self._account_filter is None:
+            return True
+
+        return (
+            f"name:{name}" in self._account_filter or
+            f"email:{email}" in self._account_filter
+        )
+
     def _check_user_account(self, name: str, email: str) -> None:
         """Check if a user account already exists in the database."""
 
+        # neither the name nor the email is registered, the insert
+        # will be guarded by the unique constraints of the table
+        if not self._account_possibly_exists(name, email):
+            self._filter_skips += 1
+            return
+
         try:
             record = self._db.get_record(
                 self.users_table, key_column = "user_name", key = name
@@ -257,6 +471,30 @@ class UserManager:
         self._last_login_attempt = dt.datetime.now()
         log.debug("Last login attempt has been recorded: %s", self._last_login_attempt)
 
+    def _run_hash_func(self, func: Callable, *args) -> any:
+        """Run a password hash function on the hashing
+        pool if available, otherwise on the calling thread."""
+
+        if self._hasher is None:
+            return func(*args)
+
+        try:
+            return self._hasher.run(func, *args)
+        except HashingPoolSaturatedError as err:
+            raise ServiceBusyError(
+                f"The password hashing service is busy: {err}"
+            ) from err
+        except TimeoutError as err:
+            raise ServiceBusyError(
+                "The password hashing service is busy: "
+                "the password hash is not ready in time!"
+            ) from err
+        except BrokenProcessPool as err:
+            raise ServiceBusyError(
+                "The password hashing service is busy: "
+                "a worker process died and the pool is restarting!"
+            ) from err
+
     def _create_user_data_folder(self, root: Path, user_id: int) -> Path:
         """Create a folder to store user files."""
 
@@ -276,6 +514,135 @@ class UserManager:
 
         return user_data_dir
 
+    def _remove_user_data_folder(self, root: Path, user_id: int) -> None:
+        """Remove the folder where the user files are stored."""
+
+        user_folder = os.path.join(root, str(user_id))
+        assert os.path.exists(user_folder), (
+            f"User data directory not found: '{user_folder}'"
+        )
+
+        try:
+            if self._reclaimer is None:
+                os.rmdir(user_folder)
+            else:
+                self._reclaimer.queue(user_folder)
+        except Exception as err:
+            raise FolderRemovalError(
+                f"An error occurred while deleting the user data folder: {err}"
+            ) from err
+
+    def _map_hash_func(self, func: Callable, *iterables) -> list:
+        """Run a password hash function over a batch of arguments on
+        the hashing pool if available, otherwise on the calling thread."""
+
+        if self._hasher is None:
+            return list(map(func, *iterables))
+
+        return self._hasher.map(func, *iterables)
+
+    def _get_records_in_batches(
+        self, key_column: str, keys: list,
+        batch_size: int) -> list[dict]:
+        """Retrieve the user records matching the keys in batches."""
+
+        records = []
+
+        for idx in range(0, len(keys), batch_size):
+            try:
+                records.extend(self._db.get_records(
+                    self.users_table, key_column, keys[idx:idx + batch_size]
+                ))
+            except Exception as err:
+                raise DatabaseError(
+                    f"An error occurred while retrieving the users: {err}"
+                ) from err
+
+        return records
+
+    def _mark_users_deleted(self, user_ids: list[int]) -> None:
+        """Mark the user records as deleted, so that the users can
+        no longer log in, and revoke their authentication tokens."""
+
+        self._db.update_records(
+            self.users_table, self._user_id_col, user_ids,
+            user_active = False,
+            user_token = None,
+            user_deleted_at = dt.datetime.now()
+        )
+
+    def _rollback_registration(self, user_ids: list[int], cause: Exception) -> None:
+        """Delete the records of the users whose registration failed
+        because of the given error.
+
+        Raises:
+        -------
+        DatabaseError
+            If the records cannot be deleted, raised from the cause.
+        """
+
+        if len(user_ids) == 0:
+            return
+
+        try:
+            self._db.delete_records(self.users_table, self._user_id_col, user_ids)
+        except Exception as err:
+            raise DatabaseError(
+                f"The registration was not rolled back: {err}"
+            ) from cause
+
+    def _run_folder_tasks(
+        self, func: Callable, root: Path,
+        user_ids: list[int], max_workers: int) -> dict:
+        """Run a folder operation for each user concurrently and
+        return the errors that occurred mapped to the user IDs."""
+
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = {
+                user_id: executor.submit(func, root, user_id)
+                for user_id in user_ids
+            }
+
+        for user_id, future in futures.items():
+            if future.exception() is not None:
+                errors[user_id] = future.exception()
+
+        return errors
+
+    def upgrade_users_table(self) -> list[str]:
+        """Add the columns missing in a users table created by an earlier
+        version of the server. The table is usable before the upgrade,
+        but deleting users requires the added columns.
+
+        Returns:
+        --------
+        The names of the added columns.
+
+        Raises:
+        -------
+        DatabaseError:
+            If a column cannot be added.
+        """
+
+        added = []
+
+        for column in ADDED_COLUMNS:
+            try:
+                if self._db.add_column(self.users_table, column):
+                    added.append(column.name)
+            except Exception as err:
+                raise DatabaseError(
+                    f"An error occurred while adding the column {column.name}: {err}"
+                ) from err
+
+        if added:
+            self.users_table = self._db.get_table(
+                self.users_table.name, self.users_table.schema)
+
+        return added
+
     def register_user(
         self, name: str, email: str, password: str,
         create_password_hash: Callable[[str], str],
@@ -326,6 +693,9 @@ class UserManager:
 
         FolderCreationError
             If an error occurs while creating the user data folder.
+
+        ServiceBusyError
+            If the password hashing service cannot accept more work.
         """
 
         # validate input parameters
@@ -344,7 +714,7 @@ class UserManager:
         self._check_user_account(name, email)
 
         # create a new database record for the user
-        hashed_password = create_password_hash(password)
+        hashed_password = self._run_hash_func(create_password_hash, password)
 
         try:
             user_id = self._db.create_record(
@@ -354,11 +724,18 @@ class UserManager:
                 user_password = hashed_password,
                 user_registration_date = dt.datetime.now()
             )
+        except DuplicateRecordError as err:
+            raise UserAlreadyExistsError(
+                "An account already exists for the user "
+                f"name: {name} or email address: {email}"
+            ) from err
         except Exception as err:
             raise DatabaseError(
                 f"An error occurred while attempting to register user: {err}"
             ) from err
 
+        self._add_to_account_filter(name, email)
+
         # generate an authentication token for the user
         auth_token = self._auth.generate_authentication_token(user_id, 24)
 
@@ -373,7 +750,12 @@ class UserManager:
         except Exception as err:
             # rollback the user registration if
             # the attempt to store the token fails
-            self.delete_user(user_id)
+            try:
+                self._rollback_registration([user_id], err)
+            except DatabaseError as rollback_err:
+                log.error("User %d: %s", user_id, rollback_err, exc_info = True)
+            else:
+                self._remove_from_account_filter(name, email)
             raise DatabaseError(
                 "An error occurred while attempting to store "
                 f"the user authentication token to database: {err}"
@@ -385,7 +767,12 @@ class UserManager:
         except Exception as err:
             # rollback the user registration if
             # the attempt to create the folder fails
-            self.delete_user(user_id)
+            try:
+                self._rollback_registration([user_id], err)
+            except DatabaseError as rollback_err:
+                log.error("User %d: %s", user_id, rollback_err, exc_info = True)
+            else:
+                self._remove_from_account_filter(name, email)
             raise FolderCreationError(
                 f"An error occurred while creating the user data folder: {err}"
             ) from err
@@ -482,6 +869,9 @@ class UserManager:
         MaxLoginAttemptsExceededError
         If the maximum login attempts are exceeded within the
         specified time frame.
+
+        ServiceBusyError
+        If the password hashing service cannot accept more work.
         """
 
         assert check_password_hash is not None, (
@@ -499,7 +889,7 @@ class UserManager:
         # validate login attemps to prevent brute force attacks
         self._validate_login_attempts(self._login_wnd)
 
-        if len(record) == 0:
+        if len(record) == 0 or record.get("user_deleted_at") is not None:
             raise InvalidUsernameError(
                 f"No such user exists: {name}!")
 
@@ -507,7 +897,8 @@ class UserManager:
             raise InactiveUserError(
                 f"User: {name} is inactive and cannot log in!")
 
-        if not check_password_hash(record["user_password"], password):
+        if not self._run_hash_func(
+            check_password_hash, record["user_password"], password):
             raise InvalidPasswordError(
                f'Invalid password: "{password}" for user: "{name}"')
 
@@ -614,8 +1005,11 @@ class UserManager:
     def delete_user(self, user_id: int, data_storage: Path) -> None:
         """Delete the user from the system.
 
-        Deleted will be the user record from
-        the database and the user's data folder.
+        The user record is marked as deleted and
+        the user's data folder is removed. The name
+        and the email of the user remain taken.
+        If a folder reclaimer is used, the folder
+        is only queued for removal in the background.
 
         Parameters:
         -----------
@@ -654,32 +1048,398 @@ class UserManager:
             raise InactiveUserError(
                 f"User: {user_id} is inactive and cannot be deleted!")
 
-        # delete the user from the database
+        # mark the user as deleted in the database
         try:
-            self._db.delete_record(
-                self.users_table,
-                self._user_id_col,
-                user_id
-            )
+            self._mark_users_deleted([user_id])
         except Exception as err:
             raise DatabaseError(
                 f"An error occurred while deleting the user: {err}"
             ) from err
 
         # delete the user data folder
-        user_folder = os.path.join(data_storage, str(user_id))
-        assert os.path.exists(user_folder), (
-            f"User data directory not found: '{user_folder}'"
+        self._remove_user_data_folder(data_storage, user_id)
+
+    def register_users(
+        self, users: list[dict],
+        create_password_hash: Callable[[str], str],
+        data_storage: Path, batch_size: int = 1000,
+        max_workers: int = 8) -> list[dict]:
+        """Register multiple users at once.
+
+        The users are validated in bulk, their passwords hashed in parallel
+        and the records inserted in batches, each in a single transaction.
+        A user that cannot be registered does not stop the registration
+        of the others.
+
+        Parameters:
+        -----------
+        users:
+            Dictionaries with the 'name', 'email'
+            and 'password' of the users to register.
+
+        create_password_hash:
+            A callable function that takes a plain password string and returns
+            its hashed version.
+
+        data_storage:
+            The root folder where the user data folders are created.
+
+        batch_size:
+            The number of records inserted in a single transaction.
+
+        max_workers:
+            The number of threads creating the user data folders.
+
+        Returns:
+        --------
+        A result for each of the users in the input order. The result
+        is a dictionary with the keys 'user_name', 'user_id', 'status'
+        ('ok' or 'failed') and 'error' (the reason of the failure).
+
+        Raises:
+        -------
+        DatabaseError
+            If an error occurs while looking up the existing users.
+        """
+
+        assert create_password_hash is not None, (
+            "Hash function to create encrypted password must be provided!")
+
+        assert os.path.exists(data_storage), (
+            f"The user data directory not found: '{data_storage}'"
         )
 
-        # delete the user data directory with no error
-        # handling - the caller will handle any exceptions
-        try:
-            os.rmdir(user_folder)
-        except Exception as err:
-            raise FolderRemovalError(
-                f"An error occurred while deleting the user data folder: {err}"
-            ) from err
+        results = [{
+            "user_name": user.get("name", ""),
+            "user_id": None,
+            "status": "failed",
+            "error": None
+        } for user in users]
+
+        # validate the input parameters of all users
+        valid = []
+        names, emails = set(), set()
+
+        for idx, user in enumerate(users):
+            name = user.get("name", "")
+            email = user.get("email", "")
+
+            try:
+                self._validate_user_name(name)
+                self._validate_user_password(user.get("password", ""))
+                self._validate_user_email(email)
+            except (
+                InvalidUsernameError,
+                InvalidPasswordError,
+                InvalidEmailError) as err:
+                results[idx]["error"] = str(err)
+                continue
+
+            if name in names or email in emails:
+                results[idx]["error"] = (
+                    "The user name or email is used more than once in the batch!")
+                continue
+
+            names.add(name)
+            emails.add(email)
+            valid.append(idx)
+
+        # check which of the users already exist in the database
+        taken_names = {rec["user_name"] for rec in self._get_records_in_batches(
+            "user_name", list(names), batch_size)}
+        taken_emails = {rec["user_email"] for rec in self._get_records_in_batches(
+            "user_email", list(emails), batch_size)}
+
+        candidates = []
+
+        for idx in valid:
+            if users[idx]["name"] in taken_names or users[idx]["email"] in taken_emails:
+                results[idx]["error"] = "An account already exists for the user!"
+            else:
+                candidates.append(idx)
+
+        registered = []
+        registration_date = dt.datetime.now()
+
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+
+            # hash the passwords of the batch in parallel, a failed
+            # hashing, such as a dead worker process, fails the batch only
+            try:
+                hashes = self._map_hash_func(
+                    create_password_hash, [users[idx]["password"] for idx in batch])
+            except Exception as err:
+                for idx in batch:
+                    results[idx]["error"] = (
+                        f"An error occurred while hashing the password: {err}")
+                continue
+
+            records = [{
+                "user_name": users[idx]["name"],
+                "user_email": users[idx]["email"],
+                "user_password": hashes[pos],
+                "user_registration_date": registration_date
+            } for pos, idx in enumerate(batch)]
+
+            try:
+                user_ids = self._db.create_records(self.users_table, records)
+            except DuplicateRecordError:
+                # some of the accounts were registered in the
+                # meantime, so the batch is inserted one by one
+                user_ids = []
+                for idx, record in zip(batch, records):
+                    try:
+                        user_ids.append(self._db.create_record(self.users_table, **record))
+                    except DuplicateRecordError:
+                        user_ids.append(None)
+                        results[idx]["error"] = "An account already exists for the user!"
+                    except Exception as err:
+                        user_ids.append(None)
+                        results[idx]["error"] = f"Database error: {err}"
+            except Exception as err:
+                for idx in batch:
+                    results[idx]["error"] = f"Database error: {err}"
+                continue
+
+            # generate and store the authentication tokens of the new users
+            tokens = {
+                user_id: self._auth.generate_authentication_token(user_id, 24)
+                for user_id in user_ids if user_id is not None
+            }
+
+            try:
+                self._db.insert_values(
+                    self.users_table, self._user_id_col, "user_token", tokens)
+            except Exception as err:
+                # rollback the registration of the whole batch
+                error = f"Database error: {err}"
+                rolled_back = True
+
+                try:
+                    self._rollback_registration(list(tokens), err)
+                except DatabaseError as rollback_err:
+                    log.error("Users %s: %s", list(tokens), rollback_err, exc_info = True)
+                    error += f" ({rollback_err})"
+                    rolled_back = False
+
+                for idx, user_id in zip(batch, user_ids):
+                    if user_id is not None:
+                        results[idx]["error"] = error
+
+                        # the account left behind keeps its id
+                        if not rolled_back:
+                            results[idx]["user_id"] = user_id
+                continue
+
+            for idx, user_id in zip(batch, user_ids):
+                if user_id is not None:
+                    results[idx]["user_id"] = user_id
+                    registered.append(idx)
+
+        # create the data folders of the registered users concurrently
+        errors = self._run_folder_tasks(
+            self._create_user_data_folder, data_storage,
+            [results[idx]["user_id"] for idx in registered], max_workers
+        )
+
+        rollback_err = None
+
+        if len(errors) != 0:
+            # rollback the registration of the users without a folder
+            try:
+                self._rollback_registration(list(errors), next(iter(errors.values())))
+            except DatabaseError as err:
+                log.error("Users %s: %s", list(errors), err, exc_info = True)
+                rollback_err = err
+
+        for idx in registered:
+            user_id = results[idx]["user_id"]
+
+            if user_id in errors:
+                results[idx]["error"] = (
+                    f"An error occurred while creating the user data folder: {errors[user_id]}")
+
+                # the account left behind keeps its id
+                if rollback_err is None:
+                    results[idx]["user_id"] = None
+                else:
+                    results[idx]["error"] += f" ({rollback_err})"
+                continue
+
+            results[idx]["status"] = "ok"
+            self._add_to_account_filter(users[idx]["name"], users[idx]["email"])
+
+        return results
+
+    def deactivate_users(self, user_ids: list[int], batch_size: int = 1000) -> list[dict]:
+        """Deactivate multiple users at once.
+
+        Parameters:
+        -----------
+        user_ids:
+            The IDs of the users to be deactivated.
+
+        batch_size:
+            The number of records updated in a single transaction.
+
+        Returns:
+        --------
+        A result for each of the users in the input order. The result
+        is a dictionary with the keys 'user_name', 'user_id', 'status'
+        ('ok' or 'failed') and 'error' (the reason of the failure).
+
+        Raises:
+        -------
+        DatabaseError
+            If an error occurs while looking up the users.
+        """
+
+        records = {
+            rec[self._user_id_col]: rec for rec in self._get_records_in_batches(
+                self._user_id_col, list(set(user_ids)), batch_size)
+        }
+
+        results = []
+        active = []
+        listed = set()
+
+        for user_id in user_ids:
+            record = records.get(user_id)
+            result = {
+                "user_name": "" if record is None else record["user_name"],
+                "user_id": user_id,
+                "status": "failed",
+                "error": None
+            }
+            results.append(result)
+
+            if record is None or record.get("user_deleted_at") is not None:
+                result["error"] = f"No such user exists with ID: {user_id}"
+            elif user_id in listed:
+                result["error"] = "The user is listed more than once in the batch!"
+            elif not record["user_active"]:
+                result["error"] = f"User: {user_id} is already inactive!"
+            else:
+                active.append(user_id)
+
+            listed.add(user_id)
+
+        failed = {}
+
+        for start in range(0, len(active), batch_size):
+            batch = active[start:start + batch_size]
+
+            try:
+                self._db.update_records(
+                    self.users_table, self._user_id_col,
+                    batch, user_active = False
+                )
+            except Exception as err:
+                failed.update({user_id: err for user_id in batch})
+
+        for result in results:
+            if result["error"] is not None:
+                continue
+
+            if result["user_id"] in failed:
+                result["error"] = f"Database error: {failed[result['user_id']]}"
+            else:
+                result["status"] = "ok"
+
+        return results
+
+    def delete_users(
+        self, user_ids: list[int], data_storage: Path,
+        batch_size: int = 1000, max_workers: int = 8) -> list[dict]:
+        """Delete multiple users at once.
+
+        Parameters:
+        -----------
+        user_ids:
+            The IDs of the users to be deleted.
+
+        data_storage:
+            The root folder where the user data folders are stored.
+
+        batch_size:
+            The number of records deleted in a single transaction.
+
+        max_workers:
+            The number of threads removing the user data folders.
+
+        Returns:
+        --------
+        A result for each of the users in the input order. The result
+        is a dictionary with the keys 'user_name', 'user_id', 'status'
+        ('ok' or 'failed') and 'error' (the reason of the failure).
+
+        Raises:
+        -------
+        DatabaseError
+            If an error occurs while looking up the users.
+        """
+
+        records = {
+            rec[self._user_id_col]: rec for rec in self._get_records_in_batches(
+                self._user_id_col, list(set(user_ids)), batch_size)
+        }
+
+        results = []
+        deletable = []
+        listed = set()
+
+        for user_id in user_ids:
+            record = records.get(user_id)
+            result = {
+                "user_name": "" if record is None else record["user_name"],
+                "user_id": user_id,
+                "status": "failed",
+                "error": None
+            }
+            results.append(result)
+
+            if record is None or record.get("user_deleted_at") is not None:
+                result["error"] = f"No such user exists with ID: {user_id}"
+            elif user_id in listed:
+                result["error"] = "The user is listed more than once in the batch!"
+            elif not record["user_active"]:
+                result["error"] = f"User: {user_id} is inactive and cannot be deleted!"
+            else:
+                deletable.append(user_id)
+
+            listed.add(user_id)
+
+        failed = {}
+        deleted = []
+
+        for start in range(0, len(deletable), batch_size):
+            batch = deletable[start:start + batch_size]
+
+            try:
+                self._mark_users_deleted(batch)
+            except Exception as err:
+                failed.update({user_id: f"Database error: {err}" for user_id in batch})
+                continue
+
+            deleted.extend(batch)
+
+        # remove the data folders of the deleted users concurrently
+        errors = self._run_folder_tasks(
+            self._remove_user_data_folder, data_storage, deleted, max_workers)
+
+        failed.update({user_id: str(err) for user_id, err in errors.items()})
+
+        for result in results:
+            if result["error"] is not None:
+                continue
+
+            if result["user_id"] in failed:
+                result["error"] = failed[result["user_id"]]
+            else:
+                result["status"] = "ok"
+
+        return results
 
     def deactivate_user(self, user_id: int) -> None:
         """Deactivate the user in the database.
@@ -763,6 +1523,9 @@ class UserManager:
         DatabaseError
             If an error occurs while updating the user's password in
             the database.
+
+        ServiceBusyError
+            If the password hashing service cannot accept more work.
         """
 
         assert create_password_hash is not None, (
@@ -774,6 +1537,10 @@ class UserManager:
         # check if the user exists before attempting to delete
         self._validate_user_record(user_id)
 
+        # hash the new password outside of the database error handling,
+        # so that a busy hashing service is not reported as a DB error
+        hashed_password = self._run_hash_func(create_password_hash, new_value)
+
         # update the user's password in the database
         try:
             self._db.insert_value(
@@ -781,7 +1548,7 @@ class UserManager:
                 key_column = self._user_id_col,
                 key = user_id,
                 value_column = "user_password",
-                value = create_password_hash(new_value)
+                value = hashed_password
             )
         except Exception as err:
             raise DatabaseError(
@@ -812,6 +1579,12 @@ class UserManager:
         attempts are exceeded."""
         return self._login_lock_wnd
 
+    @property
+    def filter_skips(self) -> int:
+        """Return the number of account checks answered
+        by the account filter without querying the database."""
+        return self._filter_skips
+
     def calculate_next_login_timeout(self, user_name: str) -> SimpleNamespace:
         """Return the time until the
         next login attempt is allowed."""
@@ -0,0 +1,322 @@
+"""Module to unit test the document management service."""
+
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, TextTestRunner, TestSuite, mock
+import datetime as dt
+import logging
+
+import numpy as np
+from PIL import Image, PdfParser
+
+from server.services.document_management import (
+    DocumentManager, DocumentNotFoundError, DocumentStateError,
+    InvalidDocumentFormatError, InvalidPageFilterError
+)
+from server.services.scanner_management import InvalidScanModeError, InvalidDropoutError
+from server.tests.tests_scanner_management import create_photo, create_form
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_document_management_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def kill_worker(*args) -> None:
+    """Stand in for a page job whose worker process dies."""
+    os._exit(1)
+
+class TestDocumentManagementService(TestCase):
+    """Unit tests for the DocumentManager class."""
+
+    corners = [[310, 140], [1090, 190], [1140, 930], [240, 880]]
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        self.storage_dir = tempfile.mkdtemp()
+        self.manager = DocumentManager(
+            self.storage_dir, max_workers = 2, pages_per_worker = 1)
+        self.photo = create_photo((1400, 1050), self.corners, 'JPEG')
+        log.info("Test setup completed...")
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        log.info("Tearing down test...")
+        self.manager.shutdown()
+        shutil.rmtree(self.storage_dir)
+        log.info("Test teardown completed.")
+        log.info("============================\n")
+
+    def assemble(
+        self, fmt: str, mode: str, photos: list,
+        page_filter: dict = None, dropout: list = None) -> tuple[str, dict]:
+        """Assemble a document of the photos, return its id and progress."""
+
+        doc_id = self.manager.create_document(fmt, mode, page_filter, dropout)
+        for index, photo in enumerate(photos):
+            self.assertEqual(self.manager.add_page(doc_id, photo), index)
+
+        self.manager.assemble(doc_id)
+        progress = self.manager.wait(doc_id, timeout = 60)
+        log.info("Document progress: %s", progress)
+
+        return doc_id, progress
+
+    def test_01_assemble_pdf(self) -> None:
+        """Test assembling a PDF document, skipping an invalid photo."""
+
+        photos = [self.photo, self.photo, b'not an image', self.photo]
+        doc_id, progress = self.assemble(
+            'pdf', 'gray', photos, {'drop_duplicates': False})
+
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['processed'], 4)
+        self.assertEqual(progress['failed'], [2])
+
+        parser = PdfParser.PdfParser(self.manager.output_path(doc_id))
+        self.assertEqual(len(parser.pages), 3)
+        parser.close()
+
+    def test_02_assemble_tiff(self) -> None:
+        """Test assembling a TIFF document in page order."""
+
+        # pages of different sizes tell the order in the file
+        sizes = [(1400, 1050), (700, 525), (1050, 788), (350, 263), (900, 675)]
+        photos = [
+            create_photo(
+                size, np.round(np.array(self.corners) * size[0] / 1400).astype(int),
+                words = seed)
+            for seed, size in enumerate(sizes)
+        ]
+        doc_id, progress = self.assemble('tiff', 'binary', photos)
+
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['failed'], [])
+
+        with Image.open(self.manager.output_path(doc_id)) as image:
+            self.assertEqual(image.n_frames, len(sizes))
+            widths = []
+            for frame in range(image.n_frames):
+                image.seek(frame)
+                self.assertEqual(image.mode, '1')
+                widths.append(image.size[0])
+
+        # the pages are as much larger as their photos
+        self.assertEqual(
+            np.argsort(widths).tolist(),
+            np.argsort([size[0] for size in sizes]).tolist())
+
+    def test_03_invalid_input(self) -> None:
+        """Test the invalid documents."""
+
+        with self.assertRaises(InvalidDocumentFormatError):
+            self.manager.create_document('docx')
+
+        with self.assertRaises(InvalidScanModeError):
+            self.manager.create_document('pdf', 'sepia')
+
+        with self.assertRaises(DocumentNotFoundError):
+            self.manager.progress('missing')
+
+        with self.assertRaises(InvalidPageFilterError):
+            self.manager.create_document('pdf', 'gray', {'blank_area': 0.1})
+
+        with self.assertRaises(InvalidPageFilterError):
+            self.manager.create_document('pdf', 'gray', {'blank_ink': True})
+
+        with self.assertRaises(InvalidDropoutError):
+            self.manager.create_document('pdf', 'color', dropout = [(0, 361)])
+
+        doc_id = self.manager.create_document('pdf')
+        with self.assertRaises(DocumentStateError):
+            self.manager.assemble(doc_id)
+
+        with self.assertRaises(DocumentStateError):
+            self.manager.output_path(doc_id)
+
+        # a document of no valid page fails
+        self.manager.add_page(doc_id, b'not an image')
+        self.manager.assemble(doc_id)
+        with self.assertRaises(DocumentStateError):
+            self.manager.add_page(doc_id, self.photo)
+
+        progress = self.manager.wait(doc_id, timeout = 60)
+        self.assertEqual(progress['status'], 'failed')
+        self.assertIsNotNone(progress['error'])
+
+    def test_04_drop_pages(self) -> None:
+        """Test dropping the blank pages and the pages fed twice."""
+
+        def photo(**kwargs) -> bytes:
+            return create_photo((1400, 1050), self.corners, 'JPEG', **kwargs)
+
+        photos = [
+            photo(words = 1), photo(blank = True), photo(words = 1, noise = 1),
+            photo(words = 2), photo(blank = True, noise = 2), photo(words = 2, noise = 3)
+        ]
+        doc_id, progress = self.assemble('tiff', 'gray', photos)
+
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['processed'], 6)
+        self.assertEqual(progress['blank'], [1, 4])
+        self.assertEqual(progress['duplicates'], [2, 5])
+
+        with Image.open(self.manager.output_path(doc_id)) as image:
+            self.assertEqual(image.n_frames, 2)
+
+        # the checks are set for each document
+        _, progress = self.assemble('tiff', 'gray', photos, {
+            'drop_blank': False, 'duplicate_similarity': 1.01})
+
+        self.assertEqual(progress['blank'], [])
+        self.assertEqual(progress['duplicates'], [])
+
+        # a document of blank pages only has no page left
+        _, progress = self.assemble('pdf', 'gray', [photos[1], photos[4]])
+        self.assertEqual(progress['status'], 'failed')
+
+    def test_05_assemble_color(self) -> None:
+        """Test assembling the color pages of forms."""
+
+        photos = [create_form((1400, 1050), self.corners)] * 2
+        doc_id, progress = self.assemble(
+            'pdf', 'color', photos, {'drop_duplicates': False}, [(330, 30)])
+
+        self.assertEqual(progress['status'], 'done')
+        with open(self.manager.output_path(doc_id), 'rb') as fs:
+            self.assertEqual(fs.read().count(b'/DeviceRGB'), 2)
+
+        doc_id, _ = self.assemble('tiff', 'color', photos[:1])
+        with Image.open(self.manager.output_path(doc_id)) as image:
+            self.assertEqual(image.mode, 'RGB')
+
+    def test_06_document_owner(self) -> None:
+        """Test hiding the documents from the other users."""
+
+        doc_id = self.manager.create_document('pdf', owner = 1)
+        self.manager.add_page(doc_id, self.photo, owner = 1)
+
+        for owner in (2, None):
+            with self.assertRaises(DocumentNotFoundError):
+                self.manager.add_page(doc_id, self.photo, owner = owner)
+
+            with self.assertRaises(DocumentNotFoundError):
+                self.manager.assemble(doc_id, owner = owner)
+
+            with self.assertRaises(DocumentNotFoundError):
+                self.manager.progress(doc_id, owner = owner)
+
+        self.manager.assemble(doc_id, owner = 1)
+        self.assertEqual(self.manager.wait(doc_id, 60, owner = 1)['status'], 'done')
+        self.assertTrue(self.manager.output_path(doc_id, owner = 1).endswith('.pdf'))
+
+        with self.assertRaises(DocumentNotFoundError):
+            self.manager.output_path(doc_id, owner = 2)
+
+    def test_07_sweep_documents(self) -> None:
+        """Test deleting the expired documents with their files."""
+
+        done_id, _ = self.assemble('pdf', 'gray', [self.photo])
+        uploading_id = self.manager.create_document('pdf')
+        self.manager.add_page(uploading_id, self.photo)
+
+        # a folder left by a stopped server
+        orphan = os.path.join(self.storage_dir, 'orphan')
+        os.makedirs(os.path.join(orphan, 'pages'))
+
+        # the documents are kept within the retention time
+        self.assertEqual(self.manager.sweep(), 0)
+        self.assertEqual(len(os.listdir(self.storage_dir)), 3)
+
+        self.manager.shutdown()
+        self.manager = DocumentManager(self.storage_dir, max_workers = 1, retention = 0.0)
+        self.assertEqual(self.manager.sweep(), 3)
+        self.assertEqual(os.listdir(self.storage_dir), [])
+
+        doc_id = self.manager.create_document('pdf')
+        self.manager.add_page(doc_id, self.photo)
+        self.manager.assemble(doc_id)
+        self.manager.sweep()
+
+        # a document being assembled is kept until it is finished
+        self.assertEqual(self.manager.wait(doc_id, timeout = 60)['status'], 'done')
+        self.assertEqual(self.manager.sweep(), 1)
+
+        for doc_id in (done_id, uploading_id, doc_id):
+            with self.assertRaises(DocumentNotFoundError):
+                self.manager.progress(doc_id)
+
+    def test_08_dead_worker(self) -> None:
+        """Test restarting the pool after a worker process dies."""
+
+        with mock.patch('server.services.document_management._sign_page', kill_worker):
+            _, progress = self.assemble('pdf', 'gray', [self.photo])
+
+        self.assertEqual(progress['status'], 'failed')
+
+        # the next document gets a new pool
+        _, progress = self.assemble('pdf', 'gray', [self.photo])
+        self.assertEqual(progress['status'], 'done')
+
+    def test_09_upload_while_assembling(self) -> None:
+        """Test assembling a document while its pages are uploaded."""
+
+        doc_id = self.manager.create_document(
+            'pdf', 'gray', {'drop_duplicates': False})
+        self.manager.add_page(doc_id, self.photo)
+        added = []
+
+        def upload() -> None:
+            for _ in range(3):
+                try:
+                    added.append(self.manager.add_page(doc_id, self.photo))
+                except DocumentStateError:
+                    return
+
+        threads = [threading.Thread(target = upload) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+
+        self.manager.assemble(doc_id)
+        for thread in threads:
+            thread.join()
+
+        # every page counted is complete, the later pages are refused
+        progress = self.manager.wait(doc_id, timeout = 60)
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['failed'], [])
+        self.assertEqual(progress['pages'], len(added) + 1)
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestDocumentManagementService('test_01_assemble_pdf'))
+    suite.addTest(TestDocumentManagementService('test_02_assemble_tiff'))
+    suite.addTest(TestDocumentManagementService('test_03_invalid_input'))
+    suite.addTest(TestDocumentManagementService('test_04_drop_pages'))
+    suite.addTest(TestDocumentManagementService('test_05_assemble_color'))
+    suite.addTest(TestDocumentManagementService('test_06_document_owner'))
+    suite.addTest(TestDocumentManagementService('test_07_sweep_documents'))
+    suite.addTest(TestDocumentManagementService('test_08_dead_worker'))
+    suite.addTest(TestDocumentManagementService('test_09_upload_while_assembling'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
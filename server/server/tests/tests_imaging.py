@@ -0,0 +1,230 @@
+"""Module to unit test the image convolutions."""
+
+import io
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase, TextTestRunner, TestSuite
+import datetime as dt
+import logging
+
+import numpy as np
+from PIL import Image
+
+from server import imaging
+from server.imaging import shared
+from server.imaging.shared import SharedArray, SharedArrayPool, MIN_SEGMENT_SIZE
+from server.services.editor_management import (
+    EditorManager, InvalidFilterError
+)
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_imaging_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def sum_and_close(handle: SharedArray) -> tuple[int, int]:
+    """Sum an array in a worker process, return the sum and
+    the number of segments the worker keeps mapped."""
+
+    pixels = handle.open()
+    total = int(pixels.sum())
+    del pixels
+    handle.close()
+
+    return total, len(shared._attached)
+
+def convolve_naive(img: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """Convolve the image tap by tap, the edges replicated."""
+
+    half_y, half_x = kernel.shape[0] // 2, kernel.shape[1] // 2
+    padded = np.pad(img.astype(np.float64), (
+        (half_y, half_y), (half_x, half_x)), mode = 'edge')
+    out = np.zeros(img.shape)
+
+    for dy in range(kernel.shape[0]):
+        for dx in range(kernel.shape[1]):
+            out += kernel[-1 - dy, -1 - dx] * padded[
+                dy:dy + img.shape[0], dx:dx + img.shape[1]]
+
+    return out
+
+class TestImaging(TestCase):
+    """Unit tests for the imaging module."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 256, (150, 210), dtype = np.uint8)
+        self.kernel = rng.normal(size = (9, 13)).astype(np.float32)
+        log.info("Test setup completed...")
+
+    def test_01_box_blur(self) -> None:
+        """Test the box blur against the window averages."""
+
+        for radius in (0, 1, 6, 40):
+            size = 2 * radius + 1
+            expected = convolve_naive(self.img, np.full((size, size), 1 / size ** 2))
+            blurred = imaging.box_blur(self.img, radius)
+
+            self.assertEqual(blurred.dtype, np.uint8)
+            self.assertLessEqual(np.abs(blurred - expected).max(), 0.5 + 1e-3)
+
+        # past the image size the radius is clamped rather than padding without bound
+        np.testing.assert_array_equal(
+            imaging.box_blur(self.img, 10 ** 6), imaging.box_blur(self.img, 210))
+
+        with self.assertRaises(ValueError):
+            imaging.box_blur(self.img, -1)
+
+    def test_02_gaussian_blur(self) -> None:
+        """Test the approximated Gaussian blur."""
+
+        sigma = 3.0
+        taps = np.arange(-15, 16)
+        kernel = np.exp(-taps ** 2 / (2 * sigma ** 2))
+        kernel /= kernel.sum()
+
+        expected = convolve_naive(self.img, np.outer(kernel, kernel))
+        blurred = imaging.gaussian_blur(self.img.astype(np.float32), sigma)
+
+        self.assertLess(np.abs(blurred - expected).mean(), 0.5)
+
+    def test_03_convolve(self) -> None:
+        """Test the separable, direct and FFT convolutions."""
+
+        img = self.img.astype(np.float32)
+        kernel_y = np.array([1, 4, 6, 4, 1], dtype = np.float32) / 16
+        kernel_x = np.array([-1, 0, 2, 0, 0], dtype = np.float32)
+        separable = np.outer(kernel_y, kernel_x)
+
+        np.testing.assert_allclose(
+            imaging.convolve_separable(img, kernel_y, kernel_x),
+            convolve_naive(img, separable), atol = 1e-3)
+        np.testing.assert_allclose(
+            imaging.convolve(img, separable),
+            convolve_naive(img, separable), atol = 1e-3)
+        np.testing.assert_allclose(
+            imaging.convolve1d(img, kernel_x, axis = 1),
+            convolve_naive(img, kernel_x[None]), atol = 1e-3)
+
+        # small kernels are convolved directly, large ones by FFT
+        small = self.kernel[:5, :5]
+        np.testing.assert_allclose(
+            imaging.convolve(img, small), convolve_naive(img, small), atol = 1e-2)
+        np.testing.assert_allclose(
+            imaging.convolve_fft(img, self.kernel),
+            convolve_naive(img, self.kernel), atol = 1e-2)
+
+        with self.assertRaises(ValueError):
+            imaging.convolve(img, np.ones((4, 3)))
+
+    def test_04_color_image(self) -> None:
+        """Test that the channels of a color image are filtered separately."""
+
+        rng = np.random.default_rng(1)
+        img = rng.integers(0, 256, (60, 70, 3), dtype = np.uint8)
+        blurred = imaging.gaussian_blur(img, 2.0)
+
+        self.assertEqual(blurred.shape, img.shape)
+        for channel in range(3):
+            np.testing.assert_array_equal(
+                blurred[..., channel],
+                imaging.gaussian_blur(np.ascontiguousarray(img[..., channel]), 2.0))
+
+    def test_05_editor_filters(self) -> None:
+        """Test applying the filters by the editor manager."""
+
+        manager = EditorManager()
+        stream = io.BytesIO()
+        Image.fromarray(self.img).save(stream, format = 'PNG')
+
+        blurred = manager.apply_filter(stream.getvalue(), 'blur_box', 2)
+        pixels = np.asarray(Image.open(io.BytesIO(blurred)))
+        np.testing.assert_array_equal(pixels, imaging.box_blur(self.img, 2))
+
+        sharpened = manager.apply_filter(stream.getvalue(), 'sharpen', 1.0)
+        pixels = np.asarray(Image.open(io.BytesIO(sharpened)))
+        self.assertGreater(pixels.std(), self.img.std())
+
+        with self.assertRaises(InvalidFilterError):
+            manager.apply_filter(stream.getvalue(), 'emboss', 1.0)
+
+        # the values beyond the limits would pad the image without bound
+        for name, value in (
+            ('blur_box', -1), ('blur_box', 1e6), ('blur_gaussian', 1e4),
+            ('blur_gaussian', float('nan')), ('sharpen', float('inf'))):
+            with self.assertRaises(InvalidFilterError):
+                manager.apply_filter(stream.getvalue(), name, value)
+
+    def test_06_shared_arrays(self) -> None:
+        """Test allocating the arrays in shared memory."""
+
+        pool = SharedArrayPool(max_cached_bytes = 2 * MIN_SEGMENT_SIZE)
+
+        try:
+            handle = pool.share(self.img)
+            self.assertLess(len(pickle.dumps(handle)), 200)
+
+            # the handle opens the same pixels
+            copy = pickle.loads(pickle.dumps(handle))
+            np.testing.assert_array_equal(copy.open(), self.img)
+            self.assertEqual(pool.used_bytes, MIN_SEGMENT_SIZE)
+
+            # a released segment serves the next array of its size class
+            pool.release(handle)
+            self.assertEqual(pool.cached_bytes, MIN_SEGMENT_SIZE)
+
+            other = pool.allocate((100, 100, 3))
+            self.assertEqual(other.name, handle.name)
+            self.assertEqual((pool.hits, pool.misses), (1, 1))
+
+            with self.assertRaises(ValueError):
+                pool.release(handle)
+
+            # a worker unmaps the segment it is done with
+            with ProcessPoolExecutor(1) as executor:
+                total, attached = executor.submit(sum_and_close, other).result()
+
+            self.assertEqual(total, int(other.open().sum()))
+            self.assertEqual(attached, 0)
+
+            # the segments above the cache limit are unlinked
+            large = pool.allocate((400, 400), np.float32)
+            pool.release(other)
+            pool.release(large)
+            self.assertEqual(pool.cached_bytes, MIN_SEGMENT_SIZE)
+            self.assertEqual(pool.used_bytes, 0)
+        finally:
+            pool.close()
+
+        with self.assertRaises(ValueError):
+            pool.allocate((10, 10))
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestImaging('test_01_box_blur'))
+    suite.addTest(TestImaging('test_02_gaussian_blur'))
+    suite.addTest(TestImaging('test_03_convolve'))
+    suite.addTest(TestImaging('test_04_color_image'))
+    suite.addTest(TestImaging('test_05_editor_filters'))
+    suite.addTest(TestImaging('test_06_shared_arrays'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
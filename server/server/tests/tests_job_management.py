@@ -0,0 +1,285 @@
+"""Module to unit test the job management service."""
+
+import base64
+import shutil
+import tempfile
+from unittest import TestCase, TextTestRunner, TestSuite, mock
+import datetime as dt
+import logging
+import os
+import time
+
+import numpy as np
+
+from server.services.editor_management import EditorManager
+from server.services.job_management import (
+    JobManager, SQLJobStore, JobNotFoundError, InvalidJobKindError, JOB_KINDS
+)
+from server.tests.tests_scanner_management import create_photo
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_job_management_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def kill_worker(params: dict, report) -> dict:
+    """Stand in for a job whose worker process dies."""
+    os._exit(1)
+
+def sleep_job(params: dict, report) -> dict:
+    """Stand in for a long job that reports no progress."""
+    time.sleep(params['delay'])
+    return {}
+
+class TestJobManagementService(TestCase):
+    """Unit tests for the JobManager class."""
+
+    corners = [[310, 140], [1090, 190], [1140, 930], [240, 880]]
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        self.folder = tempfile.mkdtemp()
+
+        # a local SQLite database stands in for the shared job table
+        self.url = "sqlite:///" + os.path.join(self.folder, "jobs.db")
+        self.manager = JobManager(SQLJobStore(self.url), max_workers = 2)
+
+        photo = create_photo((1400, 1050), self.corners, 'JPEG')
+        self.content = "data:image/jpeg;base64," + base64.b64encode(photo).decode("ascii")
+        log.info("Test setup completed...")
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        log.info("Tearing down test...")
+        self.manager.shutdown()
+        shutil.rmtree(self.folder)
+        log.info("Test teardown completed.")
+        log.info("============================\n")
+
+    def test_01_run_jobs(self) -> None:
+        """Test running the jobs in the worker processes."""
+
+        scan_id = self.manager.submit('scan', {'content': self.content, 'mode': 'binary'})
+        filter_id = self.manager.submit('filter', {
+            'content': self.content, 'filter': 'blur_gaussian', 'value': 2.0})
+
+        self.assertIn(self.manager.get(scan_id)['status'], ('queued', 'running', 'done'))
+
+        for job_id in (scan_id, filter_id):
+            job = self.manager.wait(job_id, timeout = 60)
+            log.info("Job %s: %s", job_id, job['status'])
+
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(job['progress'], 1.0)
+            self.assertIsNone(job['error'])
+
+        result = self.manager.get(scan_id)['result']
+        self.assertTrue(result['content'].startswith("data:image/png;base64,"))
+        self.assertEqual(len(result['corners']), 4)
+
+        result = self.manager.get(filter_id)['result']
+        self.assertTrue(result['content'].startswith("data:image/jpeg;base64,"))
+        self.assertEqual(self.manager.pending, 0)
+
+    def test_02_failed_jobs(self) -> None:
+        """Test the jobs failing and the invalid jobs."""
+
+        job_id = self.manager.submit('filter', {'content': self.content, 'filter': 'sepia'})
+        job = self.manager.wait(job_id, timeout = 60)
+
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('sepia', job['error'])
+        self.assertIsNone(job['result'])
+
+        with self.assertRaises(InvalidJobKindError):
+            self.manager.submit('export', {'content': self.content})
+
+        with self.assertRaises(JobNotFoundError):
+            self.manager.get('missing')
+
+    def test_03_watch_job(self) -> None:
+        """Test following the changes of a job."""
+
+        job_id = self.manager.submit('scan', {'content': self.content})
+
+        states = []
+        job = None
+        while job is None or job['status'] not in ('done', 'failed'):
+            job = self.manager.watch(job_id, job, timeout = 60)
+            states.append((job['status'], job['progress']))
+
+        log.info("Job states: %s", states)
+
+        # every change is seen once and the progress never goes back
+        self.assertEqual(states[-1], ('done', 1.0))
+        self.assertEqual(len(states), len(set(states)))
+        self.assertEqual([progress for _, progress in states], sorted(progress for _, progress in states))
+
+        # a finished job is returned at once
+        self.assertEqual(self.manager.watch(job_id, job, timeout = 60), job)
+
+    def test_04_persistent_jobs(self) -> None:
+        """Test keeping the jobs in the table."""
+
+        job_id = self.manager.submit('scan', {'content': self.content})
+        job = self.manager.wait(job_id, timeout = 60)
+        self.manager.shutdown()
+
+        # another server sharing the table sees the finished job
+        self.manager = JobManager(SQLJobStore(self.url), max_workers = 1)
+        self.assertEqual(self.manager.get(job_id), job)
+
+        # the jobs of a stopped server are failed once stale,
+        # the finished jobs are deleted once expired
+        store = SQLJobStore(self.url)
+        past = dt.datetime.now() - dt.timedelta(hours = 2)
+        store.create('lost', 'scan', past)
+        store.dispose()
+
+        self.assertEqual(self.manager.sweep(), (1, 0))
+        self.assertEqual(self.manager.get('lost')['status'], 'failed')
+
+        manager = JobManager(SQLJobStore(self.url), retention = 0.0)
+        self.assertEqual(manager.sweep(), (0, 2))
+        manager.shutdown()
+
+        with self.assertRaises(JobNotFoundError):
+            self.manager.get(job_id)
+
+    def test_05_pixel_jobs(self) -> None:
+        """Test passing the images of the jobs in shared memory."""
+
+        rng = np.random.default_rng(0)
+        image = rng.integers(0, 256, (600, 800, 3), dtype = np.uint8)
+        params = {'filter': 'blur_gaussian', 'value': 2.0}
+        expected = EditorManager().filter_pixels(image, 'blur_gaussian', 2.0)
+
+        job_id = self.manager.submit('filter_pixels', params, image)
+        job = self.manager.wait(job_id, timeout = 60)
+
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'], {'shape': [600, 800, 3]})
+        np.testing.assert_array_equal(self.manager.pixels(job_id), expected)
+
+        # the output is read once and every segment is released for reuse
+        with self.assertRaises(JobNotFoundError):
+            self.manager.pixels(job_id)
+
+        buffers = self.manager.buffers
+        self.assertEqual(buffers.used_bytes, 0)
+        self.assertGreater(buffers.cached_bytes, 0)
+
+        # an image allocated from the pool is passed without a copy
+        source = buffers.allocate(image.shape)
+        source.open()[...] = image
+        job_id = self.manager.submit('filter_pixels', params, source)
+        self.manager.wait(job_id, timeout = 60)
+
+        np.testing.assert_array_equal(self.manager.pixels(job_id), expected)
+        self.assertEqual((buffers.hits, buffers.misses), (2, 2))
+
+        # the images of the failed jobs are released too
+        job_id = self.manager.submit('filter_pixels', {'filter': 'sepia'}, image)
+        self.assertEqual(self.manager.wait(job_id, timeout = 60)['status'], 'failed')
+        self.assertEqual(buffers.used_bytes, 0)
+
+        with self.assertRaises(ValueError):
+            self.manager.submit('filter', params, image)
+
+        with self.assertRaises(ValueError):
+            self.manager.submit('filter_pixels', params)
+
+    def test_06_job_owner(self) -> None:
+        """Test hiding the jobs from the other users."""
+
+        job_id = self.manager.submit('scan', {'content': self.content}, owner = 1)
+        job = self.manager.wait(job_id, timeout = 60, owner = 1)
+        self.assertEqual(job['status'], 'done')
+
+        for owner in (2, None):
+            with self.assertRaises(JobNotFoundError):
+                self.manager.get(job_id, owner)
+
+            with self.assertRaises(JobNotFoundError):
+                self.manager.watch(job_id, owner = owner)
+
+        image = np.zeros((50, 60), dtype = np.uint8)
+        job_id = self.manager.submit(
+            'filter_pixels', {'filter': 'blur_box'}, image, owner = 1)
+        self.manager.wait(job_id, timeout = 60, owner = 1)
+
+        with self.assertRaises(JobNotFoundError):
+            self.manager.pixels(job_id, owner = 2)
+
+        self.assertEqual(self.manager.pixels(job_id, owner = 1).shape, (50, 60))
+
+    def test_07_dead_worker(self) -> None:
+        """Test restarting the pool after a worker process dies."""
+
+        # the forked workers inherit the job kind
+        with mock.patch.dict(JOB_KINDS, {'crash': kill_worker}):
+            job_id = self.manager.submit('crash', {})
+            job = self.manager.wait(job_id, timeout = 60)
+
+        self.assertEqual(job['status'], 'failed')
+
+        # the next job gets a new pool
+        job_id = self.manager.submit('scan', {'content': self.content})
+        self.assertEqual(self.manager.wait(job_id, timeout = 60)['status'], 'done')
+
+    def test_08_live_jobs(self) -> None:
+        """Test failing the stale jobs of the dead servers only."""
+
+        store = SQLJobStore(self.url)
+        now = dt.datetime.now()
+        past = now - dt.timedelta(hours = 2)
+
+        # the jobs of this server are never taken as stale
+        with mock.patch.dict(JOB_KINDS, {'sleep': sleep_job}):
+            job_id = self.manager.submit('sleep', {'delay': 1.0})
+            store.beat([job_id], past)
+
+            # a job of a live server beats, a job of a dead one does not
+            store.create('remote', 'scan', past)
+            store.beat(['remote'], now)
+            store.create('lost', 'scan', past)
+
+            self.assertEqual(self.manager.sweep(), (1, 0))
+            self.assertEqual(self.manager.wait(job_id, timeout = 60)['status'], 'done')
+
+        store.dispose()
+
+        self.assertEqual(self.manager.get('remote')['status'], 'queued')
+        self.assertEqual(self.manager.get('lost')['status'], 'failed')
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestJobManagementService('test_01_run_jobs'))
+    suite.addTest(TestJobManagementService('test_02_failed_jobs'))
+    suite.addTest(TestJobManagementService('test_03_watch_job'))
+    suite.addTest(TestJobManagementService('test_04_persistent_jobs'))
+    suite.addTest(TestJobManagementService('test_05_pixel_jobs'))
+    suite.addTest(TestJobManagementService('test_06_job_owner'))
+    suite.addTest(TestJobManagementService('test_07_dead_worker'))
+    suite.addTest(TestJobManagementService('test_08_live_jobs'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
@@ -0,0 +1,201 @@
+"""Module to unit test the logging pipeline."""
+
+import queue
+import shutil
+import tempfile
+import time
+from unittest import TestCase, TextTestRunner, TestSuite
+import datetime as dt
+import logging
+import os
+
+import yaml
+
+from server.logger import (
+    BatchFileHandler, BatchingQueueListener,
+    DroppingQueueHandler, LoggingPipeline
+)
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_logger_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+class CollectingHandler(logging.Handler):
+    """Keeps the handled records and counts the flushes."""
+
+    def __init__(self, name: str = None) -> None:
+        super().__init__()
+        self.name = name
+        self.records = []
+        self.flushes = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+    @property
+    def messages(self) -> list[str]:
+        """Return the messages of the handled records."""
+        return [record.getMessage() for record in self.records]
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    """Wait until the condition holds, return whether it does."""
+
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    return condition()
+
+class TestLoggingPipeline(TestCase):
+    """Unit tests for the non-blocking logging pipeline."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.pipelines = []
+
+        # a logger of its own, not writing to the log of the tests
+        self.logger = logging.getLogger(f"tests_logger.{self._testMethodName}")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.handler = CollectingHandler("collector")
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        for pipeline in self.pipelines:
+            pipeline.stop()
+
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+        shutil.rmtree(self.folder)
+
+    def create_pipeline(self, **kwargs) -> LoggingPipeline:
+        """Create a pipeline of the logger stopped at the end of the test."""
+
+        pipeline = LoggingPipeline(self.logger, **kwargs)
+        self.pipelines.append(pipeline)
+
+        return pipeline
+
+    def test_01_drop_on_full(self) -> None:
+        """Test dropping and counting the records of a full queue."""
+
+        handler = DroppingQueueHandler(queue.Queue(2))
+        record = self.logger.makeRecord(
+            self.logger.name, logging.INFO, __file__, 0, "message", (), None)
+
+        for _ in range(5):
+            handler.handle(record)
+
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (2, 3))
+
+        # the pipeline reports the dropped records once
+        pipeline = self.create_pipeline(max_queue_size = 2, check_interval = 0.05)
+
+        for i in range(5):
+            self.logger.info("message %d", i)
+
+        self.assertEqual((pipeline.queue_depth, pipeline.dropped), (2, 3))
+
+        pipeline.start()
+        self.assertTrue(wait_for(lambda: any(
+            "3 records dropped" in message for message in self.handler.messages)))
+
+        time.sleep(0.2)
+        self.assertEqual(self.handler.messages, [
+            "message 0", "message 1", "Log queue full: 3 records dropped."])
+
+    def test_02_batch_flushing(self) -> None:
+        """Test flushing the handlers once per batch of records."""
+
+        log_queue = queue.Queue()
+        listener = BatchingQueueListener(log_queue, [self.handler], batch_size = 4)
+
+        for i in range(10):
+            log_queue.put(self.logger.makeRecord(
+                self.logger.name, logging.INFO, __file__, 0, "message %d", (i,), None))
+
+        listener.start()
+        listener.stop()
+
+        self.assertEqual(self.handler.messages, [f"message {i}" for i in range(10)])
+        self.assertEqual(self.handler.flushes, 3)
+
+        # the file handler writes a batch at once
+        path = os.path.join(self.folder, "server.log")
+        file_handler = BatchFileHandler(path)
+
+        try:
+            file_handler.handle(self.handler.records[0])
+            self.assertEqual(os.path.getsize(path), 0)
+
+            file_handler.flush_batch()
+            self.assertGreater(os.path.getsize(path), 0)
+        finally:
+            file_handler.close()
+
+    def test_03_reload_levels(self) -> None:
+        """Test applying the levels of a changed config file."""
+
+        path = os.path.join(self.folder, "logging.yaml")
+
+        def write_config(logger_level: str, handler_level: str) -> None:
+            with open(path, "w", encoding = "utf-8") as fs:
+                yaml.safe_dump({
+                    "loggers": {self.logger.name: {"level": logger_level}},
+                    "handlers": {
+                        "collector": {"level": handler_level},
+                        "missing": {"level": "DEBUG"}
+                    }
+                }, fs)
+
+        write_config("DEBUG", "DEBUG")
+        pipeline = self.create_pipeline(config_path = path, check_interval = 0.05)
+        pipeline.start()
+
+        # a new modification time, even on a coarse file system clock
+        write_config("WARNING", "ERROR")
+        mtime = os.stat(path).st_mtime_ns + 10 ** 9
+        os.utime(path, ns = (mtime, mtime))
+
+        # the handler levels are applied after the logger levels
+        self.assertTrue(wait_for(lambda: self.handler.level == logging.ERROR))
+        self.assertEqual(self.logger.level, logging.WARNING)
+
+        self.logger.warning("below the handler level")
+        self.logger.error("above the handler level")
+        self.assertTrue(wait_for(
+            lambda: "above the handler level" in self.handler.messages))
+
+        self.assertNotIn("below the handler level", self.handler.messages)
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestLoggingPipeline('test_01_drop_on_full'))
+    suite.addTest(TestLoggingPipeline('test_02_batch_flushing'))
+    suite.addTest(TestLoggingPipeline('test_03_reload_levels'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
@@ -0,0 +1,385 @@
+"""Module to unit test the monitoring of the server app."""
+
+import json
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import TestCase, TextTestRunner, TestSuite
+import datetime as dt
+import logging
+import os
+
+from flask import Flask
+
+from server.monitoring import MetricsRegistry, instrument
+from server.monitoring.memory import MemoryTracker
+from server.monitoring.profiling import PROFILE_HEADER, RequestProfiler
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_monitoring_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+class Service:
+    """Stand in for an instrumented service."""
+
+    def scan(self, fail: bool = False) -> str:
+        if fail:
+            raise ValueError("The scan failed!")
+        return "done"
+
+    def pages(self, count: int):
+        for page in range(count):
+            if page == 2:
+                raise ValueError("The page is damaged!")
+            yield page
+
+class TestMetrics(TestCase):
+    """Unit tests for the metrics and their exposition."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.registry = MetricsRegistry()
+
+    def run_threads(self, target, count: int) -> None:
+        """Run the target on the given number of threads and wait for them."""
+
+        threads = [threading.Thread(target = target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_01_merge_shards(self) -> None:
+        """Test summing up the shards of the live threads."""
+
+        counter = self.registry.counter("requests_total", "Requests.", ("route",))
+        histogram = self.registry.histogram(
+            "latency_seconds", "Latency.", buckets = (0.1, 1.0))
+
+        recorded = threading.Barrier(5)
+        collected = threading.Event()
+
+        def record():
+            for _ in range(1000):
+                counter.inc("/scan")
+            histogram.observe(0.5)
+
+            # the threads are alive while the metrics are collected
+            recorded.wait()
+            collected.wait()
+
+        threads = [threading.Thread(target = record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+
+        recorded.wait()
+
+        try:
+            self.assertEqual(counter.value("/scan"), 4000)
+            self.assertEqual(counter.value("/other"), 0)
+            self.assertEqual(histogram.snapshot(), {(): [0, 4, 0, 2.0]})
+        finally:
+            collected.set()
+            for thread in threads:
+                thread.join()
+
+    def test_02_retire_shards(self) -> None:
+        """Test merging the shards of the ended threads."""
+
+        counter = self.registry.counter("requests_total", "Requests.", ("route",))
+
+        self.run_threads(lambda: counter.inc("/scan"), 8)
+        self.run_threads(lambda: counter.inc("/filter", amount = 2), 8)
+
+        # a new thread registers its shard without the lock
+        thread = threading.Thread(target = lambda: counter.inc("/scan"))
+        with counter._lock:
+            thread.start()
+            thread.join(5.0)
+            self.assertFalse(thread.is_alive())
+
+        self.assertEqual(counter.value("/scan"), 9)
+        self.assertEqual(counter.value("/filter"), 16)
+
+        # the shards of the ended threads are not kept
+        counter.inc("/scan")
+        self.assertEqual(counter.value("/scan"), 10)
+        self.assertEqual(len(counter._shards), 1)
+
+    def test_03_exposition_format(self) -> None:
+        """Test the Prometheus text exposition format."""
+
+        counter = self.registry.counter("requests_total", "Requests.", ("route",))
+        histogram = self.registry.histogram(
+            "latency_seconds", "Latency.", ("route",), buckets = (0.1, 1.0))
+        self.registry.gauge("queue_depth", "Queued jobs.", lambda: 3)
+        self.registry.gauge("missing", "Not available.", lambda: None)
+
+        # a metric registered again is the same metric
+        self.assertIs(self.registry.counter("requests_total", "Requests."), counter)
+
+        counter.inc('/a"b')
+        histogram.observe(0.05, "/scan")
+        histogram.observe(0.5, "/scan")
+        histogram.observe(5.0, "/scan")
+
+        self.assertEqual(self.registry.expose(), "\n".join([
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{route="/a\\"b"} 1',
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{route="/scan",le="0.1"} 1',
+            'latency_seconds_bucket{route="/scan",le="1.0"} 2',
+            'latency_seconds_bucket{route="/scan",le="+Inf"} 3',
+            'latency_seconds_sum{route="/scan"} 5.55',
+            'latency_seconds_count{route="/scan"} 3',
+            "# HELP queue_depth Queued jobs.",
+            "# TYPE queue_depth gauge",
+            "queue_depth 3",
+            "# HELP missing Not available.",
+            "# TYPE missing gauge",
+        ]) + "\n")
+
+    def test_04_instrument(self) -> None:
+        """Test timing the calls and counting the errors of a service."""
+
+        histogram = self.registry.histogram(
+            "call_seconds", "Calls.", ("component", "method"))
+        errors = self.registry.counter(
+            "call_errors_total", "Errors.", ("component", "method"))
+        service = instrument(Service(), "scanner", histogram, errors)
+
+        self.assertEqual(service.scan(), "done")
+        with self.assertRaises(ValueError):
+            service.scan(fail = True)
+
+        # a generator is timed over its iteration
+        self.assertEqual(list(service.pages(2)), [0, 1])
+        with self.assertRaises(ValueError):
+            list(service.pages(5))
+
+        calls = {key: sum(counts[:-1])
+                 for key, counts in histogram.snapshot().items()}
+        self.assertEqual(calls, {("scanner", "scan"): 2, ("scanner", "pages"): 2})
+        self.assertEqual(errors.snapshot(), {
+            ("scanner", "scan"): 1, ("scanner", "pages"): 1})
+
+class TestRequestProfiler(TestCase):
+    """Unit tests for the RequestProfiler class."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.profile_dir = os.path.join(self.folder, "profiles")
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+        shutil.rmtree(self.folder)
+
+    def create_app(self, profiler: RequestProfiler) -> Flask:
+        """Create an application profiled by the profiler."""
+
+        app = Flask(__name__)
+        profiler.init_app(app)
+
+        @app.route('/sleep/<int:millis>')
+        def sleep(millis: int):
+            time.sleep(millis / 1000)
+            return 'ok'
+
+        return app
+
+    def test_01_keep_slowest(self) -> None:
+        """Test keeping the profiles of the slowest sampled requests."""
+
+        profiler = RequestProfiler(self.profile_dir, sample_rate = 1.0, max_profiles = 2)
+        client = self.create_app(profiler).test_client()
+
+        for millis in (10, 200, 100, 5):
+            self.assertEqual(client.get(f'/sleep/{millis}').text, 'ok')
+
+        slowest = profiler.slowest()
+        self.assertEqual([meta["path"] for meta in slowest], ['/sleep/200', '/sleep/100'])
+        self.assertEqual(slowest[0]["route"], '/sleep/<int:millis>')
+        self.assertEqual(slowest[0]["trigger"], "sample")
+        self.assertNotIn("top_functions", slowest[0])
+        self.assertEqual(len(profiler.slowest(1)), 1)
+
+        # the profiles of the faster requests are removed
+        base_paths = [os.path.splitext(meta["profile"])[0] for meta in slowest]
+        self.assertEqual(sorted(os.listdir(self.profile_dir)), sorted(
+            os.path.basename(path) + ext
+            for path in base_paths for ext in (".prof", ".json")))
+
+        with open(base_paths[0] + ".json", encoding = "utf-8") as fs:
+            meta = json.load(fs)
+
+        self.assertGreaterEqual(meta["duration"], 0.2)
+        self.assertTrue(any(
+            "sleep" in func["function"] for func in meta["top_functions"]))
+
+    def test_02_admin_header(self) -> None:
+        """Test profiling only the requests carrying the admin token."""
+
+        profiler = RequestProfiler(self.profile_dir, admin_token = "secret")
+        client = self.create_app(profiler).test_client()
+
+        client.get('/sleep/1')
+        client.get('/sleep/1', headers = {PROFILE_HEADER: "guess"})
+        self.assertEqual(profiler.slowest(), [])
+
+        client.get('/sleep/1', headers = {PROFILE_HEADER: "secret"})
+        self.assertEqual(
+            [meta["trigger"] for meta in profiler.slowest()], ["header"])
+
+    def test_03_disabled(self) -> None:
+        """Test leaving the requests alone if nothing is profiled."""
+
+        profiler = RequestProfiler(self.profile_dir)
+        app = self.create_app(profiler)
+
+        self.assertFalse(profiler.enabled)
+        self.assertIs(app.extensions["profiler"], profiler)
+        self.assertEqual(app.test_client().get('/sleep/1').text, 'ok')
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        with self.assertRaises(ValueError):
+            RequestProfiler(self.profile_dir, sample_rate = 1.5)
+
+        with self.assertRaises(ValueError):
+            RequestProfiler(self.profile_dir, max_profiles = 0)
+
+class TestMemoryTracker(TestCase):
+    """Unit tests for the MemoryTracker class."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.registry = MetricsRegistry()
+        self.tracker = MemoryTracker(
+            self.registry, budgets = {"upload": 1024 ** 2}, top_sites = 3)
+        self.tracker.start()
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+        self.tracker.stop()
+
+    def peaks(self) -> dict:
+        """Return the recorded peaks mapped to the scope names."""
+
+        return {
+            key[0]: values[-1]
+            for key, values in self.tracker._peak_bytes.snapshot().items()
+        }
+
+    def test_01_budget_exceeded(self) -> None:
+        """Test recording the peak memory and reporting the exceeded budget."""
+
+        with self.assertLogs("master", logging.WARNING) as logs:
+            with self.tracker.track("upload"):
+                data = bytearray(4 * 1024 ** 2)
+                del data
+
+        # the memory freed within the scope still counts to its peak
+        self.assertGreaterEqual(self.peaks()["upload"], 4 * 1024 ** 2)
+        self.assertEqual(self.tracker._exceeded.snapshot(), {("upload",): 1})
+        self.assertIn("Memory budget exceeded in 'upload'", logs.output[0])
+
+        # the scopes without a budget are only recorded
+        with self.tracker.track("download"):
+            data = bytearray(4 * 1024 ** 2)
+
+        self.assertIn("download", self.peaks())
+        self.assertEqual(self.tracker._exceeded.snapshot(), {("upload",): 1})
+
+        sites = self.tracker._get_last_sites()
+        self.assertTrue(any(
+            scope == "download" and os.path.basename(__file__) in site
+            for scope, site in sites))
+
+    def test_02_nested_scopes(self) -> None:
+        """Test keeping the peak of a nested scope in the enclosing scope."""
+
+        with self.tracker.track("outer"):
+            with self.tracker.track("inner"):
+                data = bytearray(2 * 1024 ** 2)
+                del data
+
+            data = bytearray(64 * 1024)
+
+        peaks = self.peaks()
+        self.assertGreaterEqual(peaks["inner"], 2 * 1024 ** 2)
+        self.assertGreaterEqual(peaks["outer"], peaks["inner"])
+
+    def test_03_track_calls(self) -> None:
+        """Test tracking the method calls and skipping when not tracing."""
+
+        service = self.tracker.track_calls(Service(), "scanner", ("scan",))
+        self.assertEqual(service.scan(), "done")
+        self.assertEqual(list(self.peaks()), ["scanner.scan"])
+
+        # nothing is recorded while the allocations are not traced
+        self.tracker.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+        with self.tracker.track("upload"):
+            data = bytearray(4 * 1024 ** 2)
+
+        self.assertEqual(list(self.peaks()), ["scanner.scan"])
+        self.assertFalse(any(
+            line.startswith("memory_traced_bytes")
+            for line in self.registry.expose().splitlines()))
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestMetrics('test_01_merge_shards'))
+    suite.addTest(TestMetrics('test_02_retire_shards'))
+    suite.addTest(TestMetrics('test_03_exposition_format'))
+    suite.addTest(TestMetrics('test_04_instrument'))
+
+    return suite
+
+
+def create_test_suite_02():
+
+    log.info("Running the test suite 02...")
+    suite = TestSuite()
+    suite.addTest(TestRequestProfiler('test_01_keep_slowest'))
+    suite.addTest(TestRequestProfiler('test_02_admin_header'))
+    suite.addTest(TestRequestProfiler('test_03_disabled'))
+
+    return suite
+
+
+def create_test_suite_03():
+
+    log.info("Running the test suite 03...")
+    suite = TestSuite()
+    suite.addTest(TestMemoryTracker('test_01_budget_exceeded'))
+    suite.addTest(TestMemoryTracker('test_02_nested_scopes'))
+    suite.addTest(TestMemoryTracker('test_03_track_calls'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
+    runner.run(create_test_suite_02())
+    runner.run(create_test_suite_03())
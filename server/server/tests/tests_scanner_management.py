@@ -0,0 +1,370 @@
+"""Module to unit test the scanner management service."""
+
+import io
+import os
+import tempfile
+from unittest import TestCase, TextTestRunner, TestSuite
+import datetime as dt
+import logging
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from server.services.scanner_management import (
+    ScannerManager, InvalidImageError, InvalidScanModeError,
+    PageNotFoundError, InvalidDropoutError, OverlapNotFoundError
+)
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_scanner_management_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def create_photo(
+    size: tuple, corners: list, fmt: str = 'PNG',
+    words: int = None, noise: int = 0, blank: bool = False) -> bytes:
+    """Create a photo of a bright page with lines of
+    text lying on a dark background.
+
+    The lines are split into words and paragraphs of random lengths
+    drawn with the given seed, if set. The noise is drawn with its own seed."""
+
+    image = Image.new('L', size, 60)
+    draw = ImageDraw.Draw(image)
+    draw.polygon([tuple(corner) for corner in corners], fill = 225)
+
+    (left, top), (right, bottom) = np.min(corners, axis = 0), np.max(corners, axis = 0)
+    start, end = left + (right - left) // 4, right - (right - left) // 4
+    words = None if words is None else np.random.default_rng(words)
+
+    for y in range(top + (bottom - top) // 5, bottom - (bottom - top) // 5, 20):
+        if blank:
+            break
+
+        if words is None:
+            draw.line([(start, y), (end, y)], fill = 30, width = 4)
+            continue
+
+        # the paragraphs are separated by empty lines and
+        # their lines end at different lengths
+        if words.random() < 0.2:
+            continue
+
+        x, line_end = start, end - int(words.integers(0, (end - start) // 2))
+        while x < line_end:
+            length = int(words.integers(10, 60))
+            draw.line([(x, y), (min(x + length, line_end), y)], fill = 30, width = 4)
+            x += length + 8
+
+    rng = np.random.default_rng(noise)
+    pixels = np.asarray(image).astype(np.float32) + rng.normal(0, 5, (size[1], size[0]))
+    stream = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(stream, format = fmt)
+
+    return stream.getvalue()
+
+def create_form(size: tuple, corners: list, fmt: str = 'JPEG') -> bytes:
+    """Create a photo of a form printed on yellowish paper, boxes
+    drawn in red and filled in with black lines of text."""
+
+    image = Image.new('RGB', size, (50, 55, 60))
+    draw = ImageDraw.Draw(image)
+    draw.polygon([tuple(corner) for corner in corners], fill = (235, 225, 170))
+
+    (left, top), (right, bottom) = np.min(corners, axis = 0), np.max(corners, axis = 0)
+    left, right = left + (right - left) // 6, right - (right - left) // 6
+
+    for y in range(top + (bottom - top) // 6, bottom - (bottom - top) // 6, 40):
+        draw.rectangle([left, y, right, y + 30], outline = (220, 60, 60), width = 2)
+        draw.line([(left + 10, y + 15), ((left + right) // 2, y + 15)], fill = (25, 25, 30), width = 4)
+
+    rng = np.random.default_rng(0)
+    pixels = np.asarray(image).astype(np.float32) + rng.normal(0, 5, (size[1], size[0], 3))
+    stream = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(stream, format = fmt)
+
+    return stream.getvalue()
+
+def create_drawing(size: tuple, seed: int = 0) -> np.ndarray:
+    """Create a drawing of random lines, circles and boxes."""
+
+    rng = np.random.default_rng(seed)
+    image = Image.new('L', size, 240)
+    draw = ImageDraw.Draw(image)
+
+    for _ in range(150):
+        x, y = int(rng.integers(0, size[0])), int(rng.integers(0, size[1]))
+        radius = int(rng.integers(10, 150))
+        shape = rng.integers(0, 3)
+
+        if shape == 0:
+            draw.line([(x, y), (x + radius, y + int(rng.integers(-150, 150)))], fill = 30, width = 3)
+        elif shape == 1:
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius], outline = 30, width = 2)
+        else:
+            draw.rectangle([x, y, x + radius, y + radius // 2], outline = 30, width = 2)
+
+    return np.asarray(image)
+
+class TestScannerManagementService(TestCase):
+    """Unit tests for the ScannerManager class."""
+
+    corners = [[310, 140], [1090, 190], [1140, 930], [240, 880]]
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        self.manager = ScannerManager()
+        self.photo = create_photo((1400, 1050), self.corners)
+        log.info("Test setup completed...")
+
+    def test_01_detect_page(self) -> None:
+        """Test detecting the page corners."""
+
+        img = self.manager.decode_image(self.photo)
+        corners = self.manager.detect_page(img)
+        error = np.abs(corners - np.array(self.corners)).max()
+        log.info("Largest corner error: %.2f px", error)
+
+        self.assertLess(error, 2.0)
+
+    def test_02_scan_gray(self) -> None:
+        """Test scanning the page in grayscale."""
+
+        page, _ = self.manager.scan(self.photo, 'gray')
+
+        # the page is as large as its longest sides
+        self.assertLess(abs(page.shape[0] - 744), 3)
+        self.assertLess(abs(page.shape[1] - 902), 3)
+
+        # the background does not leak into the page and
+        # the contrast between the ink and the paper is stretched
+        self.assertGreater(np.median(page[:10]), 240)
+        self.assertLess(np.percentile(page, 0.5), 20)
+
+    def test_03_scan_binary(self) -> None:
+        """Test scanning the page in black and white."""
+
+        page, _ = self.manager.scan(self.photo, 'binary')
+
+        self.assertEqual(set(np.unique(page)), {0, 255})
+        ink = np.mean(page == 0)
+        self.assertGreater(ink, 0.01)
+        self.assertLess(ink, 0.3)
+
+    def test_04_warp_page(self) -> None:
+        """Test that mapping a page onto itself keeps the pixels."""
+
+        rng = np.random.default_rng(1)
+        img = rng.integers(0, 256, (120, 160), dtype = np.uint8)
+        corners = np.array([[0, 0], [159, 0], [159, 119], [0, 119]], dtype = np.float64)
+        page = self.manager.warp_page(img, corners, strip_rows = 16)
+
+        np.testing.assert_array_equal(page, img)
+
+    def test_05_invalid_input(self) -> None:
+        """Test scanning invalid input."""
+
+        with self.assertRaises(InvalidScanModeError):
+            self.manager.scan(self.photo, 'sepia')
+
+        with self.assertRaises(InvalidImageError):
+            self.manager.scan(b'not an image')
+
+        with self.assertRaises(PageNotFoundError):
+            self.manager.detect_page(np.zeros((300, 400), dtype = np.uint8))
+
+        # the whole photo is scanned if no page is found
+        blank = create_photo((400, 300), [[0, 0], [1, 0], [1, 1], [0, 1]])
+        page, _ = self.manager.scan(blank)
+        self.assertEqual(page.shape, (300, 400))
+
+    def test_06_adaptive_threshold(self) -> None:
+        """Test binarizing an unevenly lit page."""
+
+        # the page gets darker towards the left, where the paper is
+        # darker than the ink on the right
+        height, width = 600, 800
+        light = 70 + 170 * np.linspace(0, 1, width)[None, :] * np.ones((height, 1))
+        text = np.zeros((height, width), dtype = bool)
+        for y in range(40, 560, 30):
+            for x in range(40, 760, 40):
+                text[y:y + 8, x:x + 25] = True
+
+        rng = np.random.default_rng(2)
+        page = np.where(text, light * 0.45, light) + rng.normal(0, 4, (height, width))
+        page = np.clip(page, 0, 255).astype(np.uint8)
+
+        errors = np.mean((self.manager.clean_page(page, 'binary') == 0) != text)
+        log.info("Global threshold error rate: %.4f", errors)
+        self.assertGreater(errors, 0.1)
+
+        for method in ('sauvola', 'bradley'):
+            binary = self.manager.adaptive_threshold(page, method, window = 31)
+            errors = np.mean((binary == 0) != text)
+            log.info("Adaptive (%s) threshold error rate: %.4f", method, errors)
+
+            self.assertEqual(binary.shape, page.shape)
+            self.assertLess(errors, 0.005)
+
+        with self.assertRaises(InvalidScanModeError):
+            self.manager.adaptive_threshold(page, 'niblack')
+
+    def test_07_deskew(self) -> None:
+        """Test estimating and correcting the skew of the text lines."""
+
+        # words of random lengths on lines of a bright page
+        rng = np.random.default_rng(3)
+        image = Image.new('L', (1240, 1754), 235)
+        draw = ImageDraw.Draw(image)
+        for y in range(150, 1600, 40):
+            x = 120
+            while x < 1050:
+                length = int(rng.integers(20, 120))
+                draw.rectangle([x, y, x + length, y + 14], fill = 25)
+                x += length + 18
+
+        for angle in (0.0, 0.4, -2.5, 6.0):
+            page = np.asarray(image.rotate(
+                angle, resample = Image.BILINEAR, fillcolor = 235))
+            estimate = self.manager.estimate_skew(page)
+            log.info("Skew %.2f estimated as %.3f", angle, estimate)
+
+            self.assertLess(abs(estimate - angle), 0.15)
+
+            straight, found = self.manager.deskew(page)
+            self.assertEqual(found, estimate)
+            self.assertEqual(straight.shape, page.shape)
+
+            # the lines of the straightened page are horizontal again
+            self.assertLess(abs(self.manager.estimate_skew(straight)), 0.15)
+
+        # a page without ink is left alone
+        blank = np.full((400, 300), 235, dtype = np.uint8)
+        self.assertEqual(self.manager.estimate_skew(blank), 0.0)
+        self.assertIs(self.manager.deskew(blank)[0], blank)
+
+    def test_08_page_signature(self) -> None:
+        """Test telling the blank and the repeated pages apart."""
+
+        page = self.manager.sign_page(create_photo((1400, 1050), self.corners, 'JPEG', words = 1))
+        again = self.manager.sign_page(create_photo(
+            (1400, 1050), self.corners, 'JPEG', words = 1, noise = 1))
+        other = self.manager.sign_page(create_photo((1400, 1050), self.corners, 'JPEG', words = 2))
+        blank = self.manager.sign_page(create_photo((1400, 1050), self.corners, 'JPEG', blank = True))
+
+        for name, signature in (('page', page), ('again', again), ('other', other), ('blank', blank)):
+            log.info("Signature of %s: ink %.4f, deviation %.1f, distance %d, similarity %.3f",
+                     name, signature.ink, signature.deviation,
+                     signature.distance(page), signature.similarity(page))
+
+        self.assertTrue(blank.is_blank(0.0003, 3.0))
+        self.assertFalse(page.is_blank(0.0003, 3.0))
+
+        self.assertTrue(again.is_duplicate(page, 256, 0.85))
+        self.assertFalse(other.is_duplicate(page, 256, 0.85))
+        self.assertFalse(blank.is_duplicate(page, 256, 0.85))
+
+    def test_09_whiten_page(self) -> None:
+        """Test turning the colored paper white and dropping the form lines."""
+
+        form = create_form((1400, 1050), self.corners)
+        img = self.manager.decode_image(form, color = True)
+        gray = np.asarray(Image.fromarray(img).convert('L'))
+        raw = self.manager.warp_page(img, self.manager.detect_page(gray))
+
+        def red(page: np.ndarray) -> float:
+            return np.mean(page[..., 0].astype(np.int16) - page[..., 1] > 60)
+
+        def png_size(page: np.ndarray) -> int:
+            return len(self.manager.encode_image(page))
+
+        page, _ = self.manager.scan(form, 'color')
+        self.assertEqual(page.shape, raw.shape)
+        np.testing.assert_array_equal(np.median(page[:20], axis = (0, 1)), [255, 255, 255])
+        self.assertGreater(red(page), 0.02)
+
+        dropped, _ = self.manager.scan(form, 'color', dropout = [(330, 30)])
+        self.assertLess(red(dropped), 0.005)
+
+        # the black ink is kept
+        gray, _ = self.manager.scan(form, 'gray', dropout = [(330, 30)])
+        self.assertEqual(gray.ndim, 2)
+        self.assertGreater(np.mean(gray < 80), 0.02)
+
+        sizes = [png_size(raw), png_size(page), png_size(dropped)]
+        log.info("PNG sizes of the raw, the whitened and the dropped pages: %s", sizes)
+        self.assertLess(sizes[1] * 3, sizes[0])
+        self.assertLess(sizes[2], sizes[1])
+
+        for dropout in ([(0, 400)], [(10, 'red')], [30], 'red', [(True, 30)]):
+            with self.assertRaises(InvalidDropoutError):
+                self.manager.scan(form, 'color', dropout = dropout)
+
+    def test_10_stitch(self) -> None:
+        """Test stitching the overlapping tiles of a drawing."""
+
+        drawing = create_drawing((1500, 1000))
+
+        def encode(tile: np.ndarray) -> bytes:
+            return self.manager.encode_image(np.ascontiguousarray(tile))
+
+        # 3 x 2 tiles overlapping by about a quarter, given in no particular order
+        origins = [(0, 0), (0, 460), (0, 900), (390, 10), (400, 450), (390, 900)]
+        order = [4, 0, 5, 2, 1, 3]
+        tiles = [encode(drawing[y:y + 600, x:x + 600]) for y, x in origins]
+
+        covered = np.zeros(drawing.shape, dtype = bool)
+        for y, x in origins:
+            covered[y:y + 600, x:x + 600] = True
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'canvas.npy')
+            canvas, positions = self.manager.stitch([tiles[i] for i in order], path)
+
+            origins = np.array([origins[i] for i in order])
+            np.testing.assert_array_equal(positions, origins - origins.min(axis = 0))
+            self.assertEqual(canvas.shape, drawing.shape)
+
+            # the tiles blend into the drawing, the corners no tile covers are white
+            np.testing.assert_array_equal(canvas[covered], drawing[covered])
+            self.assertTrue(np.all(canvas[~covered] == 255))
+            self.assertEqual(os.listdir(folder), ['canvas.npy'])
+            del canvas
+
+            # a tile of another drawing overlaps no tile
+            other = encode(create_drawing((500, 600), seed = 1))
+            with self.assertRaises(OverlapNotFoundError):
+                self.manager.stitch(tiles[:2] + [other], path)
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestScannerManagementService('test_01_detect_page'))
+    suite.addTest(TestScannerManagementService('test_02_scan_gray'))
+    suite.addTest(TestScannerManagementService('test_03_scan_binary'))
+    suite.addTest(TestScannerManagementService('test_04_warp_page'))
+    suite.addTest(TestScannerManagementService('test_05_invalid_input'))
+    suite.addTest(TestScannerManagementService('test_06_adaptive_threshold'))
+    suite.addTest(TestScannerManagementService('test_07_deskew'))
+    suite.addTest(TestScannerManagementService('test_08_page_signature'))
+    suite.addTest(TestScannerManagementService('test_09_whiten_page'))
+    suite.addTest(TestScannerManagementService('test_10_stitch'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
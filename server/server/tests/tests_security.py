@@ -1,10 +1,17 @@
 """Module to unit test the server app."""
 
 import datetime as dt
+import io
 import logging
 import os
+import shutil
+import tempfile
 from unittest import TestCase, TextTestRunner, TestSuite
-from security import Credentials, XOREncryptor
+from server.security import (
+    Credentials, CredentialsWatcher, EncryptedStorage,
+    InvalidEncryptedFileError, XOREncryptor
+)
+from server.services.editor_management import EditorManager
 
 # initialize logging for the tests
 tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -96,6 +103,197 @@ class TestSecurityXorEncryptor(TestCase):
                 'password': 1
             }, self.credentials_path)
 
+class TestSecurityXorEncryptorStreams(TestCase):
+    """Unit tests for the bulk and streaming XOR encryption."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.encryptor = XOREncryptor('my_secret_key')
+
+    def reference_encrypt(self, data: bytes) -> bytes:
+        """Encrypt the data byte by byte with the repeated key."""
+
+        key = self.encryptor.key
+        key_repeated = (key * (len(data) // len(key) + 1))[:len(data)]
+        return bytes(a ^ b for a, b in zip(data, key_repeated))
+
+    def encrypt_matches_reference(self):
+        """Test that the bulk encryption matches
+        the byte by byte encryption."""
+
+        for size in (0, 1, 31, 32, 33, 1000, 4097):
+            data = os.urandom(size)
+            self.assertEqual(
+                self.encryptor.encrypt(data),
+                self.reference_encrypt(data)
+            )
+
+    def encrypt_stream_matches_bulk(self):
+        """Test that the streaming encryption matches the
+        bulk encryption for chunks not aligned with the key."""
+
+        data = os.urandom(10000)
+
+        for chunk_size in (1, 7, 32, 100, 20000):
+            dst = io.BytesIO()
+            written = self.encryptor.encrypt_stream(
+                io.BytesIO(data), dst, chunk_size)
+            self.assertEqual(written, len(data))
+            self.assertEqual(dst.getvalue(), self.encryptor.encrypt(data))
+
+    def decrypt_stream_roundtrip(self):
+        """Test that the decrypted stream equals the original data."""
+
+        data = os.urandom(5000)
+        encrypted = io.BytesIO()
+        decrypted = io.BytesIO()
+
+        self.encryptor.encrypt_stream(io.BytesIO(data), encrypted, 64)
+        encrypted.seek(0)
+        self.encryptor.decrypt_stream(encrypted, decrypted, 100)
+
+        self.assertEqual(decrypted.getvalue(), data)
+
+class TestCredentialsWatcher(TestCase):
+    """Unit tests for reloading the changed credentials."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'credentials.enc')
+        self.credentials = Credentials(XOREncryptor('my_secret_key'))
+        self.credentials.store({'user': 'postgres', 'password': 'first'}, self.path)
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        shutil.rmtree(self.folder)
+
+    def replace(self, password: str) -> None:
+        """Replace the credentials file, as a rotation does."""
+
+        path = self.path + '.new'
+        self.credentials.store({'user': 'postgres', 'password': password}, path)
+        os.replace(path, self.path)
+
+    def test_01_reload_changed(self) -> None:
+        """Test reloading the credentials once the file is replaced."""
+
+        applied = []
+        watcher = CredentialsWatcher(self.credentials, self.path, applied.append)
+
+        self.assertTrue(watcher.check())
+        self.assertFalse(watcher.check())
+
+        self.replace('second')
+        self.assertTrue(watcher.check())
+        self.assertEqual([item['password'] for item in applied], ['first', 'second'])
+
+    def test_02_retry_failed_change(self) -> None:
+        """Test applying the credentials again after the change failed."""
+
+        applied = []
+
+        def reconnect(credentials: dict) -> None:
+            if not applied:
+                applied.append(None)
+                raise ConnectionError("The database is not reachable!")
+
+            applied.append(credentials['password'])
+
+        watcher = CredentialsWatcher(self.credentials, self.path, reconnect)
+        self.credentials.load(self.path)
+        self.replace('second')
+
+        with self.assertRaises(ConnectionError):
+            watcher.check()
+
+        # the new credentials are still taken as changed
+        self.assertTrue(self.credentials.changed(self.path))
+        self.assertTrue(watcher.check())
+        self.assertEqual(applied, [None, 'second'])
+
+class TestEncryptedStorage(TestCase):
+    """Unit tests for the files encrypted at rest."""
+
+    data = bytes(range(256)) * 4 + b"tail"
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'image.png')
+
+        # small blocks, so that the ranges span several of them
+        self.storage = EncryptedStorage(XOREncryptor('my_secret_key'), block_size = 64)
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        shutil.rmtree(self.folder)
+
+    def test_01_roundtrip(self) -> None:
+        """Test decrypting the encrypted files."""
+
+        self.assertEqual(self.storage.write(self.path, io.BytesIO(self.data)), len(self.data))
+        self.assertTrue(self.storage.is_encrypted(self.path))
+        self.assertEqual(self.storage.size(self.path), len(self.data))
+
+        with open(self.path, 'rb') as file:
+            stored = file.read()
+
+        self.assertNotIn(self.data[:64], stored)
+
+        decrypted = io.BytesIO()
+        self.assertEqual(self.storage.read(self.path, decrypted), len(self.data))
+        self.assertEqual(decrypted.getvalue(), self.data)
+
+        # every file has its own key
+        other = os.path.join(self.folder, 'other.png')
+        self.storage.write(other, io.BytesIO(self.data))
+
+        with open(other, 'rb') as file:
+            self.assertNotEqual(file.read(), stored)
+
+    def test_02_read_range(self) -> None:
+        """Test decrypting the byte ranges across the block boundaries."""
+
+        self.storage.write(self.path, io.BytesIO(self.data))
+
+        for start, length in [
+            (0, 10), (60, 10), (63, 2), (64, 64),
+            (100, 500), (1020, 100), (len(self.data), 5)]:
+            self.assertEqual(
+                self.storage.read_range(self.path, start, length),
+                self.data[start:start + length])
+
+        with self.assertRaises(ValueError):
+            self.storage.read_range(self.path, -1, 10)
+
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+
+        with self.assertRaises(InvalidEncryptedFileError):
+            self.storage.read_range(self.path, 0, 10)
+
+    def test_03_legacy_plain_files(self) -> None:
+        """Test reading the files saved before the encryption was enabled."""
+
+        manager = EditorManager(storage = self.storage)
+        saved = manager.save_file(self.folder, 'saved.png', self.data)
+        self.assertTrue(self.storage.is_encrypted(saved))
+
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+
+        for path in (saved, self.path):
+            self.assertEqual(manager.file_size(path), len(self.data))
+            self.assertEqual(manager.read_file(path), self.data)
+            self.assertEqual(manager.read_file(path, 60, 10), self.data[60:70])
+            self.assertEqual(manager.read_file(path, 1000), self.data[1000:])
+
 def create_test_suite_01():
 
     print("Running the test suite 01...")
@@ -106,9 +304,41 @@ def create_test_suite_01():
     return suite
 
 
+def create_test_suite_02():
+
+    print("Running the test suite 02...")
+    suite = TestSuite()
+    suite.addTest(TestSecurityXorEncryptorStreams('encrypt_matches_reference'))
+    suite.addTest(TestSecurityXorEncryptorStreams('encrypt_stream_matches_bulk'))
+    suite.addTest(TestSecurityXorEncryptorStreams('decrypt_stream_roundtrip'))
+    return suite
+
+
+def create_test_suite_03():
+
+    print("Running the test suite 03...")
+    suite = TestSuite()
+    suite.addTest(TestCredentialsWatcher('test_01_reload_changed'))
+    suite.addTest(TestCredentialsWatcher('test_02_retry_failed_change'))
+    return suite
+
+
+def create_test_suite_04():
+
+    print("Running the test suite 04...")
+    suite = TestSuite()
+    suite.addTest(TestEncryptedStorage('test_01_roundtrip'))
+    suite.addTest(TestEncryptedStorage('test_02_read_range'))
+    suite.addTest(TestEncryptedStorage('test_03_legacy_plain_files'))
+    return suite
+
+
 # separate test suite for the authenticator
 
 if __name__ == '__main__':
 
     runner = TextTestRunner()
     runner.run(create_test_suite_01())
+    runner.run(create_test_suite_02())
+    runner.run(create_test_suite_03())
+    runner.run(create_test_suite_04())
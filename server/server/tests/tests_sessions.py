@@ -0,0 +1,219 @@
+"""Module to unit test the server-side session store."""
+
+import multiprocessing
+import shutil
+import tempfile
+import time
+from unittest import TestCase, TextTestRunner, TestSuite
+import datetime as dt
+import logging
+import os
+
+from flask import Flask, session
+
+from server.sessions import LRUCache, ServerSessionInterface, SQLSessionBackend
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_sessions_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def use_cache(cache: LRUCache) -> None:
+    """Store an item in the cache, in a forked process."""
+    cache.put("child", 1)
+
+class TestLRUCache(TestCase):
+    """Unit tests for the LRUCache class."""
+
+    def test_01_evict_least_recent(self) -> None:
+        """Test discarding the least recently used items first."""
+
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        # reading an item makes it the most recently used
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.pop("a"))
+        self.assertEqual(cache.remove_if(lambda value: value > 2), ["c"])
+        self.assertEqual(len(cache), 0)
+
+        with self.assertRaises(ValueError):
+            LRUCache(0)
+
+    def test_02_fork(self) -> None:
+        """Test using a cache in a process forked while it was locked."""
+
+        cache = LRUCache(2)
+        child = multiprocessing.get_context("fork").Process(
+            target = use_cache, args = (cache,))
+
+        with cache._lock:
+            child.start()
+
+        child.join(10)
+        if child.is_alive():
+            child.kill()
+
+        self.assertEqual(child.exitcode, 0)
+
+class TestServerSessions(TestCase):
+    """Unit tests for the ServerSessionInterface class."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        self.folder = tempfile.mkdtemp()
+
+        self.backend = SQLSessionBackend(
+            "sqlite:///" + os.path.join(self.folder, "sessions.db"))
+        self.interface = ServerSessionInterface(self.backend, flush_interval = 60.0)
+        self.app = self.create_app(self.interface)
+
+        log.info("Test setup completed...")
+
+    def create_app(self, interface: ServerSessionInterface) -> Flask:
+        """Create an application keeping its sessions by the interface."""
+
+        app = Flask(__name__)
+        app.secret_key = "some_secret_key"
+        app.session_interface = interface
+
+        @app.route('/visit')
+        def visit():
+            session['visits'] = session.get('visits', 0) + 1
+            return str(session['visits'])
+
+        @app.route('/login')
+        def login():
+            interface.regenerate(session)
+            session['user_id'] = 1
+            return 'ok'
+
+        @app.route('/whoami')
+        def whoami():
+            return str(session.get('user_id'))
+
+        return app
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        log.info("Tearing down test...")
+        self.interface.stop()
+        self.backend.dispose()
+        shutil.rmtree(self.folder)
+
+    def test_01_regenerate_on_login(self) -> None:
+        """Test moving the session to a new ID on the login."""
+
+        client = self.app.test_client()
+        client.get('/visit')
+        self.interface.flush()
+
+        cookie = client.get_cookie('session').value
+        self.assertEqual(len(self.backend.list_sessions(None)), 1)
+
+        client.get('/login')
+        self.interface.flush()
+
+        # the session data is kept under the new ID
+        self.assertNotEqual(client.get_cookie('session').value, cookie)
+        self.assertEqual(client.get('/whoami').text, '1')
+        self.assertEqual(client.get('/visit').text, '2')
+
+        # the old ID is no longer valid, not even for the new user
+        other = self.app.test_client()
+        other.set_cookie('session', cookie)
+        self.assertEqual(other.get('/whoami').text, 'None')
+        self.assertEqual(self.backend.list_sessions(None), [])
+
+    def test_02_write_behind(self) -> None:
+        """Test writing the changed sessions to the backend in batches."""
+
+        clients = [self.app.test_client() for _ in range(3)]
+        for client in clients:
+            client.get('/visit')
+        clients[0].get('/visit')
+
+        # the changes are buffered, a session once
+        self.assertEqual(self.interface.pending_writes, 3)
+        self.assertEqual(self.backend.list_sessions(None), [])
+        self.assertEqual(clients[0].get('/visit').text, '3')
+
+        self.interface.flush()
+        self.assertEqual(self.interface.pending_writes, 0)
+        self.assertEqual(len(self.backend.list_sessions(None)), 3)
+
+        # another process sharing the backend sees the sessions
+        other = ServerSessionInterface(self.backend)
+        client = self.create_app(other).test_client()
+        client.set_cookie('session', clients[0].get_cookie('session').value)
+        self.assertEqual(client.get('/visit').text, '4')
+
+    def test_03_expiry(self) -> None:
+        """Test dropping the expired sessions and sweeping them."""
+
+        self.interface = ServerSessionInterface(
+            self.backend, lifetime = dt.timedelta(seconds = 0.3),
+            flush_interval = 60.0)
+        app = self.create_app(self.interface)
+
+        client = app.test_client()
+        client.get('/visit')
+        app.test_client().get('/visit')
+        self.interface.flush()
+        self.assertEqual(client.get('/visit').text, '2')
+
+        time.sleep(0.5)
+
+        # an expired session starts over
+        self.assertEqual(client.get('/visit').text, '1')
+        self.interface.flush()
+
+        self.assertEqual(self.interface.sweep(), 2)
+        self.assertEqual(len(self.interface.cache), 1)
+        self.assertEqual(len(self.backend.list_sessions(None)), 1)
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestServerSessions('test_01_regenerate_on_login'))
+    suite.addTest(TestServerSessions('test_02_write_behind'))
+    suite.addTest(TestServerSessions('test_03_expiry'))
+
+    return suite
+
+
+def create_test_suite_02():
+
+    log.info("Running the test suite 02...")
+    suite = TestSuite()
+    suite.addTest(TestLRUCache('test_01_evict_least_recent'))
+    suite.addTest(TestLRUCache('test_02_fork'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
+    runner.run(create_test_suite_02())
@@ -0,0 +1,180 @@
+"""Module to unit test the storage management service."""
+
+import shutil
+import tempfile
+import time
+from os.path import join, exists
+from unittest import TestCase, TextTestRunner, TestSuite, mock
+import datetime as dt
+import logging
+import os
+
+from server.services.storage_management import FolderReclaimer, ReclaimError
+
+# initialize logging for the tests
+tag = dt.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+log_filename = f"logs/tests_storage_management_{tag}.log"
+
+logging.basicConfig(
+    filename = log_filename,
+    filemode = 'w',
+    level = logging.DEBUG
+)
+
+log = logging.getLogger(__name__)
+
+def create_tree(root: str, files: int, size: int = 100) -> None:
+    """Create a folder with a subfolder and the files split between them."""
+
+    os.makedirs(join(root, "images"))
+
+    for i in range(files):
+        folder = root if i % 2 == 0 else join(root, "images")
+        with open(join(folder, f"{i}.png"), "wb") as stream:
+            stream.write(b"\0" * size)
+
+class TestFolderReclaimer(TestCase):
+    """Unit tests for the FolderReclaimer class."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        log.info("============================")
+        log.info("Setting up new test...")
+        self.folder = tempfile.mkdtemp()
+        self.reclaim_dir = join(self.folder, "reclaim")
+        self.reclaimers = []
+        log.info("Test setup completed...")
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        log.info("Tearing down test...")
+        for reclaimer in self.reclaimers:
+            reclaimer.stop()
+        shutil.rmtree(self.folder)
+
+    def create_reclaimer(self, **kwargs) -> FolderReclaimer:
+        """Create a reclaimer stopped at the end of the test."""
+
+        reclaimer = FolderReclaimer(self.reclaim_dir, **kwargs)
+        self.reclaimers.append(reclaimer)
+
+        return reclaimer
+
+    def wait_empty(self, reclaimer: FolderReclaimer, timeout: float = 10.0) -> None:
+        """Wait until the reclaimer has removed all queued folders."""
+
+        deadline = time.monotonic() + timeout
+        while reclaimer.backlog and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def test_01_queue_folder(self) -> None:
+        """Test moving a queued folder away and removing it."""
+
+        user_folder = join(self.folder, "1")
+        create_tree(user_folder, 6)
+
+        reclaimer = self.create_reclaimer()
+        reclaimer.queue(user_folder)
+
+        # the folder is moved at once, not yet removed
+        self.assertFalse(exists(user_folder))
+        self.assertEqual(len(os.listdir(self.reclaim_dir)), 1)
+        self.assertEqual(reclaimer.backlog, 1)
+
+        # a folder of the same name can be queued again
+        create_tree(user_folder, 2)
+        reclaimer.queue(user_folder)
+        self.assertEqual(len(os.listdir(self.reclaim_dir)), 2)
+
+        with self.assertRaises(ReclaimError):
+            reclaimer.queue(user_folder)
+
+        reclaimer.start()
+        self.wait_empty(reclaimer)
+
+        self.assertEqual(reclaimer.backlog, 0)
+        self.assertEqual(os.listdir(self.reclaim_dir), [])
+        self.assertEqual(reclaimer.removed_files, 12)
+        self.assertEqual(reclaimer.removed_bytes, 800)
+
+    def test_02_throttled_removal(self) -> None:
+        """Test limiting the rate of the removed files and bytes."""
+
+        create_tree(join(self.folder, "1"), 10)
+        reclaimer = self.create_reclaimer(max_files_per_sec = 20)
+        reclaimer.queue(join(self.folder, "1"))
+
+        started = time.monotonic()
+        reclaimer.start()
+        self.wait_empty(reclaimer)
+
+        # the tenth file is removed half a second after the start
+        self.assertEqual(reclaimer.backlog, 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+
+        create_tree(join(self.folder, "2"), 4, size = 1000)
+        reclaimer = self.create_reclaimer(max_bytes_per_sec = 10000)
+        reclaimer.queue(join(self.folder, "2"))
+
+        started = time.monotonic()
+        reclaimer.start()
+        self.wait_empty(reclaimer)
+
+        self.assertEqual(reclaimer.backlog, 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.35)
+
+    def test_03_retry_failed_removal(self) -> None:
+        """Test retrying the removal of a folder that failed."""
+
+        create_tree(join(self.folder, "1"), 2)
+        reclaimer = self.create_reclaimer(retry_interval = 0.1)
+        reclaimer.queue(join(self.folder, "1"))
+
+        remove_tree = reclaimer._remove_tree
+        calls = []
+
+        def fail_once(root: str) -> None:
+            calls.append(root)
+            if len(calls) == 1:
+                raise PermissionError("The folder is in use!")
+            remove_tree(root)
+
+        # no other folder is queued to wake the reclaimer up
+        with mock.patch.object(reclaimer, "_remove_tree", fail_once):
+            reclaimer.start()
+            self.wait_empty(reclaimer)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(reclaimer.backlog, 0)
+        self.assertEqual(os.listdir(self.reclaim_dir), [])
+
+    def test_04_resume_after_restart(self) -> None:
+        """Test removing the folders left over from the previous run."""
+
+        create_tree(join(self.reclaim_dir, "1_0"), 4)
+        reclaimer = self.create_reclaimer()
+        self.assertEqual(reclaimer.backlog, 1)
+
+        reclaimer.start()
+        self.wait_empty(reclaimer)
+
+        self.assertEqual(os.listdir(self.reclaim_dir), [])
+
+def create_test_suite_01():
+
+    log.info("Running the test suite 01...")
+    suite = TestSuite()
+    suite.addTest(TestFolderReclaimer('test_01_queue_folder'))
+    suite.addTest(TestFolderReclaimer('test_02_throttled_removal'))
+    suite.addTest(TestFolderReclaimer('test_03_retry_failed_removal'))
+    suite.addTest(TestFolderReclaimer('test_04_resume_after_restart'))
+
+    return suite
+
+
+if __name__ == '__main__':
+
+    runner = TextTestRunner()
+    runner.run(create_test_suite_01())
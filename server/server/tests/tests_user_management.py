@@ -2,21 +2,29 @@
 
 from os.path import join, dirname, exists
 import os
-from unittest import TestCase, TextTestRunner, TestSuite
+import shutil
+import tempfile
+import time
+from unittest import TestCase, TextTestRunner, TestSuite, mock
 import datetime as dt
 import logging
 
+import sqlalchemy as sqal
 from werkzeug.security import generate_password_hash as gen_hash_func
 from werkzeug.security import check_password_hash as chk_hash_func
 
-from database import Database
-from security import Credentials, XOREncryptor
+from server.database import Database
+from server.security import (
+    Authenticator, Credentials, HS256Algorithm,
+    PasswordHasher, XOREncryptor
+)
+from server.services.storage_management import FolderReclaimer
 from server.services.user_management import (
-    UserManager, InvalidPasswordError,
+    CountingBloomFilter, UserManager, InvalidPasswordError,
     InvalidEmailError, InvalidUsernameError,
     UserAlreadyExistsError, DatabaseError,
     FolderCreationError, UserNotFoundError,
-    InactiveUserError
+    InactiveUserError, ServiceBusyError
 )
 
 # initialize logging for the tests
@@ -31,6 +39,80 @@ logging.basicConfig(
 
 log = logging.getLogger(__name__)
 
+def create_users_table(url: str, legacy: bool = False) -> None:
+    """Create the users table in an SQLite database,
+    without the added columns if it is a legacy table."""
+
+    columns = [sqal.Column("user_deleted_at", sqal.DateTime)]
+
+    engine = sqal.create_engine(url)
+    sqal.Table(
+        "users", sqal.MetaData(),
+        sqal.Column("user_id", sqal.Integer, primary_key = True),
+        sqal.Column("user_name", sqal.String(24), unique = True, nullable = False),
+        sqal.Column("user_email", sqal.String(256), unique = True, nullable = False),
+        sqal.Column("user_password", sqal.String(256), nullable = False),
+        sqal.Column("user_token", sqal.String(512)),
+        sqal.Column("user_registration_date", sqal.DateTime),
+        sqal.Column("user_active", sqal.Boolean, server_default = sqal.true()),
+        sqal.Column("user_locked_until", sqal.DateTime),
+        *([] if legacy else columns)
+    ).create(engine)
+    engine.dispose()
+
+def create_user_manager(
+    folder: str, hasher: PasswordHasher = None,
+    reclaimer: FolderReclaimer = None,
+    legacy: bool = False) -> UserManager:
+    """Create a user manager of an SQLite database in the folder."""
+
+    url = f"sqlite:///{join(folder, 'users.db')}"
+    create_users_table(url, legacy)
+
+    return UserManager(
+        db = Database(None, None, None, None, None, url = url),
+        table = "users",
+        schema = None,
+        uid_column = "user_id",
+        auth = Authenticator("some_secret_key", HS256Algorithm),
+        max_login_tries = 3,
+        login_wnd = 1,
+        login_lock_wnd = 60,
+        hasher = hasher,
+        reclaimer = reclaimer
+    )
+
+def fail_first_call(func, error: Exception):
+    """Return a function that raises the error on its first call
+    and calls the given function afterwards."""
+
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise error
+        return func(*args, **kwargs)
+
+    return wrapper
+
+def slow_hash_func(password: str) -> str:
+    """Hash the password after a delay, as an overloaded worker does."""
+
+    time.sleep(1.0)
+    return gen_hash_func(password)
+
+def kill_worker(password: str) -> str:
+    """Exit the worker process, as the out of memory killer does."""
+    os._exit(1)
+
+def kill_worker_on_first(password: str) -> str:
+    """Exit the worker process hashing the password of the first user."""
+
+    if password.endswith("0"):
+        os._exit(1)
+    return gen_hash_func(password)
+
 class TestUserManagemetService(TestCase):
     """Unit tests for the UserManagementService class."""
 
@@ -435,6 +517,382 @@ class TestUserManagemetService(TestCase):
         log.info("Test OK.")
         log.info("***************************")
 
+class TestPasswordHashing(TestCase):
+    """Unit tests for hashing the passwords on the worker processes."""
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.data_storage = join(self.folder, "users")
+        os.mkdir(self.data_storage)
+
+        self.hasher = PasswordHasher(
+            max_workers = 1, max_pending = 1,
+            iterations = 1000, timeout = 0.5
+        )
+        self.manager = create_user_manager(self.folder, self.hasher)
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        self.hasher.shutdown()
+        self.manager._db.disconnect()
+        shutil.rmtree(self.folder)
+
+    def test_01_hashing_timeout(self) -> None:
+        """Test rejecting the registration when the hash is late."""
+
+        with self.assertRaises(ServiceBusyError):
+            self.manager.register_user(
+                name = "Maria12578",
+                email = "szaroazova@ledvance.com",
+                password = "majka12575h585",
+                create_password_hash = slow_hash_func,
+                data_storage = self.data_storage
+            )
+
+        self.assertFalse(os.listdir(self.data_storage))
+
+        # the late hash still occupies the worker process
+        self.assertEqual(self.hasher.pending, 1)
+
+        with self.assertRaises(ServiceBusyError):
+            self.manager.register_user(
+                name = "Maria12579",
+                email = "szaroazova2@ledvance.com",
+                password = "majka12575h585",
+                create_password_hash = gen_hash_func,
+                data_storage = self.data_storage
+            )
+
+        deadline = time.monotonic() + 10.0
+        while self.hasher.pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(self.hasher.pending, 0)
+
+    def test_02_worker_died(self) -> None:
+        """Test restarting the hashing pool after a worker process died."""
+
+        with self.assertRaises(ServiceBusyError):
+            self.manager.register_user(
+                name = "Maria12578",
+                email = "szaroazova@ledvance.com",
+                password = "majka12575h585",
+                create_password_hash = kill_worker,
+                data_storage = self.data_storage
+            )
+
+        self.assertEqual(self.hasher.pending, 0)
+        self.assertFalse(os.listdir(self.data_storage))
+
+        # the next registration gets a new pool
+        user_id, _ = self.manager.register_user(
+            name = "Maria12578",
+            email = "szaroazova@ledvance.com",
+            password = "majka12575h585",
+            create_password_hash = gen_hash_func,
+            data_storage = self.data_storage
+        )
+
+        self.assertTrue(self.manager.exists_user(user_id))
+
+class TestCountingBloomFilter(TestCase):
+    """Unit tests for the CountingBloomFilter class."""
+
+    def test_01_add_remove(self) -> None:
+        """Test adding and removing the values."""
+
+        bloom = CountingBloomFilter(100)
+        bloom.add("name:Dasa_124")
+        bloom.add("name:Maria12578")
+
+        self.assertIn("name:Dasa_124", bloom)
+        self.assertIn("name:Maria12578", bloom)
+        self.assertNotIn("name:Ludmila", bloom)
+
+        # removing an absent value leaves the others in place
+        bloom.remove("name:Ludmila")
+        self.assertIn("name:Dasa_124", bloom)
+
+        bloom.remove("name:Dasa_124")
+        self.assertNotIn("name:Dasa_124", bloom)
+        self.assertIn("name:Maria12578", bloom)
+
+    def test_02_saturated_counters(self) -> None:
+        """Test keeping the values of the saturated counters."""
+
+        bloom = CountingBloomFilter(1, max_bytes = 1)
+        self.assertEqual((bloom.size, bloom.hash_count), (1, 1))
+
+        # every value shares the single counter
+        for i in range(300):
+            bloom.add(f"name:user{i}")
+
+        for i in range(300):
+            bloom.remove(f"name:user{i}")
+
+        # the counter no longer tells how many values it holds,
+        # so it is not decremented and no value is lost
+        self.assertIn("name:user0", bloom)
+
+    def test_03_false_positive_rate(self) -> None:
+        """Test the rate of the false positive answers."""
+
+        bloom = CountingBloomFilter(10000, error_rate = 0.01)
+
+        for i in range(10000):
+            bloom.add(f"email:user{i}@ledvance.com")
+
+        for i in range(10000):
+            self.assertIn(f"email:user{i}@ledvance.com", bloom)
+
+        false_positives = sum(
+            f"email:other{i}@ledvance.com" in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+
+        # a filter limited in size answers with more false positives
+        small = CountingBloomFilter(10000, error_rate = 0.01, max_bytes = 20000)
+        self.assertEqual(small.size, 20000)
+
+        for i in range(10000):
+            small.add(f"email:user{i}@ledvance.com")
+
+        self.assertGreater(sum(
+            f"email:other{i}@ledvance.com" in small for i in range(20000)
+        ), false_positives)
+
+class TestBatchOperations(TestCase):
+    """Unit tests for the batches of users partly failing."""
+
+    users = [{
+        "name": f"BatchUser{i}",
+        "email": f"batch{i}@ledvance.com",
+        "password": f"batchpass{i}"
+    } for i in range(4)]
+
+    def setUp(self) -> None:
+        """Set up the test."""
+
+        self.folder = tempfile.mkdtemp()
+        self.data_storage = join(self.folder, "users")
+        os.mkdir(self.data_storage)
+
+        # the reclaimer is not started, the queued folders are kept
+        self.reclaimer = FolderReclaimer(join(self.folder, "reclaim"))
+        self.manager = create_user_manager(self.folder, reclaimer = self.reclaimer)
+        self.db = self.manager._db
+
+    def tearDown(self) -> None:
+        """Tear down the test."""
+
+        self.db.disconnect()
+        shutil.rmtree(self.folder)
+
+    def register(self, users: list[dict]) -> list[dict]:
+        """Register the users in batches of two."""
+
+        return self.manager.register_users(
+            users, gen_hash_func, self.data_storage, batch_size = 2)
+
+    def user_names(self) -> list[str]:
+        """Return the names of the stored users."""
+
+        return sorted(name for name, in self.db.iter_records(
+            self.manager.users_table, ["user_name"]))
+
+    def test_01_register_failed_batch(self) -> None:
+        """Test rolling back a batch of users whose tokens are not stored."""
+
+        error = ConnectionError("The database is not reachable!")
+        insert_values = fail_first_call(self.db.insert_values, error)
+
+        with mock.patch.object(self.db, "insert_values", insert_values):
+            results = self.register(self.users)
+
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["failed", "failed", "ok", "ok"])
+        self.assertIn("not reachable", results[0]["error"])
+        self.assertIsNone(results[0]["user_id"])
+        self.assertEqual(self.user_names(), ["BatchUser2", "BatchUser3"])
+
+    def test_02_register_failed_rollback(self) -> None:
+        """Test reporting the accounts left behind by a failed rollback."""
+
+        error = ConnectionError("The database is not reachable!")
+        insert_values = fail_first_call(self.db.insert_values, error)
+        delete_records = fail_first_call(
+            self.db.delete_records, ConnectionError("The database is gone!"))
+
+        with mock.patch.object(self.db, "insert_values", insert_values), \
+             mock.patch.object(self.db, "delete_records", delete_records), \
+             self.assertLogs("master", logging.ERROR) as logs:
+            results = self.register(self.users)
+
+        # the other batches are registered, the failure
+        # reports both the error and the failed rollback
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["failed", "failed", "ok", "ok"])
+        self.assertIn("not reachable", results[0]["error"])
+        self.assertIn("not rolled back: The database is gone!", results[0]["error"])
+        self.assertIsNotNone(results[0]["user_id"])
+        self.assertEqual(len(self.user_names()), 4)
+
+        # the logged rollback error is raised from its cause
+        record = next(rec for rec in logs.records if rec.exc_info)
+        self.assertIsInstance(record.exc_info[1], DatabaseError)
+        self.assertIs(record.exc_info[1].__cause__, error)
+        self.assertIn("The database is gone!", str(record.exc_info[1].__context__))
+
+    def test_03_register_failed_folder(self) -> None:
+        """Test rolling back a user whose data folder is not created."""
+
+        create_folder = self.manager._create_user_data_folder
+
+        def create_user_data_folder(root: str, user_id: int) -> str:
+            if user_id == 2:
+                raise FolderCreationError("The disk is full!")
+            return create_folder(root, user_id)
+
+        with mock.patch.object(
+            self.manager, "_create_user_data_folder", create_user_data_folder):
+            results = self.register(self.users)
+
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["ok", "failed", "ok", "ok"])
+        self.assertIn("The disk is full!", results[1]["error"])
+        self.assertNotIn("BatchUser1", self.user_names())
+        self.assertEqual(sorted(os.listdir(self.data_storage)), ["1", "3", "4"])
+
+    def test_04_deactivate_failed_batch(self) -> None:
+        """Test deactivating the users of the batches that succeed."""
+
+        user_ids = [result["user_id"] for result in self.register(self.users)]
+        error = ConnectionError("The database is not reachable!")
+        update_records = fail_first_call(self.db.update_records, error)
+
+        with mock.patch.object(self.db, "update_records", update_records):
+            results = self.manager.deactivate_users(user_ids + [99], batch_size = 2)
+
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["failed", "failed", "ok", "ok", "failed"])
+        self.assertIn("not reachable", results[0]["error"])
+        self.assertIn("No such user", results[4]["error"])
+
+        records = self.db.get_records(self.manager.users_table, "user_id", user_ids)
+        self.assertEqual(
+            sorted((rec["user_id"], rec["user_active"]) for rec in records),
+            [(1, True), (2, True), (3, False), (4, False)])
+
+    def test_05_delete_failed_batch(self) -> None:
+        """Test deleting the users of the batches that succeed."""
+
+        user_ids = [result["user_id"] for result in self.register(self.users)]
+        error = ConnectionError("The database is not reachable!")
+        update_records = fail_first_call(self.db.update_records, error)
+
+        with mock.patch.object(self.db, "update_records", update_records):
+            results = self.manager.delete_users(
+                user_ids, self.data_storage, batch_size = 2)
+
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["failed", "failed", "ok", "ok"])
+        self.assertIn("not reachable", results[0]["error"])
+        self.assertEqual(
+            [self.manager.exists_user(user_id) for user_id in user_ids],
+            [True, True, False, False])
+        self.assertEqual(sorted(os.listdir(self.data_storage)), ["1", "2"])
+
+        # the deleted users cannot be deleted again
+        results = self.manager.delete_users(user_ids[2:], self.data_storage)
+        self.assertIn("No such user", results[0]["error"])
+
+    def test_06_delete_user(self) -> None:
+        """Test marking a deleted user and queueing the user folder."""
+
+        user_id = self.register(self.users[:1])[0]["user_id"]
+        self.manager.delete_user(user_id, self.data_storage)
+
+        # the record is kept, marked as deleted
+        record = self.db.get_record(self.manager.users_table, "user_id", user_id)
+        self.assertIsNotNone(record["user_deleted_at"])
+        self.assertFalse(record["user_active"])
+        self.assertIsNone(record["user_token"])
+        self.assertFalse(self.manager.exists_user(user_id))
+
+        # the folder waits for the reclaimer
+        self.assertEqual(os.listdir(self.data_storage), [])
+        self.assertEqual(self.reclaimer.backlog, 1)
+
+        with self.assertRaises(UserNotFoundError):
+            self.manager.delete_user(user_id, self.data_storage)
+
+        with self.assertRaises(InvalidUsernameError):
+            self.manager.login_user("BatchUser0", "batchpass0", chk_hash_func)
+
+        # the name and the email remain taken
+        with self.assertRaises(UserAlreadyExistsError):
+            self.manager.register_user(
+                "BatchUser0", "batch0@ledvance.com", "batchpass0",
+                gen_hash_func, self.data_storage)
+
+    def test_07_upgrade_legacy_table(self) -> None:
+        """Test using and upgrading a users table without the added columns."""
+
+        self.db.disconnect()
+        legacy_folder = join(self.folder, "legacy")
+        os.mkdir(legacy_folder)
+        self.manager = create_user_manager(
+            legacy_folder, reclaimer = self.reclaimer, legacy = True)
+        self.db = self.manager._db
+
+        # the users are found before the upgrade
+        user_ids = [result["user_id"] for result in self.register(self.users[:2])]
+        self.assertTrue(self.manager.exists_user(user_ids[0]))
+        self.manager.login_user("BatchUser0", "batchpass0", chk_hash_func)
+        self.assertEqual(
+            [result["status"] for result in self.manager.deactivate_users(user_ids[1:])],
+            ["ok"])
+
+        self.assertEqual(self.manager.upgrade_users_table(), ["user_deleted_at"])
+        self.assertEqual(self.manager.upgrade_users_table(), [])
+
+        # the user is deleted after the upgrade
+        results = self.manager.delete_users(user_ids[:1], self.data_storage)
+        self.assertEqual([result["status"] for result in results], ["ok"])
+        self.assertFalse(self.manager.exists_user(user_ids[0]))
+        self.assertEqual(self.user_names(), ["BatchUser0", "BatchUser1"])
+
+    def test_08_register_failed_hashing(self) -> None:
+        """Test failing the batch whose worker process died."""
+
+        self.db.disconnect()
+        hasher_folder = join(self.folder, "hasher")
+        os.mkdir(hasher_folder)
+        hasher = PasswordHasher(max_workers = 1, iterations = 1000)
+        self.manager = create_user_manager(hasher_folder, hasher, self.reclaimer)
+        self.db = self.manager._db
+
+        try:
+            results = self.manager.register_users(
+                self.users, kill_worker_on_first, self.data_storage, batch_size = 2)
+        finally:
+            hasher.shutdown()
+
+        # the next batch is hashed by a new pool
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["failed", "failed", "ok", "ok"])
+        self.assertIn("hashing the password", results[1]["error"])
+        self.assertIsNone(results[1]["user_id"])
+        self.assertEqual(self.user_names(), ["BatchUser2", "BatchUser3"])
+
 def create_test_suite_01():
 
     log.info("Running the test suite 01...")
@@ -450,7 +908,47 @@ def create_test_suite_01():
     return suite
 
 
+def create_test_suite_02():
+
+    log.info("Running the test suite 02...")
+    suite = TestSuite()
+    suite.addTest(TestPasswordHashing('test_01_hashing_timeout'))
+    suite.addTest(TestPasswordHashing('test_02_worker_died'))
+
+    return suite
+
+
+def create_test_suite_03():
+
+    log.info("Running the test suite 03...")
+    suite = TestSuite()
+    suite.addTest(TestCountingBloomFilter('test_01_add_remove'))
+    suite.addTest(TestCountingBloomFilter('test_02_saturated_counters'))
+    suite.addTest(TestCountingBloomFilter('test_03_false_positive_rate'))
+
+    return suite
+
+
+def create_test_suite_04():
+
+    log.info("Running the test suite 04...")
+    suite = TestSuite()
+    suite.addTest(TestBatchOperations('test_01_register_failed_batch'))
+    suite.addTest(TestBatchOperations('test_02_register_failed_rollback'))
+    suite.addTest(TestBatchOperations('test_03_register_failed_folder'))
+    suite.addTest(TestBatchOperations('test_04_deactivate_failed_batch'))
+    suite.addTest(TestBatchOperations('test_05_delete_failed_batch'))
+    suite.addTest(TestBatchOperations('test_06_delete_user'))
+    suite.addTest(TestBatchOperations('test_07_upgrade_legacy_table'))
+    suite.addTest(TestBatchOperations('test_08_register_failed_hashing'))
+
+    return suite
+
+
 if __name__ == '__main__':
 
     runner = TextTestRunner()
     runner.run(create_test_suite_01())
+    runner.run(create_test_suite_02())
+    runner.run(create_test_suite_03())
+    runner.run(create_test_suite_04())